@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+性能基准测试
+在合成源目录（见 synthetic.py）上测量备份各环节的耗时，结果输出为 JSON，可与保存的基线比较：
+- scan：scan_directory 遍历源目录
+- hash：calculate_directory_hash 计算目录哈希
+- archive：create_compressed_backup 创建压缩备份
+- copy：create_directory_snapshot 创建目录快照
+- list_cold / list_warm：目标目录中有数百个快照时 get_backups_by_type 的耗时（不使用 / 使用进程内缓存）
+- cleanup：同样的目标目录上 cleanup_old_backups 按默认保留策略清理
+
+用法:
+    python benchmarks/run_benchmarks.py --profile smoke --output results.json
+    python benchmarks/run_benchmarks.py --files 100000 --layout wide --sizes tiny --content random
+    python benchmarks/run_benchmarks.py --profile standard --baseline baseline.json --threshold 0.2
+发现超过阈值的退化时返回 2
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime, timedelta
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARK_DIR), 'src'))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from core.scanner import scan_directory, summarize_manifest
+from core.tier_backup import (calculate_directory_hash, create_compressed_backup, get_backups_by_type,
+                              cleanup_old_backups, configure_logging)
+from core.copier import create_directory_snapshot
+from core.catalog import rebuild_catalog, _invalidate_cache
+from synthetic import (TreeSpec, LAYOUTS, SIZE_DISTRIBUTIONS, CONTENT_TYPES, generate_tree, get_spec_name,
+                       validate_spec)
+
+# 结果文件的格式版本
+RESULT_VERSION = 1
+BENCHMARKS = ('scan', 'hash', 'archive', 'copy', 'list_cold', 'list_warm', 'cleanup')
+# 源目录相关的基准（其余基准使用快照目录）
+TREE_BENCHMARKS = ('scan', 'hash', 'archive', 'copy')
+# 默认的退化阈值：中位数比基线慢 20% 以上视为退化
+DEFAULT_THRESHOLD = 0.2
+
+# 预设的测试组合：(源目录列表, 快照数)
+PROFILES = {
+    'smoke': ([TreeSpec(1000, 'balanced', 'small', 'mixed')], 200),
+    'standard': ([
+        TreeSpec(10000, 'wide', 'small', 'mixed'),
+        TreeSpec(10000, 'deep', 'small', 'compressible'),
+        TreeSpec(1000, 'balanced', 'mixed', 'random')
+    ], 500),
+    'large': ([
+        TreeSpec(100000, 'wide', 'small', 'mixed'),
+        TreeSpec(100000, 'deep', 'tiny', 'compressible'),
+        TreeSpec(1000000, 'balanced', 'tiny', 'mixed')
+    ], 1000)
+}
+
+
+def _summarize_runs(runs):
+    """汇总多次运行的耗时"""
+    return {
+        'runs': [round(seconds, 6) for seconds in runs],
+        'min': round(min(runs), 6),
+        'median': round(statistics.median(runs), 6),
+        'max': round(max(runs), 6)
+    }
+
+
+def measure(func, repeat, setup=None):
+    """运行 func repeat 次并返回每次的耗时；setup 在每次运行之前、计时之外执行"""
+    runs = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def _remove(path):
+    """删除上一次运行的输出"""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def build_snapshot_target(target_dir, count):
+    """生成含有 count 个快照的目标目录（约 60% 每小时、25% 每日、15% 每周），登记到快照目录"""
+    if os.path.exists(target_dir):
+        shutil.rmtree(target_dir)
+    now = datetime(2025, 1, 15, 12, 0)
+    counts = {'hourly': count * 60 // 100, 'daily': count * 25 // 100}
+    counts['weekly'] = count - counts['hourly'] - counts['daily']
+    steps = {'hourly': timedelta(hours=1), 'daily': timedelta(days=1), 'weekly': timedelta(days=7)}
+    for backup_type, number in counts.items():
+        for index in range(number):
+            created = now - steps[backup_type] * index
+            timestamp = created.strftime("%Y-%m-%d_%H%M" if backup_type == 'hourly' else "%Y-%m-%d")
+            snapshot = os.path.join(target_dir, backup_type, timestamp)
+            os.makedirs(snapshot)
+            with open(os.path.join(snapshot, 'data.txt'), 'w', encoding='utf-8') as f:
+                f.write(timestamp)
+            with open(os.path.join(snapshot, 'backup_info.json'), 'w', encoding='utf-8') as f:
+                json.dump({'timestamp': timestamp, 'created_at': created.isoformat(), 'type': backup_type,
+                           'directory_hash': f"{backup_type}-{index}", 'file_count': 1,
+                           'total_size': len(timestamp), 'is_symlink': False}, f)
+    rebuild_catalog(target_dir)
+
+
+def bench_tree(spec, work_dir, repeat, selected):
+    """在一个合成源目录上运行源目录相关的基准，返回结果列表"""
+    name = get_spec_name(spec)
+    source_dir = os.path.join(work_dir, 'trees', name)
+    start = time.perf_counter()
+    tree = generate_tree(source_dir, spec)
+    print(f"源目录 {name}: {tree['files']} 个文件, {tree['bytes']} 字节"
+          f"（{'复用已生成的目录' if tree['reused'] else f'生成耗时 {time.perf_counter() - start:.1f} 秒'}）",
+          file=sys.stderr)
+
+    manifest = scan_directory(source_dir)
+    files, size = summarize_manifest(manifest)
+    output = os.path.join(work_dir, 'output', name)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    archive_path = output + '.zip'
+
+    cases = {
+        'scan': lambda: scan_directory(source_dir),
+        'hash': lambda: calculate_directory_hash(source_dir),
+        'archive': lambda: create_compressed_backup(source_dir, archive_path, 6, manifest),
+        'copy': lambda: create_directory_snapshot(source_dir, output, manifest)
+    }
+    # 每次运行之前删除上一次的输出
+    setups = {'archive': lambda: _remove(archive_path), 'copy': lambda: _remove(output)}
+
+    results = []
+    for benchmark in TREE_BENCHMARKS:
+        if benchmark not in selected:
+            continue
+        runs = measure(cases[benchmark], repeat, setup=setups.get(benchmark))
+        result = {
+            'name': f"{benchmark}/{name}",
+            'benchmark': benchmark,
+            'tree': name,
+            'files': files,
+            'bytes': size,
+            'seconds': _summarize_runs(runs)
+        }
+        median = result['seconds']['median']
+        result['files_per_second'] = round(files / median) if median else None
+        result['bytes_per_second'] = round(size / median) if median else None
+        if benchmark == 'archive':
+            result['compression_ratio'] = round(os.path.getsize(archive_path) / size, 4) if size else None
+        results.append(result)
+        print(f"  {result['name']}: 中位数 {median:.3f} 秒", file=sys.stderr)
+    _remove(archive_path)
+    _remove(output)
+    return results
+
+
+def bench_snapshots(count, work_dir, repeat, selected):
+    """在含有 count 个快照的目标目录上运行快照相关的基准，返回结果列表"""
+    template = os.path.join(work_dir, 'snapshots', f"template-{count}")
+    build_snapshot_target(template, count)
+    name = f"snapshots-{count}"
+    target_dir = os.path.join(work_dir, 'snapshots', 'target')
+
+    def fresh_target():
+        _remove(target_dir)
+        shutil.copytree(template, target_dir, symlinks=True)
+        _invalidate_cache(target_dir)
+
+    config = {'max_disk_usage_percent': 100}
+    cases = {
+        'list_cold': (lambda: get_backups_by_type(template), lambda: _invalidate_cache(template)),
+        'list_warm': (lambda: get_backups_by_type(template), lambda: get_backups_by_type(template)),
+        'cleanup': (lambda: cleanup_old_backups(config, target_dir), fresh_target)
+    }
+
+    results = []
+    for benchmark in ('list_cold', 'list_warm', 'cleanup'):
+        if benchmark not in selected:
+            continue
+        func, setup = cases[benchmark]
+        runs = measure(func, repeat, setup=setup)
+        result = {
+            'name': f"{benchmark}/{name}",
+            'benchmark': benchmark,
+            'tree': name,
+            'snapshots': count,
+            'seconds': _summarize_runs(runs)
+        }
+        results.append(result)
+        print(f"  {result['name']}: 中位数 {result['seconds']['median']:.4f} 秒", file=sys.stderr)
+    _remove(target_dir)
+    return results
+
+
+def get_environment():
+    """记录运行环境，便于判断两次结果是否可比"""
+    environment = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count()
+    }
+    try:
+        environment['commit'] = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARK_DIR, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        environment['commit'] = None
+    return environment
+
+
+def run_suite(specs, snapshot_count, work_dir, repeat=3, benchmarks=BENCHMARKS):
+    """运行基准测试，返回结果字典（可直接写入 JSON）"""
+    for spec in specs:
+        validate_spec(spec)
+    unknown = set(benchmarks) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"未知的基准: {', '.join(sorted(unknown))}")
+
+    started = datetime.now()
+    results = []
+    if set(benchmarks) & set(TREE_BENCHMARKS):
+        for spec in specs:
+            results.extend(bench_tree(spec, work_dir, repeat, benchmarks))
+    if snapshot_count and set(benchmarks) - set(TREE_BENCHMARKS):
+        results.extend(bench_snapshots(snapshot_count, work_dir, repeat, benchmarks))
+    return {
+        'version': RESULT_VERSION,
+        'started_at': started.isoformat(),
+        'finished_at': datetime.now().isoformat(),
+        'environment': get_environment(),
+        'repeat': repeat,
+        'trees': {get_spec_name(spec): spec._asdict() for spec in specs},
+        'results': results
+    }
+
+
+def compare_results(current, baseline, threshold=DEFAULT_THRESHOLD):
+    """按名称比较两次结果的耗时中位数，返回比较列表
+
+    每项包含 name、baseline、current（秒）、ratio（当前 / 基线）和 status：
+    regression（慢了超过 threshold）、improvement（快了超过 threshold）、unchanged 或 new（基线中没有）。
+    """
+    baseline_results = {result['name']: result for result in baseline.get('results', [])}
+    comparison = []
+    for result in current['results']:
+        old = baseline_results.get(result['name'])
+        current_seconds = result['seconds']['median']
+        if old is None:
+            comparison.append({'name': result['name'], 'baseline': None, 'current': current_seconds,
+                               'ratio': None, 'status': 'new'})
+            continue
+        old_seconds = old['seconds']['median']
+        ratio = current_seconds / old_seconds if old_seconds else None
+        if ratio is None:
+            status = 'unchanged'
+        elif ratio > 1 + threshold:
+            status = 'regression'
+        elif ratio < 1 - threshold:
+            status = 'improvement'
+        else:
+            status = 'unchanged'
+        comparison.append({'name': result['name'], 'baseline': old_seconds, 'current': current_seconds,
+                           'ratio': round(ratio, 4) if ratio is not None else None, 'status': status})
+    return comparison
+
+
+def build_parser():
+    """构建命令行参数解析器"""
+    parser = argparse.ArgumentParser(description='Tier Backup 性能基准测试')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='smoke', help='预设的测试组合（默认 smoke）')
+    parser.add_argument('--files', type=int, help='自定义源目录的文件数（指定后代替预设组合中的源目录）')
+    parser.add_argument('--layout', choices=sorted(LAYOUTS), default='balanced', help='自定义源目录的目录布局')
+    parser.add_argument('--sizes', choices=sorted(SIZE_DISTRIBUTIONS), default='small', help='自定义源目录的大小分布')
+    parser.add_argument('--content', choices=CONTENT_TYPES, default='mixed', help='自定义源目录的内容类型')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--snapshots', type=int, help='快照相关基准使用的快照数（0 为跳过）')
+    parser.add_argument('--benchmark', action='append', dest='benchmarks', choices=BENCHMARKS,
+                        help='只运行指定的基准（可多次指定）')
+    parser.add_argument('--repeat', type=int, default=3, help='每个基准的运行次数（默认 3，取中位数）')
+    parser.add_argument('--work-dir', help='生成的源目录和输出的存放目录（指定后保留，再次运行时复用已生成的源目录）')
+    parser.add_argument('--output', help='结果 JSON 的输出路径（默认输出到标准输出）')
+    parser.add_argument('--baseline', help='与之比较的基线结果 JSON')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='退化阈值（默认 0.2，即中位数慢 20%% 以上）')
+    return parser
+
+
+def main(argv=None):
+    """命令行主函数，返回进程退出码"""
+    args = build_parser().parse_args(argv)
+    specs, snapshot_count = PROFILES[args.profile]
+    if args.files:
+        specs = [TreeSpec(args.files, args.layout, args.sizes, args.content, args.seed)]
+    if args.snapshots is not None:
+        snapshot_count = args.snapshots
+    # 备份过程的日志只输出警告和错误，避免淹没测试结果
+    configure_logging({'log_level': 'WARNING', 'log_file': ''})
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='tier_backup_bench_')
+    try:
+        report = run_suite(specs, snapshot_count, work_dir, max(1, args.repeat),
+                           tuple(args.benchmarks or BENCHMARKS))
+    except ValueError as e:
+        print(f"错误: {str(e)}")
+        return 1
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    comparison = compare_results(report, baseline, args.threshold)
+    print(f"\n与基线比较（{args.baseline}，阈值 {args.threshold:.0%}）:")
+    for item in comparison:
+        if item['status'] == 'new':
+            print(f"  [new] {item['name']}: {item['current']:.4f} 秒（基线中没有）")
+        else:
+            print(f"  [{item['status']}] {item['name']}: {item['baseline']:.4f} -> {item['current']:.4f} 秒"
+                  f"（x{item['ratio']}）")
+    return 2 if any(item['status'] == 'regression' for item in comparison) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
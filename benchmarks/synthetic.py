@@ -0,0 +1,166 @@
+"""
+合成源目录生成模块
+按参数生成可复现的源目录树，供性能基准测试使用：
+- 文件数：从 1k 到 1M
+- 大小分布：tiny / small / mixed / large
+- 内容：可压缩的文本、随机数据（不可压缩）或两者各半
+- 目录布局：wide（少量目录、每个目录上千个文件）、deep（多层嵌套的目录链）、balanced（扇出 16 的目录树）
+同样的参数和随机种子总是生成同样的文件（路径、大小、内容和修改时间），结果可以在不同运行之间比较
+"""
+
+import os
+import json
+import math
+import random
+import shutil
+from collections import namedtuple
+
+# 生成参数：files 为文件数，layout 为目录布局，sizes 为大小分布，content 为内容类型，seed 为随机种子
+TreeSpec = namedtuple('TreeSpec', ['files', 'layout', 'sizes', 'content', 'seed'])
+TreeSpec.__new__.__defaults__ = ('balanced', 'small', 'mixed', 0)
+
+# 大小分布：[(比例, 最小字节数, 最大字节数)]，区间内按对数均匀分布
+SIZE_DISTRIBUTIONS = {
+    'tiny': [(1.0, 0, 4 * 1024)],
+    'small': [(0.9, 0, 16 * 1024), (0.1, 16 * 1024, 256 * 1024)],
+    'mixed': [(0.70, 0, 16 * 1024), (0.25, 16 * 1024, 1024 * 1024), (0.05, 1024 * 1024, 16 * 1024 * 1024)],
+    'large': [(0.5, 1024 * 1024, 16 * 1024 * 1024), (0.5, 16 * 1024 * 1024, 64 * 1024 * 1024)]
+}
+CONTENT_TYPES = ('compressible', 'random', 'mixed')
+# 目录布局：(每个目录的文件数, 目录链的长度)；链长为 1 时目录直接位于根目录（或扇出 16 的树）下
+LAYOUTS = {
+    'wide': (1000, 1),
+    'deep': (8, 32),
+    'balanced': (64, 1)
+}
+
+# 生成的目录中记录参数的文件，参数一致时直接复用已生成的目录
+SPEC_FILE_NAME = '.synthetic_tree.json'
+# 内容池的大小：文件内容从池中的随机偏移处截取
+POOL_SIZE = 4 * 1024 * 1024
+# 第一个文件的修改时间（秒），之后每个文件加一秒
+BASE_MTIME = 1700000000
+
+_WORDS = ('backup', 'snapshot', 'archive', 'hourly', 'daily', 'weekly', 'retention', 'catalog', 'merkle',
+          'manifest', 'digest', 'throttle', 'restore', 'verify', '备份', '快照', '压缩', '目录', '文件', '哈希')
+
+
+def get_spec_name(spec):
+    """返回生成参数的简短名称，如 balanced-1000-small-mixed"""
+    name = f"{spec.layout}-{spec.files}-{spec.sizes}-{spec.content}"
+    return name if not spec.seed else f"{name}-s{spec.seed}"
+
+
+def validate_spec(spec):
+    """校验生成参数，无效时抛出 ValueError"""
+    if not isinstance(spec.files, int) or spec.files <= 0:
+        raise ValueError(f"文件数必须是正整数: {spec.files}")
+    for value, choices in ((spec.layout, LAYOUTS), (spec.sizes, SIZE_DISTRIBUTIONS), (spec.content, CONTENT_TYPES)):
+        if value not in choices:
+            raise ValueError(f"未知的参数 {value}，可选: {', '.join(choices)}")
+
+
+def _content_pools(rng):
+    """生成可压缩和随机两个内容池"""
+    words = []
+    length = 0
+    while length < POOL_SIZE:
+        word = rng.choice(_WORDS)
+        words.append(word)
+        length += len(word.encode('utf-8')) + 1
+    compressible = ' '.join(words).encode('utf-8')[:POOL_SIZE]
+    random_pool = rng.getrandbits(POOL_SIZE * 8).to_bytes(POOL_SIZE, 'little')
+    return {'compressible': compressible, 'random': random_pool}
+
+
+def _pick_size(rng, distribution):
+    """按大小分布随机取一个文件大小"""
+    point = rng.random()
+    for weight, low, high in distribution:
+        point -= weight
+        if point <= 0:
+            break
+    return int(math.exp(rng.uniform(math.log(low + 1), math.log(high + 1)))) - 1
+
+
+def _directory_path(index, layout):
+    """返回第 index 个目录相对根目录的路径"""
+    _, chain = LAYOUTS[layout]
+    if chain > 1:
+        # 目录链：c<链号>/n/n/...，每条链 chain 层
+        return os.path.join(f"c{index // chain:05d}", *(['n'] * (index % chain)))
+    if layout == 'balanced':
+        # 扇出 16 的目录树
+        parts = []
+        while True:
+            parts.append(f"d{index % 16:x}")
+            index //= 16
+            if not index:
+                break
+        return os.path.join(*reversed(parts))
+    return f"d{index:05d}"
+
+
+def _write_content(path, size, pool, rng):
+    """从内容池的随机偏移处截取 size 字节写入文件，超过池大小时循环截取"""
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining:
+            offset = rng.randrange(POOL_SIZE)
+            chunk = pool[offset:offset + remaining]
+            f.write(chunk)
+            remaining -= len(chunk)
+
+
+def iter_tree_files(spec):
+    """按生成参数依次产出 (相对路径, 大小, 内容类型)，不写入磁盘"""
+    validate_spec(spec)
+    rng = random.Random(f"layout:{spec.seed}")
+    files_per_dir, _ = LAYOUTS[spec.layout]
+    distribution = SIZE_DISTRIBUTIONS[spec.sizes]
+    for index in range(spec.files):
+        directory = _directory_path(index // files_per_dir, spec.layout)
+        size = _pick_size(rng, distribution)
+        content = spec.content if spec.content != 'mixed' else rng.choice(('compressible', 'random'))
+        yield os.path.join(directory, f"f{index:07d}.dat"), size, content
+
+
+def generate_tree(root, spec):
+    """在 root 下生成合成源目录，返回统计字典（files、bytes、directories、reused）
+
+    root 中已有同样参数生成的目录时直接复用；否则清空后重新生成。
+    """
+    validate_spec(spec)
+    spec_path = os.path.join(root, SPEC_FILE_NAME)
+    try:
+        with open(spec_path, encoding='utf-8') as f:
+            saved = json.load(f)
+        if saved['spec'] == spec._asdict():
+            return dict(saved['stats'], reused=True)
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.makedirs(root)
+
+    pools = _content_pools(random.Random(f"content:{spec.seed}"))
+    rng = random.Random(f"data:{spec.seed}")
+    directories = set()
+    total_bytes = 0
+    for index, (rel_path, size, content) in enumerate(iter_tree_files(spec)):
+        directory = os.path.join(root, os.path.dirname(rel_path))
+        if directory not in directories:
+            os.makedirs(directory, exist_ok=True)
+            directories.add(directory)
+        path = os.path.join(root, rel_path)
+        _write_content(path, size, pools[content], rng)
+        mtime = BASE_MTIME + index
+        os.utime(path, (mtime, mtime))
+        total_bytes += size
+
+    stats = {'files': spec.files, 'bytes': total_bytes, 'directories': len(directories)}
+    # 参数文件以点开头，备份时和其他隐藏文件一样被排除
+    with open(spec_path, 'w', encoding='utf-8') as f:
+        json.dump({'spec': spec._asdict(), 'stats': stats}, f, indent=2)
+    return dict(stats, reused=False)
@@ -20,13 +20,6 @@ else
     exit 1
 fi
 
-# 检查 rsync 是否可用
-if ! command -v rsync &> /dev/null; then
-    echo "错误: 未找到 rsync 命令"
-    echo "macOS 通常内置 rsync，如果缺失请安装: brew install rsync"
-    exit 1
-fi
-
 # 检查配置文件是否存在
 if [ ! -f "config/back_config.json" ]; then
     echo "错误: 未找到 config/back_config.json 配置文件"
@@ -37,7 +30,6 @@ fi
 # 运行备份脚本
 echo "启动备份脚本..."
 echo "Python 版本: $($PYTHON_CMD --version)"
-echo "rsync 版本: $(rsync --version | head -n1)"
 echo "当前时间: $(date)"
 echo "----------------------------------------"
 
@@ -3,5 +3,8 @@
 """
 
 from .tier_backup import main, create_backup, cleanup_old_backups
+from .catalog import rebuild_catalog
+from .restore import restore_snapshot
+from .scrub import scrub_target
 
-__all__ = ['main', 'create_backup', 'cleanup_old_backups'] 
\ No newline at end of file
+__all__ = ['main', 'create_backup', 'cleanup_old_backups', 'rebuild_catalog', 'restore_snapshot', 'scrub_target']
@@ -0,0 +1,360 @@
+"""
+压缩包写入模块
+在线程池中并行压缩各个成员，并按文件清单顺序写入 ZIP，结果仍是标准 ZIP 文件。
+zlib 压缩时会释放 GIL，因此线程池即可用满多核；大文件按块并行压缩（与 pigz 相同的做法）。
+未变化的文件可直接从上一个压缩包中原样复制已压缩的数据，无需重新压缩
+"""
+
+import os
+import json
+import time
+import zlib
+import struct
+import logging
+import zipfile
+import tempfile
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .codec import choose_codec, add_codec_stats, summarize_codec_stats
+from .throttle import UNLIMITED
+
+# 读取文件时的块大小
+CHUNK_SIZE = 1024 * 1024
+# 单个成员压缩结果在内存中缓存的上限，超过后写入临时文件
+SPOOL_LIMIT = 4 * 1024 * 1024
+# 超过此大小的文件按块并行压缩
+LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+# 大文件并行压缩时每块的大小
+BLOCK_SIZE = 4 * 1024 * 1024
+# deflate 的窗口大小，用上一块的末尾作为下一块的预置字典
+DICT_SIZE = 32 * 1024
+
+# 压缩包内记录各文件大小、修改时间和 CRC 的清单成员
+MANIFEST_NAME = 'backup_manifest.json'
+
+# 工作线程压缩一个成员的结果；data 为已定位到开头的临时文件对象
+CompressedMember = namedtuple('CompressedMember', ['data', 'crc', 'file_size', 'compress_size', 'compress_type', 'seconds'])
+
+
+def get_compression_workers(workers=None):
+    """获取压缩线程数，未配置时使用全部 CPU 核心"""
+    if workers:
+        return max(1, int(workers))
+    return os.cpu_count() or 1
+
+
+def make_zipinfo(entry):
+    """根据文件清单条目构造 ZipInfo"""
+    date_time = time.localtime(entry.mtime_ns // 1000000000)[:6]
+    if date_time[0] < 1980:
+        # ZIP 格式不支持 1980 年以前的时间
+        date_time = (1980, 1, 1, 0, 0, 0)
+
+    zinfo = zipfile.ZipInfo(entry.path, date_time)
+    zinfo.external_attr = (entry.mode & 0xFFFF) << 16
+    # 预先给出文件大小，zipfile 据此决定是否使用 ZIP64
+    zinfo.file_size = entry.size
+    return zinfo
+
+
+def compress_file(path, compression_level, policy=None, compress_type=None, throttle=UNLIMITED):
+    """读取并压缩整个文件（在工作线程中执行）
+
+    未指定 compress_type 时，按压缩策略根据扩展名和文件开头的数据选择压缩算法。
+    读取按 throttle 限速，读完后提示内核丢弃源文件的页缓存。返回 CompressedMember。
+    """
+    start = time.perf_counter()
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_LIMIT)
+    crc = 0
+    file_size = 0
+
+    with open(path, 'rb') as f:
+        throttle.open_source(f.fileno())
+        try:
+            chunk = f.read(CHUNK_SIZE)
+            throttle.read(len(chunk))
+            if compress_type is None:
+                compress_type = choose_codec(path, chunk, policy)
+            compressor = zipfile._get_compressor(compress_type, compression_level)
+
+            while chunk:
+                crc = zlib.crc32(chunk, crc)
+                file_size += len(chunk)
+                spool.write(compressor.compress(chunk) if compressor else chunk)
+                chunk = f.read(CHUNK_SIZE)
+                if chunk:
+                    throttle.read(len(chunk))
+        finally:
+            throttle.release_source(f.fileno())
+
+    if compressor:
+        spool.write(compressor.flush())
+
+    compress_size = spool.tell()
+    spool.seek(0)
+    return CompressedMember(spool, crc, file_size, compress_size, compress_type, time.perf_counter() - start)
+
+
+def _deflate_block(data, compression_level, zdict, final):
+    """压缩大文件中的一块，返回原始 deflate 数据
+
+    非最后一块以 Z_SYNC_FLUSH 结束（按字节对齐），各块拼接后即为一个完整的 deflate 流。
+    """
+    if zdict:
+        compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -15, 8, zlib.Z_DEFAULT_STRATEGY, zdict)
+    else:
+        compressor = zlib.compressobj(compression_level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def write_raw_member(zipf, zinfo, data_file, throttle=UNLIMITED):
+    """将已压缩好的成员数据写入 ZIP
+
+    zinfo 中的 CRC、compress_size、file_size 和 compress_type 必须已经正确设置。
+    """
+    if zinfo.compress_type == zipfile.ZIP_LZMA:
+        # LZMA 数据包含结束标记
+        zinfo.flag_bits |= 0x02
+    zinfo.header_offset = zipf.fp.tell()
+    zipf._writecheck(zinfo)
+    zipf._didModify = True
+    zipf.fp.write(zinfo.FileHeader())
+    if data_file is not None:
+        while True:
+            data = data_file.read(throttle.chunk_size(CHUNK_SIZE))
+            if not data:
+                break
+            zipf.fp.write(data)
+            throttle.write(len(data))
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = zipf.fp.tell()
+
+
+def copy_raw_member(src_fp, src_zinfo, zipf, zinfo, throttle=UNLIMITED):
+    """从另一个压缩包原样复制成员的已压缩数据，不解压也不重新压缩"""
+    src_fp.seek(src_zinfo.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, src_fp.read(zipfile.sizeFileHeader))
+    if header[0] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"本地文件头损坏: {src_zinfo.filename}")
+    # 跳过本地文件头中的文件名和扩展字段
+    src_fp.seek(header[10] + header[11], os.SEEK_CUR)
+
+    zinfo.compress_type = src_zinfo.compress_type
+    zinfo.CRC = src_zinfo.CRC
+    zinfo.file_size = src_zinfo.file_size
+    zinfo.compress_size = src_zinfo.compress_size
+    write_raw_member(zipf, zinfo, None)
+
+    remaining = src_zinfo.compress_size
+    while remaining > 0:
+        chunk = src_fp.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f"成员数据不完整: {src_zinfo.filename}")
+        zipf.fp.write(chunk)
+        throttle.copy(len(chunk))
+        remaining -= len(chunk)
+    zipf.start_dir = zipf.fp.tell()
+
+
+def write_manifest_member(zipf, manifest, digests=None):
+    """把文件清单（大小、纳秒修改时间、CRC）写入压缩包，供下次备份判断文件是否变化
+
+    digests 为 {成员名: 内容摘要}（按内容检测变化时），摘要作为每项的第四个元素写入。
+    """
+    infos = zipf.NameToInfo
+    files = {}
+    for entry in manifest:
+        zinfo = infos.get(entry.path.replace(os.sep, '/'))
+        if zinfo is not None:
+            files[zinfo.filename] = [entry.size, entry.mtime_ns, zinfo.CRC]
+            if digests and zinfo.filename in digests:
+                files[zinfo.filename].append(digests[zinfo.filename])
+    zipf.writestr(MANIFEST_NAME, json.dumps({'version': 1, 'files': files}, separators=(',', ':')))
+
+
+def read_manifest_member(zipf):
+    """读取压缩包中的文件清单，返回 {成员名: [大小, 修改时间纳秒, CRC(, 内容摘要)]}；旧版本压缩包返回空字典"""
+    if MANIFEST_NAME not in zipf.NameToInfo:
+        return {}
+    return json.loads(zipf.read(MANIFEST_NAME).decode('utf-8')).get('files', {})
+
+
+def _write_large_member(zipf, pool, path, zinfo, compression_level, window, throttle=UNLIMITED):
+    """按块并行压缩大文件并写入 ZIP
+
+    先写入占位的本地文件头，数据写完后回到头部补写 CRC 和大小（与 zipfile 的做法相同）。
+    """
+    zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.CRC = 0
+    zinfo.compress_size = 0
+    zinfo.header_offset = zipf.fp.tell()
+    zipf._writecheck(zinfo)
+    zipf._didModify = True
+    zipf.fp.write(zinfo.FileHeader(zip64))
+
+    crc = 0
+    file_size = 0
+    compress_size = 0
+    pending = deque()
+
+    def write_block(future):
+        nonlocal compress_size
+        data = future.result()
+        zipf.fp.write(data)
+        throttle.write(len(data))
+        compress_size += len(data)
+
+    with open(path, 'rb') as f:
+        throttle.open_source(f.fileno())
+        try:
+            zdict = None
+            block = f.read(BLOCK_SIZE)
+            throttle.read(len(block))
+            while block:
+                next_block = f.read(BLOCK_SIZE)
+                if next_block:
+                    throttle.read(len(next_block))
+                crc = zlib.crc32(block, crc)
+                file_size += len(block)
+                pending.append(pool.submit(_deflate_block, block, compression_level, zdict, not next_block))
+                zdict = block[-DICT_SIZE:]
+                block = next_block
+                if len(pending) >= window:
+                    write_block(pending.popleft())
+        finally:
+            throttle.release_source(f.fileno())
+
+    if not pending:
+        # 空文件（扫描后被截断）也需要一个合法的 deflate 流
+        pending.append(pool.submit(_deflate_block, b'', compression_level, None, True))
+    while pending:
+        write_block(pending.popleft())
+
+    if not zip64 and (file_size > zipfile.ZIP64_LIMIT or compress_size > zipfile.ZIP64_LIMIT):
+        raise RuntimeError(f"文件在备份过程中变大，超出 ZIP64 限制: {zinfo.filename}")
+
+    zinfo.CRC = crc
+    zinfo.file_size = file_size
+    zinfo.compress_size = compress_size
+
+    # 回到本地文件头补写 CRC 和大小
+    end = zipf.fp.tell()
+    zipf.fp.seek(zinfo.header_offset)
+    zipf.fp.write(zinfo.FileHeader(zip64))
+    zipf.fp.seek(end)
+
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = end
+
+
+def write_archive(zipf, source_dir, manifest, compression_level=6, workers=None, reuse_from=None, policy=None,
+                  digests=None, throttle=UNLIMITED, tracer=None):
+    """按文件清单把源目录并行压缩写入已打开的 ZipFile
+
+    成员在线程池中并行压缩，写入顺序与清单一致；同时在途的成员数量有上限，内存占用有界。
+    reuse_from 为上一个压缩快照的路径：大小和修改时间都未变化的文件直接原样复制其已压缩数据
+    （连同 CRC），只有变化的文件才重新压缩。
+    policy 为 codec.load_codec_policy() 返回的压缩策略，为每个成员选择压缩算法；
+    为 None 时全部使用 DEFLATED。
+    digests 为 {成员名: 内容摘要}（按内容检测变化时）：只有上一个压缩包中记录的摘要也一致的成员才会复用，
+    摘要同时写入包内的文件清单。
+    throttle 为 throttle.IOThrottle，限制读取源文件和写入压缩包的带宽和 IOPS。
+    tracer 为 profiling.SlowFileTracer，记录压缩超过阈值的文件。
+
+    返回统计字典：compressed（压缩的文件数）、reused（复用的文件数）、reused_bytes（复用的原始字节数）、
+    codecs（按压缩算法统计的字节数、耗时以及节省的空间和时间）。
+    """
+    workers = get_compression_workers(workers)
+    window = workers * 2
+    stats = {'compressed': 0, 'reused': 0, 'reused_bytes': 0}
+    compress, write_large_member = compress_file, _write_large_member
+    if tracer is not None:
+        compress = tracer.wrap('compress', compress_file)
+        write_large_member = tracer.wrap('compress', _write_large_member, 2)
+    codec_stats = {}
+
+    prev_zipf = None
+    prev_files = {}
+    if reuse_from:
+        try:
+            prev_zipf = zipfile.ZipFile(reuse_from, 'r')
+            prev_files = read_manifest_member(prev_zipf)
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            logging.warning(f"无法读取上一个压缩快照，全部重新压缩: {reuse_from}, 错误: {str(e)}")
+            prev_files = {}
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+
+            def write_next():
+                zinfo, future = pending.popleft()
+                if future is None:
+                    copy_raw_member(prev_zipf.fp, prev_zipf.NameToInfo[zinfo.filename], zipf, zinfo, throttle)
+                    logging.debug(f"复用上一个压缩包中的成员: {zinfo.filename}")
+                    return
+                member = future.result()
+                with member.data:
+                    zinfo.compress_type = member.compress_type
+                    zinfo.CRC = member.crc
+                    zinfo.file_size = member.file_size
+                    zinfo.compress_size = member.compress_size
+                    write_raw_member(zipf, zinfo, member.data, throttle)
+                add_codec_stats(codec_stats, member.compress_type, member.file_size, member.compress_size,
+                                member.seconds)
+                logging.debug(f"添加文件到压缩包: {zinfo.filename}")
+
+            for entry in manifest:
+                zinfo = make_zipinfo(entry)
+                path = os.path.join(source_dir, entry.path)
+
+                prev = prev_files.get(zinfo.filename)
+                prev_zinfo = prev_zipf.NameToInfo.get(zinfo.filename) if prev else None
+                if prev_zinfo is not None and prev[0] == entry.size and prev[1] == entry.mtime_ns \
+                        and prev[2] == prev_zinfo.CRC and prev_zinfo.file_size == entry.size \
+                        and (digests is None or prev[3:4] == [digests.get(zinfo.filename)]):
+                    # 未变化的文件：按顺序原样复制上一个压缩包中的数据
+                    pending.append((zinfo, None))
+                    stats['reused'] += 1
+                    stats['reused_bytes'] += entry.size
+                elif entry.size >= LARGE_FILE_THRESHOLD:
+                    # 大文件：先读取开头的样本选择压缩算法
+                    with open(path, 'rb') as f:
+                        sample = f.read(BLOCK_SIZE)
+                    throttle.read(len(sample))
+                    compress_type = choose_codec(path, sample, policy)
+                    stats['compressed'] += 1
+                    if compress_type != zipfile.ZIP_DEFLATED:
+                        pending.append((zinfo, pool.submit(compress, path, compression_level, policy,
+                                                           compress_type, throttle)))
+                    else:
+                        # DEFLATED：先按顺序写完之前的成员，再按块并行压缩
+                        while pending:
+                            write_next()
+                        start = time.perf_counter()
+                        write_large_member(zipf, pool, path, zinfo, compression_level, window, throttle)
+                        add_codec_stats(codec_stats, zipfile.ZIP_DEFLATED, zinfo.file_size, zinfo.compress_size,
+                                        time.perf_counter() - start)
+                        logging.debug(f"添加大文件到压缩包: {zinfo.filename}")
+                        continue
+                else:
+                    pending.append((zinfo, pool.submit(compress, path, compression_level, policy, None,
+                                                       throttle)))
+                    stats['compressed'] += 1
+
+                if len(pending) >= window:
+                    write_next()
+
+            while pending:
+                write_next()
+    finally:
+        if prev_zipf is not None:
+            prev_zipf.close()
+
+    write_manifest_member(zipf, manifest, digests)
+    stats['codecs'] = summarize_codec_stats(codec_stats)
+    return stats
@@ -0,0 +1,311 @@
+"""
+快照目录（catalog）模块
+在目标目录下维护一个 SQLite 快照索引，记录每个快照的类型、时间、哈希、大小等信息，
+避免每次运行都重新打开所有 backup_info.json 和 ZIP 文件
+"""
+
+import os
+import json
+import sqlite3
+import logging
+import zipfile
+from contextlib import closing
+from datetime import datetime
+
+# 目标目录下存放内部状态（快照目录等）的隐藏目录
+STATE_DIR_NAME = '.tier_backup'
+CATALOG_FILE_NAME = 'catalog.db'
+
+BACKUP_TYPES = ('hourly', 'daily', 'weekly')
+
+# 进程内的快照记录缓存：{目标目录: (数据库文件的修改时间和大小, 记录列表)}
+# 守护进程多次运行之间保持有效；本进程写入时清除，其他进程写入时按文件状态失效
+_snapshot_cache = {}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    compressed INTEGER NOT NULL DEFAULT 0,
+    hash TEXT,
+    size INTEGER,
+    file_count INTEGER,
+    is_symlink INTEGER NOT NULL DEFAULT 0,
+    symlink_target TEXT,
+    source_size INTEGER,
+    unique_size INTEGER,
+    PRIMARY KEY (type, name)
+)
+"""
+
+# 旧版本快照目录中缺少的列：(列名, 类型)
+_ADDED_COLUMNS = (('source_size', 'INTEGER'), ('unique_size', 'INTEGER'))
+
+
+def get_state_dir(target_dir):
+    """获取（并创建）目标目录下的内部状态目录"""
+    state_dir = os.path.join(target_dir, STATE_DIR_NAME)
+    os.makedirs(state_dir, exist_ok=True)
+    return state_dir
+
+
+def get_catalog_path(target_dir):
+    """获取快照目录数据库文件路径"""
+    return os.path.join(target_dir, STATE_DIR_NAME, CATALOG_FILE_NAME)
+
+
+def _connect(target_dir):
+    """打开快照目录数据库，必要时创建表结构"""
+    conn = sqlite3.connect(os.path.join(get_state_dir(target_dir), CATALOG_FILE_NAME), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute(_SCHEMA)
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(snapshots)")}
+    for column, column_type in _ADDED_COLUMNS:
+        if column not in columns:
+            conn.execute(f"ALTER TABLE snapshots ADD COLUMN {column} {column_type}")
+    return conn
+
+
+def _catalog_stamp(target_dir):
+    """返回快照目录数据库文件的 (修改时间, 大小)，用于判断缓存是否失效"""
+    try:
+        st = os.stat(get_catalog_path(target_dir))
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _invalidate_cache(target_dir):
+    """清除目标目录的快照记录缓存"""
+    _snapshot_cache.pop(os.path.abspath(target_dir), None)
+
+
+def _split_backup_path(target_dir, backup_path):
+    """将备份路径拆分为 (类型, 名称)，路径不在目标目录下时返回 (None, None)"""
+    rel_path = os.path.relpath(os.path.abspath(backup_path), os.path.abspath(target_dir))
+    parts = rel_path.split(os.sep)
+    if len(parts) != 2 or parts[0] not in BACKUP_TYPES:
+        return None, None
+    return parts[0], parts[1]
+
+
+def _row_to_backup(target_dir, row):
+    """将数据库记录转换为备份信息字典"""
+    return {
+        'path': os.path.join(target_dir, row['type'], row['name']),
+        'type': row['type'],
+        'timestamp': row['timestamp'],
+        'created_at': row['created_at'],
+        'compressed': bool(row['compressed']),
+        'is_symlink': bool(row['is_symlink']),
+        'hash': row['hash'] or '',
+        'size': row['size'],
+        'file_count': row['file_count'],
+        'symlink_target': row['symlink_target'],
+        'source_size': row['source_size'],
+        'unique_size': row['unique_size']
+    }
+
+
+def _insert_snapshot(conn, target_dir, backup):
+    """在已打开的连接中写入一条快照记录"""
+    backup_type, name = _split_backup_path(target_dir, backup['path'])
+    if not backup_type:
+        logging.warning(f"备份路径不在目标目录中，跳过登记: {backup['path']}")
+        return
+
+    conn.execute(
+        "INSERT OR REPLACE INTO snapshots "
+        "(type, name, timestamp, created_at, compressed, hash, size, file_count, is_symlink, symlink_target, "
+        "source_size, unique_size) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            backup_type,
+            name,
+            backup.get('timestamp', ''),
+            backup.get('created_at', ''),
+            int(bool(backup.get('compressed', False))),
+            backup.get('hash', ''),
+            backup.get('size'),
+            backup.get('file_count'),
+            int(bool(backup.get('is_symlink', False))),
+            backup.get('symlink_target'),
+            backup.get('source_size'),
+            backup.get('unique_size')
+        )
+    )
+
+
+def record_snapshot(target_dir, backup):
+    """在快照目录中登记（或更新）一个快照"""
+    _invalidate_cache(target_dir)
+    try:
+        with closing(_connect(target_dir)) as conn, conn:
+            _insert_snapshot(conn, target_dir, backup)
+    except sqlite3.Error as e:
+        logging.error(f"登记快照失败: {backup['path']}, 错误: {str(e)}")
+
+
+def remove_snapshot(target_dir, backup_path):
+    """从快照目录中移除一个快照"""
+    remove_snapshots(target_dir, [backup_path])
+
+
+def remove_snapshots(target_dir, backup_paths):
+    """在一个事务中从快照目录中批量移除快照"""
+    keys = [key for key in (_split_backup_path(target_dir, path) for path in backup_paths) if key[0]]
+    if not keys:
+        return
+
+    _invalidate_cache(target_dir)
+    try:
+        with closing(_connect(target_dir)) as conn, conn:
+            conn.executemany("DELETE FROM snapshots WHERE type = ? AND name = ?", keys)
+    except sqlite3.Error as e:
+        logging.error(f"移除快照记录失败: {backup_paths}, 错误: {str(e)}")
+
+
+def list_snapshots(target_dir, backup_type=None):
+    """列出快照目录中的快照（按时间戳从旧到新排序）
+
+    快照目录不存在时会先从磁盘重建；已被外部删除的快照会自动从目录中移除。
+    记录缓存在进程内，数据库未变化时不再重新查询。
+    """
+    if not os.path.exists(get_catalog_path(target_dir)):
+        rebuild_catalog(target_dir)
+
+    key = os.path.abspath(target_dir)
+    stamp = _catalog_stamp(target_dir)
+    cached = _snapshot_cache.get(key)
+    if cached and cached[0] == stamp:
+        records = cached[1]
+    else:
+        with closing(_connect(target_dir)) as conn:
+            rows = conn.execute("SELECT * FROM snapshots ORDER BY timestamp, created_at").fetchall()
+        records = [_row_to_backup(target_dir, row) for row in rows]
+        _snapshot_cache[key] = (stamp, records)
+
+    backups = []
+    missing = []
+    for record in records:
+        if backup_type and record['type'] != backup_type:
+            continue
+        # 返回副本，调用方修改不影响缓存
+        backup = dict(record)
+        if os.path.lexists(backup['path']):
+            backups.append(backup)
+        else:
+            missing.append(backup['path'])
+
+    for backup_path in missing:
+        logging.warning(f"快照已不存在，从快照目录中移除: {backup_path}")
+        remove_snapshot(target_dir, backup_path)
+
+    return backups
+
+
+def read_snapshot_info(item_path, backup_type):
+    """从磁盘上的快照读取元数据，返回备份信息字典；无法识别时返回 None"""
+    name = os.path.basename(item_path)
+    is_symlink = os.path.islink(item_path)
+    info = None
+
+    if os.path.isdir(item_path):
+        # 目录备份
+        info_file = os.path.join(item_path, 'backup_info.json')
+        if os.path.exists(info_file):
+            with open(info_file, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        compressed = False
+    elif name.endswith('.zip') and os.path.isfile(item_path):
+        # 压缩备份
+        with zipfile.ZipFile(item_path, 'r') as zipf:
+            if 'backup_info.json' in zipf.namelist():
+                info = json.loads(zipf.read('backup_info.json').decode('utf-8'))
+        compressed = True
+    else:
+        return None
+
+    if not info:
+        return None
+
+    # 层级以快照所在的目录为准：层级提升的软链接和共享硬链接的压缩包、数据移交后的快照，
+    # 以及旧版本写穿的元数据中记录的是其他层级
+
+    # 时间戳以快照名称为准：旧版本的软链接备份会把元数据写穿到目标快照中
+    backup = {
+        'path': item_path,
+        'type': backup_type,
+        'timestamp': name[:-4] if compressed else name,
+        'created_at': info.get('created_at', ''),
+        'compressed': compressed,
+        'is_symlink': is_symlink,
+        'hash': info.get('directory_hash', ''),
+        'size': info.get('total_size'),
+        'file_count': info.get('file_count'),
+        'symlink_target': None,
+        'source_size': info.get('total_size'),
+        'unique_size': None
+    }
+
+    if is_symlink:
+        # 软链接快照读到的是目标快照的元数据，创建时间以链接本身为准
+        backup['symlink_target'] = os.readlink(item_path)
+        backup['created_at'] = datetime.fromtimestamp(os.lstat(item_path).st_mtime).isoformat()
+        backup['size'] = 0
+        backup['unique_size'] = 0
+    elif not compressed:
+        backup['size'] = backup['size'] if backup['size'] is not None else get_path_size(item_path)
+    else:
+        st = os.stat(item_path)
+        backup['size'] = st.st_size
+        backup['unique_size'] = st.st_size if st.st_nlink == 1 else None
+
+    return backup
+
+
+def get_path_size(path):
+    """计算快照占用的字节数（软链接按 0 计算）"""
+    if os.path.islink(path):
+        return 0
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    total_size = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                total_size += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                continue
+    return total_size
+
+
+def rebuild_catalog(target_dir):
+    """扫描磁盘上的所有快照，重建快照目录，返回登记的快照数量"""
+    backups = []
+    for backup_type in BACKUP_TYPES:
+        type_dir = os.path.join(target_dir, backup_type)
+        if not os.path.isdir(type_dir):
+            continue
+
+        for item in sorted(os.listdir(type_dir)):
+            item_path = os.path.join(type_dir, item)
+            try:
+                backup = read_snapshot_info(item_path, backup_type)
+            except Exception as e:
+                logging.warning(f"读取备份信息失败: {item_path}, 错误: {str(e)}")
+                continue
+            if backup:
+                backups.append(backup)
+
+    _invalidate_cache(target_dir)
+    with closing(_connect(target_dir)) as conn, conn:
+        conn.execute("DELETE FROM snapshots")
+        for backup in backups:
+            _insert_snapshot(conn, target_dir, backup)
+
+    logging.info(f"快照目录重建完成: {target_dir}, 共 {len(backups)} 个快照")
+    return len(backups)
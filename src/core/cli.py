@@ -0,0 +1,237 @@
+"""
+命令行入口
+兼容旧用法 `tier_backup.py [配置文件]`，支持 `--daemon` 常驻运行，并提供维护类子命令
+"""
+
+import os
+import sys
+import argparse
+from datetime import datetime
+
+from .tier_backup import main as run_backup, load_config, configure_logging
+from .jobs import load_jobs
+from .catalog import BACKUP_TYPES, rebuild_catalog
+from .restore import restore_snapshot
+from .history import get_file_history, find_version_snapshot, rebuild_history
+from .scrub import scrub_target, is_report_clean
+from .daemon import run_daemon
+
+DEFAULT_CONFIG_FILE = os.path.join('config', 'back_config.json')
+
+# 子命令列表；第一个参数不是子命令时按 `run` 处理，保持旧用法可用
+COMMANDS = ('run', 'rebuild-catalog', 'restore', 'history', 'verify', 'scrub')
+
+
+def build_parser():
+    """构建命令行参数解析器"""
+    parser = argparse.ArgumentParser(
+        prog='tier_backup.py',
+        description='Tier Backup - 智能分层备份解决方案'
+    )
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help='执行一次分层备份（默认命令）')
+    run_parser.add_argument('config', nargs='?', default=DEFAULT_CONFIG_FILE, help='配置文件路径')
+    run_parser.add_argument('--daemon', action='store_true', help='以守护进程方式常驻运行，按内部计划执行各层级备份')
+    run_parser.add_argument('--profile', action='store_true',
+                            help='剖析本次运行（按配置中的 profiling 设置，默认用 cProfile 剖析整个运行），'
+                                 '结果写入运行报告旁的 profiles/ 目录')
+
+    rebuild_parser = subparsers.add_parser('rebuild-catalog', help='从磁盘上的快照重建快照目录')
+    rebuild_parser.add_argument('config', nargs='?', default=DEFAULT_CONFIG_FILE, help='配置文件路径')
+
+    restore_parser = subparsers.add_parser('restore', help='从快照中恢复文件')
+    restore_parser.add_argument('config', nargs='?', default=DEFAULT_CONFIG_FILE, help='配置文件路径')
+    restore_parser.add_argument('--dest', required=True, help='恢复到的目录')
+    restore_parser.add_argument('--snapshot', help='快照名称（如 2025-01-15_0900 或 daily/2025-01-15），默认最新的快照')
+    restore_parser.add_argument('--type', choices=BACKUP_TYPES, help='只在该层级中查找快照')
+    restore_parser.add_argument('--path', action='append', dest='patterns', metavar='GLOB',
+                                help='只恢复匹配的路径（相对快照根目录，可多次指定；目录匹配其中的全部文件）')
+    restore_parser.add_argument('--version', type=int,
+                                help='按历史索引恢复 --path 指定文件的第 N 个版本（1 为最新，见 history 命令）')
+    restore_parser.add_argument('--job', help='配置了多个备份任务时，从该任务的目标目录恢复')
+    restore_parser.add_argument('--workers', type=int, help='并行解压或复制的线程数')
+    restore_parser.add_argument('--link', action='store_true',
+                                help='目录快照直接硬链接到快照中的文件（最快，但修改恢复的文件会同时修改快照）')
+
+    history_parser = subparsers.add_parser('history', help='列出一个文件在各快照中的版本')
+    history_parser.add_argument('path', help='相对源目录的文件路径')
+    history_parser.add_argument('config', nargs='?', default=DEFAULT_CONFIG_FILE, help='配置文件路径')
+    history_parser.add_argument('--job', help='配置了多个备份任务时，查询该任务的目标目录')
+
+    verify_parser = subparsers.add_parser('verify', aliases=['scrub'], help='校验已有快照的完整性')
+    verify_parser.add_argument('config', nargs='?', default=DEFAULT_CONFIG_FILE, help='配置文件路径')
+    verify_parser.add_argument('--job', help='配置了多个备份任务时，只校验该任务的目标目录')
+    verify_parser.add_argument('--workers', type=int, help='并行读取的线程数')
+    verify_parser.add_argument('--rate', type=int, dest='bytes_per_second', metavar='BYTES',
+                               help='每秒最多读取的字节数')
+    verify_parser.add_argument('--max-bytes', type=int, metavar='BYTES',
+                               help='本次运行最多读取的字节数，未校验的快照留到下次运行')
+    verify_parser.add_argument('--report', help='校验报告的输出路径（默认为目标目录下的 .tier_backup/scrub_report.json）')
+    verify_parser.add_argument('--restart', action='store_true', help='忽略上次的进度，重新开始一轮校验')
+
+    return parser
+
+
+def load_cli_config(config_file):
+    """加载配置文件，并按其中的日志设置配置日志"""
+    config = load_config(config_file)
+    configure_logging(config)
+    return config
+
+
+def get_job_config(config, job_name=None):
+    """返回指定名称的备份任务配置；未指定时要求配置中只有一个任务，否则抛出 ValueError"""
+    jobs = load_jobs(config)
+    if job_name:
+        for name, job_config in jobs:
+            if name == job_name:
+                return job_config
+        raise ValueError(f"没有名为 {job_name} 的备份任务")
+    if len(jobs) > 1:
+        raise ValueError(f"配置了多个备份任务，请用 --job 指定: {', '.join(name for name, _ in jobs)}")
+    return jobs[0][1]
+
+
+def cmd_rebuild_catalog(args):
+    """重建快照目录（配置了多个备份任务时逐个重建各任务的目标目录）"""
+    config = load_cli_config(args.config)
+    try:
+        jobs = load_jobs(config)
+    except ValueError as e:
+        print(f"错误: {str(e)}")
+        return 1
+
+    for name, job_config in jobs:
+        target_dir = job_config.get('target_directory', '')
+        if not target_dir:
+            print(f"错误: 备份任务 {name} 的目标目录未配置")
+            return 1
+
+        count = rebuild_catalog(target_dir)
+        print(f"快照目录重建完成: {target_dir}, 共 {count} 个快照")
+        rebuild_history(target_dir)
+    return 0
+
+
+def cmd_restore(args):
+    """从快照中恢复文件"""
+    config = load_cli_config(args.config)
+    try:
+        target_dir = get_job_config(config, args.job).get('target_directory', '')
+    except ValueError as e:
+        print(f"错误: {str(e)}")
+        return 1
+    if not target_dir:
+        print("错误: 目标目录未配置")
+        return 1
+
+    snapshot = args.snapshot
+    if args.version is not None:
+        if not args.patterns or len(args.patterns) != 1 or args.snapshot:
+            print("错误: --version 需要且只能与一个 --path 一起使用，且不能同时指定 --snapshot")
+            return 1
+        snapshot = find_version_snapshot(target_dir, args.patterns[0], args.version)
+        if snapshot is None:
+            print(f"错误: 历史索引中没有 {args.patterns[0]} 的第 {args.version} 个版本")
+            return 1
+
+    try:
+        stats = restore_snapshot(target_dir, args.dest, snapshot, args.type, args.patterns, args.workers,
+                                 args.link)
+    except (OSError, ValueError) as e:
+        print(f"错误: {str(e)}")
+        return 1
+
+    print(f"已从 {stats['snapshot']} 恢复 {stats['files']} 个文件 ({stats['bytes']} 字节) 到 {args.dest}, "
+          f"耗时 {stats['seconds']} 秒")
+    return 0 if stats['files'] or not args.patterns else 1
+
+
+def cmd_history(args):
+    """列出一个文件在各快照中的版本（从新到旧）"""
+    config = load_cli_config(args.config)
+    try:
+        target_dir = get_job_config(config, args.job).get('target_directory', '')
+    except ValueError as e:
+        print(f"错误: {str(e)}")
+        return 1
+    if not target_dir:
+        print("错误: 目标目录未配置")
+        return 1
+
+    versions = get_file_history(target_dir, args.path)
+    if not versions:
+        print(f"没有找到 {args.path} 的历史版本")
+        return 1
+
+    for number, version in enumerate(versions, 1):
+        mtime = datetime.fromtimestamp(version['mtime_ns'] / 1e9).isoformat(sep=' ', timespec='seconds')
+        print(f"版本 {number}: 大小 {version['size']} 字节, 修改时间 {mtime}, 哈希 {version['hash'] or '-'}")
+        for snapshot in version['snapshots']:
+            print(f"    {os.path.relpath(snapshot, target_dir)}")
+    return 0
+
+
+def cmd_verify(args):
+    """校验快照的完整性；发现损坏、悬空软链接或未登记的快照时返回 2"""
+    config = load_cli_config(args.config)
+    try:
+        jobs = [(args.job, get_job_config(config, args.job))] if args.job else load_jobs(config)
+    except ValueError as e:
+        print(f"错误: {str(e)}")
+        return 1
+
+    clean = True
+    for name, job_config in jobs:
+        scrub_config = job_config.get('scrub', {})
+        target_dir = job_config.get('target_directory', '')
+        if not target_dir:
+            print(f"错误: 备份任务 {name} 的目标目录未配置")
+            return 1
+
+        report_path = args.report
+        if report_path and len(jobs) > 1:
+            root, ext = os.path.splitext(report_path)
+            report_path = f"{root}-{name}{ext}"
+        report = scrub_target(
+            target_dir,
+            workers=args.workers or scrub_config.get('workers'),
+            bytes_per_second=args.bytes_per_second or scrub_config.get('bytes_per_second'),
+            max_bytes=args.max_bytes or scrub_config.get('max_bytes_per_run'),
+            report_path=report_path,
+            restart=args.restart
+        )
+        summary = report['summary']
+        print(f"{target_dir}: 正常 {summary['ok']}, 损坏 {summary['corrupt']}, 悬空软链接 {summary['dangling']}, "
+              f"未登记 {summary['unregistered']}, 本轮剩余 {report['remaining']} 个快照")
+        for result in report['snapshots']:
+            if result['status'] != 'ok':
+                print(f"    [{result['status']}] {os.path.relpath(result['path'], target_dir)}")
+                for error in result['errors'][:10]:
+                    print(f"        {error}")
+        clean = clean and is_report_clean(report)
+    return 0 if clean else 2
+
+
+def main(argv=None):
+    """命令行主函数"""
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ('-h', '--help')):
+        argv.insert(0, 'run')
+
+    args = build_parser().parse_args(argv)
+
+    if args.command == 'rebuild-catalog':
+        return cmd_rebuild_catalog(args)
+    if args.command == 'restore':
+        return cmd_restore(args)
+    if args.command == 'history':
+        return cmd_history(args)
+    if args.command in ('verify', 'scrub'):
+        return cmd_verify(args)
+
+    if args.daemon:
+        return run_daemon(args.config, profile=args.profile)
+
+    return run_backup(args.config, args.profile)
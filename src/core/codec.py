@@ -0,0 +1,110 @@
+"""
+压缩算法选择模块
+按文件扩展名和开头数据的试压缩结果，为每个压缩包成员选择 STORED、DEFLATED、BZIP2 或 LZMA，
+避免对 JPEG、视频、压缩包等已压缩的文件重复压缩浪费 CPU
+"""
+
+import os
+import zlib
+import zipfile
+
+CODECS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflated': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA
+}
+CODEC_NAMES = {value: name for name, value in CODECS.items()}
+
+# 默认直接存储（不压缩）的扩展名：图片、音视频、压缩包和基于 ZIP 的文档格式
+DEFAULT_STORE_EXTENSIONS = [
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif',
+    '.mp3', '.aac', '.m4a', '.ogg', '.opus', '.flac',
+    '.mp4', '.m4v', '.mkv', '.mov', '.avi', '.webm', '.wmv',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.lz4',
+    '.pdf', '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.epub',
+    '.jar', '.apk', '.whl'
+]
+
+DEFAULT_POLICY = {
+    'enabled': True,
+    'default_codec': 'deflated',
+    'store_extensions': DEFAULT_STORE_EXTENSIONS,
+    'bzip2_extensions': [],
+    'lzma_extensions': [],
+    # 试压缩的样本大小（文件开头的字节数）
+    'sample_size': 64 * 1024,
+    # 样本试压缩节省的比例低于此值时直接存储
+    'min_saving_ratio': 0.03
+}
+
+
+def load_codec_policy(policy_config=None):
+    """合并配置文件中的 compression_policy 与默认策略"""
+    policy = dict(DEFAULT_POLICY)
+    if policy_config:
+        policy.update(policy_config)
+
+    if policy['default_codec'] not in CODECS:
+        raise ValueError(f"未知的压缩算法: {policy['default_codec']}")
+
+    # 统一为小写的扩展名集合，便于查找
+    for key in ('store_extensions', 'bzip2_extensions', 'lzma_extensions'):
+        policy[key] = frozenset(ext.lower() for ext in policy[key])
+    return policy
+
+
+def choose_codec(path, sample, policy):
+    """根据扩展名和文件开头的样本选择压缩算法，返回 zipfile 的压缩类型常量"""
+    if not policy or not policy['enabled']:
+        return zipfile.ZIP_DEFLATED
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext in policy['store_extensions']:
+        return zipfile.ZIP_STORED
+    if ext in policy['lzma_extensions']:
+        return zipfile.ZIP_LZMA
+    if ext in policy['bzip2_extensions']:
+        return zipfile.ZIP_BZIP2
+
+    sample = sample[:policy['sample_size']]
+    if sample:
+        # 用最快的压缩级别试压缩样本，几乎无法压缩的数据直接存储
+        saving = 1 - len(zlib.compress(sample, 1)) / len(sample)
+        if saving < policy['min_saving_ratio']:
+            return zipfile.ZIP_STORED
+
+    return CODECS[policy['default_codec']]
+
+
+def add_codec_stats(codec_stats, compress_type, file_size, compress_size, seconds):
+    """累加一个成员的压缩统计"""
+    stats = codec_stats.setdefault(CODEC_NAMES.get(compress_type, str(compress_type)), {
+        'files': 0, 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0
+    })
+    stats['files'] += 1
+    stats['bytes_in'] += file_size
+    stats['bytes_out'] += compress_size
+    stats['seconds'] += seconds
+
+
+def summarize_codec_stats(codec_stats):
+    """计算各压缩算法节省的字节数和时间
+
+    bytes_saved 为压缩节省的空间；直接存储的成员按本次 DEFLATED 的实测吞吐量
+    估算避免压缩所节省的时间（time_saved）。
+    """
+    deflated = codec_stats.get('deflated')
+    deflate_rate = None
+    if deflated and deflated['seconds'] > 0:
+        deflate_rate = deflated['bytes_in'] / deflated['seconds']
+
+    summary = {}
+    for name, stats in codec_stats.items():
+        item = dict(stats)
+        item['seconds'] = round(stats['seconds'], 3)
+        item['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+        if name == 'stored' and deflate_rate:
+            item['time_saved'] = round(stats['bytes_in'] / deflate_rate - stats['seconds'], 3)
+        summary[name] = item
+    return summary
@@ -0,0 +1,423 @@
+"""
+目录复制模块
+根据文件清单在进程内复制源目录，不依赖 rsync 或 robocopy：
+- 支持时用 reflink（FICLONE）克隆文件，只共享数据块而不复制数据
+- 否则用 os.copy_file_range / os.sendfile 在内核中复制，不经过用户态缓冲区
+- 小文件在线程池中并行复制，大文件按块并行复制
+- 类似 rsync --link-dest 的硬链接增量快照：未变化的文件硬链接到上一个快照，只复制新增或修改的文件
+- 层级提升：把已有快照整体硬链接（或克隆）为另一个层级的快照
+- 差异存储：超过大小下限的文件只保存与上一个快照相比变化的块（见 delta 模块）
+"""
+
+import os
+import sys
+import stat
+import errno
+import shutil
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .throttle import UNLIMITED
+from .delta import store_file
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Linux 的 FICLONE ioctl 请求码（_IOW(0x94, 9, int)）
+FICLONE = 0x40049409
+# 超过此大小的文件按块并行复制
+LARGE_FILE_THRESHOLD = 256 * 1024 * 1024
+# 大文件并行复制时每块的大小
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+# 用户态复制时的缓冲区大小
+BUFFER_SIZE = 1024 * 1024
+
+# 表示文件系统或内核不支持某种复制方式的错误码，遇到后本次运行不再尝试该方式
+_UNSUPPORTED_ERRNOS = {
+    errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.EBADF, errno.EPERM
+}
+
+
+def get_copy_workers(workers=None):
+    """返回复制使用的线程数，默认与 ThreadPoolExecutor 一致"""
+    if workers:
+        return max(1, int(workers))
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def detect_copy_methods():
+    """返回当前平台可用的复制方式
+
+    返回的字典在一次复制过程中共享：某种方式在目标文件系统上不受支持时会被关闭，
+    后续文件直接使用下一种方式。
+    """
+    linux = sys.platform.startswith('linux')
+    return {
+        'reflink': linux and fcntl is not None,
+        'copy_file_range': hasattr(os, 'copy_file_range'),
+        'sendfile': linux and hasattr(os, 'sendfile'),
+        'pread': hasattr(os, 'pread')
+    }
+
+
+def _is_unsupported(methods, name, error):
+    """判断错误是否表示复制方式不受支持，若是则关闭该方式"""
+    if error.errno in _UNSUPPORTED_ERRNOS:
+        if methods[name]:
+            logging.debug(f"复制方式 {name} 不可用，改用其他方式: {str(error)}")
+        methods[name] = False
+        return True
+    return False
+
+
+def _try_reflink(src_fd, dst_fd, methods):
+    """尝试用 FICLONE 克隆整个文件，成功时返回 True"""
+    if not methods['reflink']:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError as e:
+        if not _is_unsupported(methods, 'reflink', e):
+            raise
+        return False
+
+
+def _copy_stream(fsrc, fdst, methods, throttle=UNLIMITED):
+    """从当前位置复制到源文件末尾，返回使用的复制方式；每次复制后按字节数计入 throttle"""
+    src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+    chunk_size = throttle.chunk_size(COPY_CHUNK_SIZE)
+
+    if methods['copy_file_range']:
+        try:
+            while True:
+                copied = os.copy_file_range(src_fd, dst_fd, chunk_size)
+                if not copied:
+                    break
+                throttle.copy(copied)
+            return 'copy_file_range'
+        except OSError as e:
+            if not _is_unsupported(methods, 'copy_file_range', e):
+                raise
+
+    if methods['sendfile']:
+        try:
+            # sendfile 按源文件偏移读取，写入目标文件的当前位置
+            offset = os.lseek(src_fd, 0, os.SEEK_CUR)
+            while True:
+                sent = os.sendfile(dst_fd, src_fd, offset, chunk_size)
+                if not sent:
+                    break
+                offset += sent
+                throttle.copy(sent)
+            return 'sendfile'
+        except OSError as e:
+            if not _is_unsupported(methods, 'sendfile', e):
+                raise
+
+    if throttle is UNLIMITED:
+        shutil.copyfileobj(fsrc, fdst, BUFFER_SIZE)
+        return 'read'
+    while True:
+        data = fsrc.read(BUFFER_SIZE)
+        if not data:
+            break
+        fdst.write(data)
+        throttle.copy(len(data))
+    return 'read'
+
+
+def _copy_chunk(src_fd, dst_fd, offset, count, methods, throttle=UNLIMITED):
+    """按偏移复制大文件的一块（在工作线程中执行，不改变文件位置）
+
+    返回复制结束的位置；源文件在扫描之后变小时，读到文件末尾即提前结束，返回值小于块的结束位置。
+    """
+    end = offset + count
+    chunk_size = throttle.chunk_size(end - offset)
+
+    if methods['copy_file_range']:
+        try:
+            while offset < end:
+                copied = os.copy_file_range(src_fd, dst_fd, min(chunk_size, end - offset), offset, offset)
+                if not copied:
+                    return offset
+                offset += copied
+                throttle.copy(copied)
+            return offset
+        except OSError as e:
+            if not _is_unsupported(methods, 'copy_file_range', e):
+                raise
+
+    while offset < end:
+        data = os.pread(src_fd, min(BUFFER_SIZE, end - offset), offset)
+        if not data:
+            return offset
+        os.pwrite(dst_fd, data, offset)
+        offset += len(data)
+        throttle.copy(len(data))
+    return offset
+
+
+def copy_file(src, dst, methods=None, throttle=UNLIMITED):
+    """复制单个文件的内容，返回使用的复制方式（reflink/copy_file_range/sendfile/read）
+
+    throttle 为 throttle.IOThrottle：按其设置限速，并在读完后提示内核丢弃源文件的页缓存。
+    """
+    if methods is None:
+        methods = detect_copy_methods()
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        throttle.open_source(fsrc.fileno())
+        try:
+            if _try_reflink(fsrc.fileno(), fdst.fileno(), methods):
+                # 克隆只修改元数据，计为一次 I/O 操作
+                throttle.write(0)
+                return 'reflink'
+            return _copy_stream(fsrc, fdst, methods, throttle)
+        finally:
+            throttle.release_source(fsrc.fileno())
+
+
+def _apply_metadata(dst, entry):
+    """按清单恢复权限和修改时间（不再对源文件 stat）"""
+    os.chmod(dst, stat.S_IMODE(entry.mode))
+    os.utime(dst, ns=(entry.mtime_ns, entry.mtime_ns))
+
+
+def copy_entry(source_dir, dest_dir, entry, methods=None, throttle=UNLIMITED):
+    """复制单个文件，并按清单恢复权限和修改时间，返回使用的复制方式"""
+    dst = os.path.join(dest_dir, entry.path)
+    method = copy_file(os.path.join(source_dir, entry.path), dst, methods, throttle)
+    _apply_metadata(dst, entry)
+    return method
+
+
+def copy_large_entry(pool, source_dir, dest_dir, entry, methods, throttle=UNLIMITED):
+    """按块并行复制大文件，返回使用的复制方式
+
+    各块用带偏移的 copy_file_range（或 pread/pwrite）在线程池中同时复制，互不影响文件位置。
+    """
+    dst = os.path.join(dest_dir, entry.path)
+    with open(os.path.join(source_dir, entry.path), 'rb') as fsrc, open(dst, 'wb') as fdst:
+        src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+        throttle.open_source(src_fd)
+        try:
+            if _try_reflink(src_fd, dst_fd, methods):
+                throttle.write(0)
+                method = 'reflink'
+            elif not (methods['copy_file_range'] or methods['pread']):
+                method = _copy_stream(fsrc, fdst, methods, throttle)
+            else:
+                os.ftruncate(dst_fd, entry.size)
+                futures = {}
+                for offset in range(0, entry.size, COPY_CHUNK_SIZE):
+                    count = min(COPY_CHUNK_SIZE, entry.size - offset)
+                    futures[offset + count] = pool.submit(_copy_chunk, src_fd, dst_fd, offset, count, methods,
+                                                          throttle)
+                # 源文件在扫描之后变小：截断到实际复制的长度，不留下源文件中从未有过的全零尾部
+                size = entry.size
+                for end, future in futures.items():
+                    stop = future.result()
+                    if stop < end:
+                        size = min(size, stop)
+                if size < entry.size:
+                    logging.warning(f"文件在复制过程中变小: {entry.path} ({entry.size} -> {size} 字节)")
+                    os.ftruncate(dst_fd, size)
+                method = 'copy_file_range' if methods['copy_file_range'] else 'read'
+        finally:
+            throttle.release_source(src_fd)
+    _apply_metadata(dst, entry)
+    return method
+
+
+def _is_unchanged(prev_path, entry):
+    """判断上一个快照中的文件是否与清单条目一致（大小和修改时间相同）"""
+    try:
+        st = os.lstat(prev_path)
+    except OSError:
+        return False
+    return stat.S_ISREG(st.st_mode) and st.st_size == entry.size and st.st_mtime_ns == entry.mtime_ns
+
+
+def _link_source(link_dest, entry, known_changes=None, link_map=None):
+    """返回可供硬链接的上一个快照中的文件路径，文件需要复制时返回 None"""
+    if not link_dest:
+        return None
+    if link_map is not None:
+        prev_path = link_map.get(entry.path)
+        return os.path.join(link_dest, prev_path) if prev_path is not None else None
+    prev = os.path.join(link_dest, entry.path)
+    unchanged = entry.path not in known_changes if known_changes is not None else _is_unchanged(prev, entry)
+    return prev if unchanged else None
+
+
+def _snapshot_entry(source_dir, backup_path, entry, link_dest, methods, known_changes=None, link_map=None,
+                    throttle=UNLIMITED):
+    """处理一个文件（在工作线程中执行）：未变化时硬链接，否则复制；返回 'linked' 或复制方式"""
+    prev = _link_source(link_dest, entry, known_changes, link_map)
+    if prev is not None:
+        try:
+            os.link(prev, os.path.join(backup_path, entry.path))
+            return 'linked'
+        except OSError as e:
+            # 硬链接数达到上限等情况下退回到复制
+            logging.debug(f"硬链接失败，改为复制: {entry.path}, 错误: {str(e)}")
+    return copy_entry(source_dir, backup_path, entry, methods, throttle)
+
+
+def _delta_entry(source_dir, backup_path, entry, link_dest, delta_base, delta, known_changes=None, link_map=None,
+                 throttle=UNLIMITED):
+    """以差异方式保存一个大文件（在工作线程中执行），返回 (结果, 写入的字节数)（见 delta.store_file）"""
+    same_as = None
+    if link_dest and delta_base and os.path.abspath(link_dest) == os.path.abspath(delta_base):
+        prev = _link_source(link_dest, entry, known_changes, link_map)
+        same_as = os.path.relpath(prev, link_dest) if prev is not None else None
+        # 只按元数据比较时，上一个快照中以差异存储的文件由其记录的大小和修改时间判断
+        check_metadata = known_changes is None and link_map is None
+    else:
+        check_metadata = True
+    return store_file(source_dir, backup_path, entry, delta_base, delta, same_as, check_metadata, throttle)
+
+
+def _record_error(report, entry, error):
+    """记录单个文件的复制错误"""
+    logging.warning(f"复制文件失败: {entry.path}, 错误: {str(error)}")
+    report['errors'].append({'path': entry.path, 'errno': getattr(error, 'errno', None), 'error': str(error)})
+
+
+def create_directory_snapshot(source_dir, backup_path, manifest, link_dest=None, workers=None, known_changes=None,
+                              link_map=None, throttle=UNLIMITED, tracer=None, delta=None, delta_base=None):
+    """按文件清单在进程内复制源目录，创建目录快照
+
+    link_dest 为同一层级上一个目录快照的路径；其中大小和修改时间与清单一致的文件
+    直接硬链接，其余文件从源目录复制。每个快照都是完整可浏览的目录树，
+    而磁盘占用只与变化量成正比。workers 为复制线程数。
+    known_changes 为相对 link_dest 变化的文件路径集合（来自变化日志）：给出时其余文件直接硬链接，
+    不再逐个比较上一个快照中的文件。
+    link_map 为按内容摘要得到的 {清单路径: link_dest 中的相对路径}（见 hasher.plan_content_links()）：
+    给出时只有其中的文件被硬链接（可以链接到 link_dest 中另一路径下内容相同的文件），其余文件全部复制。
+    throttle 为 throttle.IOThrottle，限制复制的带宽和 IOPS。
+    tracer 为 profiling.SlowFileTracer，记录复制（或链接）超过阈值的文件。
+    delta 为 delta.load_delta_config() 返回的差异存储设置：不小于 min_size 的文件与 delta_base
+    （同一层级上一个目录快照）中的同一文件比较，只保存变化的块。
+
+    返回统计字典：linked（硬链接文件数）、copied（复制文件数）、cloned（其中 reflink 克隆的文件数）、
+    copied_bytes（复制字节数，差异存储的文件按实际写入的字节数计算）、deltas（以差异存储的文件数）、
+    errors（失败的文件列表，每项包含 path、errno、error）。
+    """
+    report = {'linked': 0, 'copied': 0, 'cloned': 0, 'copied_bytes': 0, 'deltas': 0, 'errors': []}
+    methods = detect_copy_methods()
+    workers = get_copy_workers(workers)
+    window = workers * 4
+    snapshot_entry, copy_large, delta_entry = _snapshot_entry, copy_large_entry, _delta_entry
+    if tracer is not None:
+        snapshot_entry = tracer.wrap('copy', _snapshot_entry, 2)
+        copy_large = tracer.wrap('copy', copy_large_entry, 3)
+        delta_entry = tracer.wrap('copy', _delta_entry, 2)
+
+    os.makedirs(backup_path, exist_ok=True)
+    created_dirs = {backup_path}
+    large_entries = []
+
+    def count(entry, result):
+        written = entry.size
+        if isinstance(result, tuple):
+            # 差异存储的文件：(linked/delta/full, 写入的字节数)
+            result, written = result
+            if result == 'delta':
+                report['deltas'] += 1
+        if result == 'linked':
+            report['linked'] += 1
+            return
+        report['copied'] += 1
+        report['copied_bytes'] += written
+        if result == 'reflink':
+            report['cloned'] += 1
+
+    def collect(done):
+        for future in done:
+            entry = pending.pop(future)
+            try:
+                count(entry, future.result())
+            except OSError as e:
+                _record_error(report, entry, e)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        for entry in manifest:
+            dst = os.path.join(backup_path, entry.path)
+            parent = os.path.dirname(dst)
+            if parent not in created_dirs:
+                os.makedirs(parent, exist_ok=True)
+                created_dirs.add(parent)
+
+            if delta is not None and entry.size >= delta['min_size']:
+                pending[pool.submit(delta_entry, source_dir, backup_path, entry, link_dest, delta_base, delta,
+                                    known_changes, link_map, throttle)] = entry
+            elif entry.size >= LARGE_FILE_THRESHOLD and _link_source(link_dest, entry, known_changes, link_map) is None:
+                # 大文件在小文件之后按块并行复制
+                large_entries.append(entry)
+            else:
+                pending[pool.submit(snapshot_entry, source_dir, backup_path, entry, link_dest, methods,
+                                    known_changes, link_map, throttle)] = entry
+
+            if len(pending) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        collect(list(pending))
+
+        for entry in large_entries:
+            try:
+                count(entry, copy_large(pool, source_dir, backup_path, entry, methods, throttle))
+            except OSError as e:
+                _record_error(report, entry, e)
+
+    logging.info(
+        f"目录快照创建完成: {backup_path}, 硬链接 {report['linked']} 个, "
+        f"复制 {report['copied']} 个 ({report['copied_bytes']} 字节, 其中克隆 {report['cloned']} 个, "
+        f"差异存储 {report['deltas']} 个), "
+        f"失败 {len(report['errors'])} 个"
+    )
+    return report
+
+
+def link_file(src, dst, methods=None):
+    """把文件硬链接到新位置，无法硬链接时克隆或复制；返回 'linked' 或复制方式"""
+    try:
+        os.link(src, dst)
+        return 'linked'
+    except OSError as e:
+        logging.debug(f"硬链接失败，改为复制: {src}, 错误: {str(e)}")
+    method = copy_file(src, dst, methods)
+    shutil.copystat(src, dst)
+    return method
+
+
+def link_tree(src_dir, dst_dir):
+    """把整个快照目录硬链接到新位置（包括隐藏文件和 backup_info.json）
+
+    两个目录共享文件数据，但各自独立：删除其中一个不影响另一个。
+    返回统计字典：linked、copied、errors（同 create_directory_snapshot）。
+    """
+    report = {'linked': 0, 'copied': 0, 'errors': []}
+    methods = detect_copy_methods()
+
+    for root, dirs, files in os.walk(src_dir):
+        rel_root = os.path.relpath(root, src_dir)
+        dst_root = os.path.normpath(os.path.join(dst_dir, rel_root))
+        os.makedirs(dst_root, exist_ok=True)
+        for name in files:
+            try:
+                if link_file(os.path.join(root, name), os.path.join(dst_root, name), methods) == 'linked':
+                    report['linked'] += 1
+                else:
+                    report['copied'] += 1
+            except OSError as e:
+                path = os.path.normpath(os.path.join(rel_root, name))
+                logging.warning(f"链接文件失败: {path}, 错误: {str(e)}")
+                report['errors'].append({'path': path, 'errno': e.errno, 'error': str(e)})
+        shutil.copystat(root, dst_root)
+
+    return report
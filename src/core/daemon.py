@@ -0,0 +1,163 @@
+"""
+守护进程模块
+常驻运行，用单调时钟调度每小时、每日和每周备份，代替每小时由计划任务冷启动一次脚本：
+- 配置只加载一次，快照目录和 Merkle 树状态在内存中保持缓存，每次只做增量工作
+- 启用 change_journal 时用 inotify 变化日志代替每次遍历源目录
+- 按墙上时间判断各层级最近一次计划时间，系统休眠或停机错过的层级在恢复后立即补做
+- 过期快照移入回收站后在两次备份之间由后台线程删除
+- 配置了多个备份任务时，各任务分别判断需要补做的层级，按设备限制并发执行
+- 每个备份任务保留最近 N 次运行的报告（metrics.history_size），写入目标目录下的 run_history.json
+- 收到 SIGTERM / SIGINT 后完成当前备份并退出
+"""
+
+import time
+import signal
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from .catalog import BACKUP_TYPES, list_snapshots
+from .tier_backup import load_config, configure_logging, prepare_jobs, run_backups
+from .jobs import run_jobs
+from .journal import ChangeJournal
+from .metrics import RunHistory
+from .profiling import enable_profiling
+
+# 每次最多睡眠的秒数：定期醒来比较墙上时间，及时发现系统休眠和时钟调整
+MAX_SLEEP_SECONDS = 60
+# 备份失败的层级重试前等待的秒数
+RETRY_SECONDS = 300
+
+TIER_PERIODS = {
+    'hourly': timedelta(hours=1),
+    'daily': timedelta(days=1),
+    'weekly': timedelta(days=7)
+}
+
+
+def get_last_scheduled(backup_type, now):
+    """返回不晚于 now 的最近一次计划备份时间（与 should_create_backup 的时间点一致）"""
+    if backup_type == 'hourly':
+        # 每小时整点
+        return now.replace(minute=0, second=0, microsecond=0)
+    if backup_type == 'daily':
+        # 每天23:59
+        scheduled = now.replace(hour=23, minute=59, second=0, microsecond=0)
+    else:
+        # 每周日23:55
+        days_since_sunday = (now.weekday() + 1) % 7
+        scheduled = (now - timedelta(days=days_since_sunday)).replace(hour=23, minute=55, second=0, microsecond=0)
+    if scheduled > now:
+        scheduled -= TIER_PERIODS[backup_type]
+    return scheduled
+
+
+def get_due_tiers(last_created, now):
+    """判断各层级是否需要备份：最近一次备份早于最近一次计划时间（或从未备份）即需要补做
+
+    last_created 为 {备份类型: 最近一次备份的创建时间}。
+    """
+    due = {}
+    for backup_type in BACKUP_TYPES:
+        created = last_created.get(backup_type)
+        due[backup_type] = created is None or created < get_last_scheduled(backup_type, now)
+    return due
+
+
+def seconds_until_next(now):
+    """距离下一次计划备份的秒数"""
+    next_times = [get_last_scheduled(t, now) + TIER_PERIODS[t] for t in BACKUP_TYPES]
+    return max(0.0, (min(next_times) - now).total_seconds())
+
+
+def load_last_created(target_dir):
+    """从快照目录读取各层级最近一次备份的创建时间"""
+    last_created = {}
+    for backup in list_snapshots(target_dir):
+        try:
+            created = datetime.fromisoformat(backup['created_at'])
+        except (TypeError, ValueError):
+            continue
+        if backup['type'] not in last_created or created > last_created[backup['type']]:
+            last_created[backup['type']] = created
+    return last_created
+
+
+def run_daemon(config_file, stop_event=None, profile=False):
+    """以守护进程方式运行，直到收到停止信号；返回进程退出码
+
+    stop_event 为 threading.Event，设置后在当前备份完成后退出（供测试或嵌入使用）。
+    profile 为 True 时（命令行 --profile）每次运行都进行性能剖析。
+    """
+    config = load_config(config_file)
+    configure_logging(config)
+    if profile:
+        enable_profiling(config)
+    jobs = prepare_jobs(config)
+    if not jobs:
+        return 1
+
+    if stop_event is None:
+        stop_event = threading.Event()
+
+        def handle_signal(signum, frame):
+            logging.info(f"收到信号 {signum}，完成当前备份后退出")
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, handle_signal)
+        signal.signal(signal.SIGINT, handle_signal)
+
+    journals = []
+    for job in jobs:
+        settings = job.settings
+        logging.info(f"=== 备份守护进程启动 === 任务: {job.name}, 源目录: {settings['source_dir']}, "
+                     f"目标目录: {settings['target_dir']}")
+        if job.config.get('change_journal', False):
+            journal = ChangeJournal(settings['source_dir'])
+            if journal.start():
+                settings['journal'] = journal
+                journals.append(journal)
+        if settings['metrics']['enabled'] and settings['metrics']['history_size']:
+            # 最近 N 次运行的报告，run_backups 每次运行后追加
+            settings['run_history'] = RunHistory(settings['target_dir'], settings['metrics']['history_size'])
+
+    # 失败层级的重试时间（单调时钟）：{(任务名称, 备份类型): 时间}
+    retry_at = {}
+
+    while not stop_event.is_set():
+        now = datetime.now()
+        monotonic_now = time.monotonic()
+        work = {}
+        for job in jobs:
+            due = get_due_tiers(load_last_created(job.settings['target_dir']), now)
+            for backup_type in BACKUP_TYPES:
+                if due[backup_type] and retry_at.get((job.name, backup_type), 0) > monotonic_now:
+                    due[backup_type] = False
+            if any(due.values()):
+                logging.info(f"备份任务 {job.name} 需要执行的备份: {[t for t in BACKUP_TYPES if due[t]]}")
+                work[job.name] = due
+
+        if work:
+            results = run_jobs([job for job in jobs if job.name in work],
+                               lambda job: run_backups(job.config, job.settings, work[job.name]),
+                               config.get('max_jobs_per_device'), config.get('max_parallel_jobs'))
+            for name, due in work.items():
+                created = results.get(name) or []
+                for backup_type in BACKUP_TYPES:
+                    if due[backup_type] and backup_type not in created:
+                        retry_at[(name, backup_type)] = time.monotonic() + RETRY_SECONDS
+                        logging.warning(f"备份任务 {name} 的{backup_type}备份失败，{RETRY_SECONDS} 秒后重试")
+                    elif backup_type in created:
+                        retry_at.pop((name, backup_type), None)
+            logging.info(f"本轮备份完成，耗时 {time.monotonic() - monotonic_now:.1f} 秒")
+
+        # 睡眠到下一次计划时间，但最多睡眠 MAX_SLEEP_SECONDS 秒后重新检查
+        stop_event.wait(min(MAX_SLEEP_SECONDS, seconds_until_next(now)) or 1)
+
+    for journal in journals:
+        journal.stop()
+    # 未删除完的回收站条目留到下次启动时继续
+    for job in jobs:
+        job.settings['reaper'].stop()
+    logging.info("=== 备份守护进程退出 ===")
+    return 0
@@ -0,0 +1,431 @@
+"""
+差异存储模块
+数据库导出、虚拟机磁盘镜像等大文件每次只改动很少一部分时，目录快照不再保存完整的新副本，
+而是与同一层级上一个快照中的同一文件按固定大小的块比较 BLAKE2b 块摘要，只保存变化的块和块映射：
+- 每个版本的块摘要（签名）与数据一起保存，下次备份只需读取源文件，不需要读取或重建上一个版本
+- 块按摘要匹配上一个版本中任意位置的块，整块移动的数据同样不必重新保存
+- 差异链（基础版本和依次的各个差异）的全部文件硬链接到每个快照中，删除任何旧快照都不会破坏较新的快照
+- 链长度有上限，达到上限或变化过多时重新保存完整副本，恢复时读取的文件数有界
+- 恢复和校验时按块映射直接定位每个块所在的文件和偏移，顺序写出，不生成中间版本
+
+快照中的布局：<快照>/.tier_delta/<相对路径>/ 存放该文件的差异链，<n>.data 为版本 n 的数据
+（0 为完整的基础版本，其余只含变化的块），<n>.json 为大小、修改时间、权限和块映射，<n>.sig 为块摘要。
+完整保存的版本直接写在快照中原来的路径下（可以直接浏览），差异链目录中只有 0.json 和 0.sig。
+"""
+
+import os
+import re
+import stat
+import json
+import errno
+import shutil
+import hashlib
+import logging
+
+from .throttle import UNLIMITED
+
+# 快照中存放差异链的目录（源目录中的隐藏文件不会被备份，不会与之冲突）
+DELTA_DIR_NAME = '.tier_delta'
+# 默认只对不小于 256 MB 的文件使用差异存储
+DEFAULT_MIN_SIZE = 256 * 1024 * 1024
+# 默认块大小
+DEFAULT_BLOCK_SIZE = 256 * 1024
+# 默认的最大差异链长度（基础版本之后的差异数）
+DEFAULT_MAX_CHAIN_LENGTH = 8
+# 变化的数据超过文件大小的此比例时改为保存完整副本
+DEFAULT_MAX_DELTA_RATIO = 0.5
+# 块摘要的字节数
+BLOCK_DIGEST_SIZE = 16
+# 版本文件的格式版本
+FORMAT_VERSION = 1
+
+_VERSION_FILE = re.compile(r'^(\d+)\.json$')
+
+
+def load_delta_config(delta_config=None):
+    """读取配置文件中的 delta_storage 设置；未启用时返回 None，参数无效时抛出 ValueError
+
+    字段：enabled（默认 true）、min_size（使用差异存储的最小文件大小）、block_size（块大小）、
+    max_chain_length（最大差异链长度）、max_delta_ratio（变化的数据超过文件大小的此比例时保存完整副本）。
+    """
+    if not delta_config:
+        return None
+    unknown = set(delta_config) - {'enabled', 'min_size', 'block_size', 'max_chain_length', 'max_delta_ratio'}
+    if unknown:
+        raise ValueError(f"未知的 delta_storage 参数: {', '.join(sorted(unknown))}")
+    if not delta_config.get('enabled', True):
+        return None
+
+    config = {
+        'min_size': delta_config.get('min_size', DEFAULT_MIN_SIZE),
+        'block_size': delta_config.get('block_size', DEFAULT_BLOCK_SIZE),
+        'max_chain_length': delta_config.get('max_chain_length', DEFAULT_MAX_CHAIN_LENGTH),
+        'max_delta_ratio': delta_config.get('max_delta_ratio', DEFAULT_MAX_DELTA_RATIO)
+    }
+    for key in ('min_size', 'block_size', 'max_chain_length'):
+        if isinstance(config[key], bool) or not isinstance(config[key], int) or config[key] < 1:
+            raise ValueError(f"{key} 必须是正整数: {config[key]}")
+    ratio = config['max_delta_ratio']
+    if isinstance(ratio, bool) or not isinstance(ratio, (int, float)) or not 0 < ratio <= 1:
+        raise ValueError(f"max_delta_ratio 必须在 0 到 1 之间: {ratio}")
+    return config
+
+
+def get_chain_dir(snapshot_path, rel_path):
+    """返回快照中文件的差异链目录"""
+    return os.path.join(snapshot_path, DELTA_DIR_NAME, rel_path)
+
+
+def _version_path(chain_dir, index, suffix):
+    return os.path.join(chain_dir, f"{index}.{suffix}")
+
+
+def _latest_index(chain_dir):
+    """返回差异链中最新版本的序号，没有差异链时返回 None"""
+    try:
+        names = os.listdir(chain_dir)
+    except OSError:
+        return None
+    indexes = [int(match.group(1)) for match in map(_VERSION_FILE.match, names) if match]
+    return max(indexes) if indexes else None
+
+
+def load_version(chain_dir, index):
+    """读取差异链中一个版本的信息"""
+    with open(_version_path(chain_dir, index, 'json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def read_signature(chain_dir, index):
+    """读取一个版本的块摘要列表"""
+    with open(_version_path(chain_dir, index, 'sig'), 'rb') as f:
+        data = f.read()
+    return [data[offset:offset + BLOCK_DIGEST_SIZE] for offset in range(0, len(data), BLOCK_DIGEST_SIZE)]
+
+
+def _write_version(chain_dir, index, info, signature):
+    with open(_version_path(chain_dir, index, 'sig'), 'wb') as f:
+        f.write(b''.join(signature))
+    with open(_version_path(chain_dir, index, 'json'), 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+
+
+def _block_digest(block):
+    return hashlib.blake2b(block, digest_size=BLOCK_DIGEST_SIZE).digest()
+
+
+def list_delta_files(snapshot_path):
+    """列出快照中以差异存储的文件，返回 {相对路径（以 / 分隔）: 最新版本的信息}
+
+    信息中另含 chain_dir（差异链目录）和 index（版本序号）；完整保存的文件不在其中。
+    """
+    files = {}
+    delta_root = os.path.join(snapshot_path, DELTA_DIR_NAME)
+    for root, dirs, names in os.walk(delta_root):
+        indexes = [int(match.group(1)) for match in map(_VERSION_FILE.match, names) if match]
+        if not indexes:
+            continue
+        # 差异链目录中不会再有文件的差异链
+        dirs[:] = []
+        index = max(indexes)
+        if index == 0:
+            continue
+        info = load_version(root, index)
+        info['chain_dir'] = root
+        info['index'] = index
+        files[os.path.relpath(root, delta_root).replace(os.sep, '/')] = info
+    return files
+
+
+def _previous_state(base_dir, rel_path):
+    """返回上一个快照中文件最新版本的 (大小, 修改时间纳秒)，不存在时返回 None"""
+    chain_dir = get_chain_dir(base_dir, rel_path)
+    index = _latest_index(chain_dir)
+    if index:
+        info = load_version(chain_dir, index)
+        return info['size'], info['mtime_ns']
+    try:
+        st = os.lstat(os.path.join(base_dir, rel_path))
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns) if stat.S_ISREG(st.st_mode) else None
+
+
+def _link_chain(src_chain, dst_chain, indexes=None):
+    """把差异链中的文件（indexes 为 None 时为全部文件）硬链接到新的差异链目录"""
+    os.makedirs(dst_chain, exist_ok=True)
+    for name in os.listdir(src_chain):
+        index = name.split('.', 1)[0]
+        if indexes is None or (index.isdigit() and int(index) in indexes):
+            os.link(os.path.join(src_chain, name), os.path.join(dst_chain, name))
+
+
+def _link_version(base_dir, src_rel, backup_path, dst_rel):
+    """把上一个快照中未变化的文件（完整副本或差异链）硬链接到新快照"""
+    src = os.path.join(base_dir, src_rel)
+    src_chain = get_chain_dir(base_dir, src_rel)
+    linked = False
+    if os.path.isfile(src) and not os.path.islink(src):
+        os.link(src, os.path.join(backup_path, dst_rel))
+        linked = True
+    if os.path.isdir(src_chain):
+        _link_chain(src_chain, get_chain_dir(backup_path, dst_rel))
+        linked = True
+    if not linked:
+        raise FileNotFoundError(errno.ENOENT, "上一个快照中没有该文件", src)
+
+
+def _discard(backup_path, rel_path):
+    """删除写了一半的文件和差异链，之后重新保存"""
+    try:
+        os.unlink(os.path.join(backup_path, rel_path))
+    except OSError:
+        pass
+    shutil.rmtree(get_chain_dir(backup_path, rel_path), ignore_errors=True)
+
+
+def _apply_metadata(path, entry):
+    os.chmod(path, stat.S_IMODE(entry.mode))
+    os.utime(path, ns=(entry.mtime_ns, entry.mtime_ns))
+
+
+def _file_signature(path, block_size, throttle=UNLIMITED):
+    """读取文件计算块摘要（上一个快照中的完整副本没有记录签名时使用）"""
+    signature = []
+    with open(path, 'rb') as f:
+        throttle.open_source(f.fileno())
+        try:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                throttle.read(len(block))
+                signature.append(_block_digest(block))
+        finally:
+            throttle.release_source(f.fileno())
+    return signature
+
+
+def _load_previous(base_dir, rel_path, block_size, throttle=UNLIMITED):
+    """返回上一个快照中文件最新版本的 (序号, 块摘要)；没有该文件或块大小不同时返回 None"""
+    chain_dir = get_chain_dir(base_dir, rel_path)
+    index = _latest_index(chain_dir)
+    if index is not None and load_version(chain_dir, index)['block_size'] == block_size:
+        if index or os.path.isfile(os.path.join(base_dir, rel_path)):
+            return index, read_signature(chain_dir, index)
+
+    path = os.path.join(base_dir, rel_path)
+    if index is None and os.path.isfile(path) and not os.path.islink(path):
+        # 启用差异存储之前的快照或刚超过大小下限的文件：读取一次完整副本得到签名
+        return 0, _file_signature(path, block_size, throttle)
+    return None
+
+
+def _append_run(runs, ref):
+    """把一个块加入块映射：[起始块序号, 块数]，起始为 -1 表示依次取本版本数据文件中的块"""
+    if runs:
+        start, count = runs[-1]
+        if (ref < 0 and start < 0) or (ref >= 0 and start >= 0 and start + count == ref):
+            runs[-1][1] += 1
+            return
+    runs.append([ref, 1])
+
+
+def _write_changed_blocks(src_path, data_path, block_size, previous, max_bytes, throttle=UNLIMITED):
+    """读取源文件，把上一个版本中没有的块写入 data_path
+
+    返回 (块映射, 块摘要, 写入的字节数, 文件大小)；写入超过 max_bytes 时返回 None。
+    """
+    positions = {}
+    for position, digest in enumerate(previous):
+        positions.setdefault(digest, position)
+    runs, signature = [], []
+    written = size = 0
+    with open(src_path, 'rb') as fsrc, open(data_path, 'wb') as fdata:
+        throttle.open_source(fsrc.fileno())
+        try:
+            while True:
+                block = fsrc.read(block_size)
+                if not block:
+                    break
+                throttle.read(len(block))
+                digest = _block_digest(block)
+                position = len(signature)
+                # 优先匹配同一位置的块，块映射中连续的引用可以合并
+                if position < len(previous) and previous[position] == digest:
+                    ref = position
+                else:
+                    ref = positions.get(digest, -1)
+                if ref < 0:
+                    fdata.write(block)
+                    throttle.write(len(block))
+                    written += len(block)
+                    if written > max_bytes:
+                        return None
+                signature.append(digest)
+                _append_run(runs, ref)
+                size += len(block)
+        finally:
+            throttle.release_source(fsrc.fileno())
+    return runs, signature, written, size
+
+
+def _write_full(src_path, dst_path, block_size, throttle=UNLIMITED):
+    """复制完整副本并同时计算块摘要，返回 (块摘要, 文件大小)"""
+    signature = []
+    size = 0
+    with open(src_path, 'rb') as fsrc, open(dst_path, 'wb') as fdst:
+        throttle.open_source(fsrc.fileno())
+        try:
+            while True:
+                block = fsrc.read(block_size)
+                if not block:
+                    break
+                throttle.read(len(block))
+                fdst.write(block)
+                throttle.write(len(block))
+                signature.append(_block_digest(block))
+                size += len(block)
+        finally:
+            throttle.release_source(fsrc.fileno())
+    return signature, size
+
+
+def _version_info(entry, size, block_size, runs=None):
+    info = {'format': FORMAT_VERSION, 'size': size, 'mtime_ns': entry.mtime_ns, 'mode': entry.mode,
+            'block_size': block_size}
+    if runs is not None:
+        info['map'] = runs
+    return info
+
+
+def store_file(source_dir, backup_path, entry, base_dir, config, same_as=None, check_metadata=False,
+               throttle=UNLIMITED):
+    """以差异方式保存一个大文件（在工作线程中执行），返回 (结果, 写入的字节数)
+
+    结果为 linked（未变化，硬链接上一个快照中的完整副本或差异链）、delta（只保存变化的块）或 full（完整副本）。
+    base_dir 为同一层级的上一个目录快照；same_as 为其中内容相同的文件的相对路径（已知未变化时）；
+    check_metadata 为 True 时按上一个版本记录的大小和修改时间判断文件是否变化。
+    """
+    if base_dir:
+        try:
+            if same_as is None and check_metadata and _previous_state(base_dir, entry.path) == (entry.size,
+                                                                                                 entry.mtime_ns):
+                same_as = entry.path
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"无法读取上一个版本的信息: {entry.path}, 错误: {str(e)}")
+        if same_as is not None:
+            try:
+                _link_version(base_dir, same_as, backup_path, entry.path)
+                return 'linked', 0
+            except OSError as e:
+                logging.debug(f"链接上一个版本失败，重新保存: {entry.path}, 错误: {str(e)}")
+                _discard(backup_path, entry.path)
+
+    src_path = os.path.join(source_dir, entry.path)
+    dst_path = os.path.join(backup_path, entry.path)
+    chain_dir = get_chain_dir(backup_path, entry.path)
+    block_size = config['block_size']
+    os.makedirs(chain_dir, exist_ok=True)
+
+    previous = None
+    if base_dir:
+        try:
+            previous = _load_previous(base_dir, entry.path, block_size, throttle)
+        except (OSError, ValueError, KeyError) as e:
+            # 上一个快照中的差异链不完整时不再以它为基础
+            logging.warning(f"无法读取上一个版本，保存完整副本: {entry.path}, 错误: {str(e)}")
+
+    if previous is not None and previous[0] >= config['max_chain_length']:
+        logging.debug(f"差异链已达到 {previous[0]} 个版本，保存完整副本: {entry.path}")
+        previous = None
+
+    if previous is not None:
+        index, signature = previous
+        data_path = _version_path(chain_dir, index + 1, 'data')
+        result = _write_changed_blocks(src_path, data_path, block_size, signature,
+                                       entry.size * config['max_delta_ratio'], throttle)
+        if result is not None:
+            runs, new_signature, written, size = result
+            prev_chain = get_chain_dir(base_dir, entry.path)
+            if index == 0:
+                # 上一个版本是完整副本：它成为本差异链的基础版本
+                os.link(os.path.join(base_dir, entry.path), _version_path(chain_dir, 0, 'data'))
+                if _latest_index(prev_chain) == 0:
+                    _link_chain(prev_chain, chain_dir, {0})
+                else:
+                    st = os.stat(_version_path(chain_dir, 0, 'data'))
+                    base_entry = entry._replace(mtime_ns=st.st_mtime_ns, mode=st.st_mode)
+                    _write_version(chain_dir, 0, _version_info(base_entry, st.st_size, block_size), signature)
+            else:
+                _link_chain(prev_chain, chain_dir, set(range(index + 1)))
+            _write_version(chain_dir, index + 1, _version_info(entry, size, block_size, runs), new_signature)
+            return 'delta', written
+        os.unlink(data_path)
+        logging.debug(f"变化的数据过多，保存完整副本: {entry.path}")
+
+    signature, size = _write_full(src_path, dst_path, block_size, throttle)
+    _apply_metadata(dst_path, entry)
+    _write_version(chain_dir, 0, _version_info(entry, size, block_size), signature)
+    return 'full', size
+
+
+def _block_locations(chain_dir, index):
+    """返回版本 index 中每个块的 (数据文件的版本序号, 偏移, 长度)，按块的顺序"""
+    base = load_version(chain_dir, 0)
+    block_size = base['block_size']
+    locations = [(0, offset, min(block_size, base['size'] - offset)) for offset in range(0, base['size'], block_size)]
+    for version in range(1, index + 1):
+        info = load_version(chain_dir, version)
+        blocks = []
+        data_offset = 0
+        for start, count in info['map']:
+            if start >= 0:
+                blocks.extend(locations[start:start + count])
+                continue
+            for _ in range(count):
+                length = min(block_size, info['size'] - len(blocks) * block_size)
+                blocks.append((version, data_offset, length))
+                data_offset += length
+        if sum(length for _, _, length in blocks) != info['size']:
+            raise ValueError(f"差异链损坏: 版本 {version} 的块映射与文件大小 {info['size']} 不一致")
+        locations = blocks
+    return locations
+
+
+def iter_delta_file(chain_dir, index=None, verify=False):
+    """按块产出以差异存储的文件的内容（index 为 None 时为最新版本）
+
+    verify 为 True 时比对每个块的摘要，不一致时抛出 ValueError。
+    """
+    if index is None:
+        index = _latest_index(chain_dir)
+    signature = read_signature(chain_dir, index) if verify else None
+    files = {}
+    try:
+        for position, (version, offset, length) in enumerate(_block_locations(chain_dir, index)):
+            f = files.get(version)
+            if f is None:
+                f = files[version] = open(_version_path(chain_dir, version, 'data'), 'rb')
+            f.seek(offset)
+            block = f.read(length)
+            if len(block) != length:
+                raise ValueError(f"差异链损坏: 版本 {version} 的数据文件缺少 {length - len(block)} 字节")
+            if signature is not None and (position >= len(signature) or _block_digest(block) != signature[position]):
+                raise ValueError(f"第 {position} 块的内容与记录的摘要不一致")
+            yield block
+    finally:
+        for f in files.values():
+            f.close()
+
+
+def restore_delta_file(info, dest):
+    """把以差异存储的文件（list_delta_files() 返回的信息）重建到 dest，恢复权限和修改时间，返回字节数"""
+    size = 0
+    with open(dest, 'wb') as f:
+        for block in iter_delta_file(info['chain_dir'], info['index']):
+            f.write(block)
+            size += len(block)
+    os.chmod(dest, stat.S_IMODE(info['mode']))
+    os.utime(dest, ns=(info['mtime_ns'], info['mtime_ns']))
+    return size
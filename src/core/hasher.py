@@ -0,0 +1,230 @@
+"""
+内容哈希模块
+按内容检测变化时，用 BLAKE2b 计算每个文件的摘要：文件通过 mmap 映射后交给 hashlib（计算时释放 GIL），
+在线程池中并行计算。摘要缓存在目标目录的 .tier_backup/hash_cache.db 中，键为 (inode, 大小, 修改时间纳秒)，
+只有元数据变化的文件才重新读取；保留修改时间的工具替换文件时 inode 会变化，同样会重新计算。
+摘要写入快照元数据，供校验和按内容去重使用
+"""
+
+import os
+import mmap
+import time
+import sqlite3
+import hashlib
+import logging
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .catalog import get_state_dir, STATE_DIR_NAME
+from .throttle import UNLIMITED
+
+HASH_CACHE_FILE_NAME = 'hash_cache.db'
+
+# 变化检测方式：metadata 按路径、大小和修改时间；content 按文件内容
+CHANGE_DETECTION_MODES = ('metadata', 'content')
+# 摘要格式为 "blake2b:<十六进制>"，与压缩快照成员的 "crc32:<十六进制>" 区分
+DIGEST_PREFIX = 'blake2b:'
+DIGEST_SIZE = 32
+# mmap 不可用时（如部分网络文件系统）按块读取
+CHUNK_SIZE = 1024 * 1024
+
+# 进程内缓存的摘要：{目标目录: (数据库文件的修改时间和大小, {(inode, 大小, 修改时间): 摘要})}
+# 守护进程多次运行之间保持有效，数据库被其他进程修改后自动失效
+_digest_cache = {}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (inode, size, mtime_ns)
+)
+"""
+
+
+def get_hash_workers(workers=None):
+    """返回计算摘要使用的线程数；hashlib 处理大块数据时释放 GIL，默认与 ThreadPoolExecutor 一致"""
+    if workers:
+        return max(1, int(workers))
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def new_hasher():
+    """创建一个 BLAKE2b 摘要对象"""
+    return hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+
+def format_digest(hasher):
+    """把摘要对象格式化为带算法前缀的字符串"""
+    return DIGEST_PREFIX + hasher.hexdigest()
+
+
+def _hash_mapped(hasher, view, throttle):
+    """计算已映射文件的摘要；限速时按块计算，每块计入一次读取"""
+    if throttle is UNLIMITED:
+        hasher.update(view)
+        return
+    chunk_size = throttle.chunk_size(len(view))
+    for offset in range(0, len(view), chunk_size):
+        with view[offset:offset + chunk_size] as chunk:
+            hasher.update(chunk)
+            throttle.read(len(chunk))
+
+
+def hash_file(path, throttle=UNLIMITED):
+    """计算文件内容的 BLAKE2b 摘要（mmap 映射整个文件），返回 "blake2b:<十六进制>"
+
+    throttle 为 throttle.IOThrottle：读取按其设置限速，读完后提示内核丢弃文件的页缓存。
+    """
+    hasher = new_hasher()
+    with open(path, 'rb') as f:
+        throttle.open_source(f.fileno())
+        try:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                # 空文件不能映射；不支持 mmap 的文件系统退回到按块读取
+                while True:
+                    chunk = f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    throttle.read(len(chunk))
+            else:
+                with mapped, memoryview(mapped) as view:
+                    _hash_mapped(hasher, view, throttle)
+        finally:
+            throttle.release_source(f.fileno())
+    return format_digest(hasher)
+
+
+def _connect(target_dir):
+    """打开摘要缓存数据库，必要时创建表结构"""
+    conn = sqlite3.connect(os.path.join(get_state_dir(target_dir), HASH_CACHE_FILE_NAME), timeout=30)
+    conn.execute(_SCHEMA)
+    return conn
+
+
+def _db_stamp(target_dir):
+    """返回摘要缓存数据库文件的 (修改时间, 大小)"""
+    try:
+        st = os.stat(os.path.join(target_dir, STATE_DIR_NAME, HASH_CACHE_FILE_NAME))
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def hash_manifest(source_dir, manifest, target_dir, workers=None, throttle=UNLIMITED, tracer=None):
+    """计算文件清单中每个文件的内容摘要，返回 ({相对路径（以 / 分隔）: 摘要}, 统计字典)
+
+    (inode, 大小, 修改时间) 与缓存一致的文件直接使用缓存的摘要，其余文件在线程池中并行计算，
+    之后把新摘要写入缓存并删除已不在清单中的条目。读取失败的文件（如已被删除）不出现在结果中。
+    throttle 为 throttle.IOThrottle，限制读取的带宽和 IOPS。
+    tracer 为 profiling.SlowFileTracer，记录摘要计算超过阈值的文件。
+    统计字典：hashed（重新计算的文件数）、hashed_bytes（读取的字节数）、cached（命中缓存的文件数）、seconds。
+    """
+    start = time.monotonic()
+    key = os.path.abspath(target_dir)
+    stats = {'hashed': 0, 'hashed_bytes': 0, 'cached': 0}
+
+    with closing(_connect(target_dir)) as conn:
+        cached = _digest_cache.get(key)
+        if cached and cached[0] == _db_stamp(target_dir):
+            known = cached[1]
+        else:
+            known = {
+                (inode, size, mtime_ns): digest
+                for inode, size, mtime_ns, digest in conn.execute("SELECT inode, size, mtime_ns, digest FROM hashes")
+            }
+
+        digests = {}
+        current = set()
+        misses = []
+        for entry in manifest:
+            cache_key = (entry.inode, entry.size, entry.mtime_ns)
+            current.add(cache_key)
+            digest = known.get(cache_key)
+            if digest is not None:
+                digests[entry.path.replace(os.sep, '/')] = digest
+                stats['cached'] += 1
+            else:
+                misses.append(entry)
+
+        added = []
+        if misses:
+            workers = get_hash_workers(workers)
+            hash_task = tracer.wrap('hash', hash_file) if tracer is not None else hash_file
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hash') as pool:
+                pending = {}
+
+                def collect(done):
+                    for future in done:
+                        entry = pending.pop(future)
+                        try:
+                            digest = future.result()
+                        except OSError as e:
+                            logging.warning(f"计算文件摘要失败: {entry.path}, 错误: {str(e)}")
+                            continue
+                        digests[entry.path.replace(os.sep, '/')] = digest
+                        added.append((entry.inode, entry.size, entry.mtime_ns, digest))
+                        stats['hashed'] += 1
+                        stats['hashed_bytes'] += entry.size
+
+                for entry in misses:
+                    pending[pool.submit(hash_task, os.path.join(source_dir, entry.path), throttle)] = entry
+                    if len(pending) >= workers * 4:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+                collect(list(pending))
+
+        stale = [cache_key for cache_key in known if cache_key not in current]
+        if added or stale:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)", added)
+                conn.executemany("DELETE FROM hashes WHERE inode = ? AND size = ? AND mtime_ns = ?", stale)
+            for cache_key in stale:
+                del known[cache_key]
+            for inode, size, mtime_ns, digest in added:
+                known[(inode, size, mtime_ns)] = digest
+        _digest_cache[key] = (_db_stamp(target_dir), known)
+
+    stats['seconds'] = round(time.monotonic() - start, 3)
+    logging.info(f"内容摘要: 重新计算 {stats['hashed']} 个文件 ({stats['hashed_bytes']} 字节), "
+                 f"缓存命中 {stats['cached']} 个, 耗时 {stats['seconds']} 秒")
+    return digests, stats
+
+
+def content_root_hash(digests):
+    """由全部文件的路径和内容摘要计算目录哈希（按内容检测变化时代替 Merkle 树的根哈希）"""
+    hasher = new_hasher()
+    for path in sorted(digests):
+        hasher.update(f"{path}:{digests[path]}\n".encode('utf-8'))
+    hasher.update(f"file_count:{len(digests)}".encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def plan_content_links(manifest, digests, previous_files):
+    """按内容摘要决定硬链接增量快照中哪些文件可以链接到上一个快照，返回 {清单路径: 上一个快照中的相对路径}
+
+    previous_files 为上一个快照的文件状态 {路径: (大小, 修改时间纳秒, 摘要)}（来自历史索引）。
+    大小、修改时间和内容摘要都一致的文件链接到同一路径；路径变化（移动或重命名）但三者一致的文件
+    链接到上一个快照中内容相同的文件，不再重新复制。其余文件不在结果中，需要复制。
+    """
+    by_content = {}
+    for path, state in previous_files.items():
+        if state[2] and state[2].startswith(DIGEST_PREFIX):
+            by_content.setdefault(state, path)
+
+    links = {}
+    for entry in manifest:
+        key = entry.path.replace(os.sep, '/')
+        digest = digests.get(key)
+        if digest is None:
+            continue
+        state = (entry.size, entry.mtime_ns, digest)
+        if previous_files.get(key) == state:
+            links[entry.path] = entry.path
+        elif state in by_content:
+            links[entry.path] = by_content[state].replace('/', os.sep)
+    return links
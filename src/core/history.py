@@ -0,0 +1,351 @@
+"""
+文件历史索引模块
+在目标目录的 .tier_backup/history.db 中记录每个相对路径在各快照中的版本（大小、修改时间、内容哈希），
+回答"哪些快照中有这个文件的不同版本"时不再打开每个压缩包或遍历每个快照目录。
+
+每个层级只记录相对同一层级上一个快照的变化（新增、修改、删除），
+快照 S 中某个路径的版本即为该层级中不晚于 S 的最近一条变化记录；
+state 表保存每个层级最新快照的完整文件状态，创建快照时据此计算变化。
+删除快照时，其变化记录移交给同一层级的下一个快照（下一个快照没有自己的记录时），否则直接丢弃
+"""
+
+import os
+import json
+import stat
+import sqlite3
+import logging
+import zipfile
+from contextlib import closing
+from datetime import datetime
+
+from .catalog import get_state_dir, list_snapshots, BACKUP_TYPES
+from .archiver import read_manifest_member, MANIFEST_NAME
+from .delta import list_delta_files, DELTA_DIR_NAME
+
+HISTORY_FILE_NAME = 'history.db'
+
+# 快照中的内部文件，不记录历史
+INTERNAL_FILES = ('backup_info.json', MANIFEST_NAME)
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS snapshots (
+        id INTEGER PRIMARY KEY,
+        type TEXT NOT NULL,
+        name TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        UNIQUE (type, name)
+    )
+    """,
+    # size 为 NULL 表示该路径在此快照中被删除
+    """
+    CREATE TABLE IF NOT EXISTS changes (
+        snapshot_id INTEGER NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER,
+        mtime_ns INTEGER,
+        hash TEXT,
+        PRIMARY KEY (snapshot_id, path)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS changes_path ON changes (path)",
+    """
+    CREATE TABLE IF NOT EXISTS state (
+        type TEXT NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        hash TEXT,
+        PRIMARY KEY (type, path)
+    )
+    """
+)
+
+
+def _connect(target_dir):
+    """打开历史索引数据库，必要时创建表结构"""
+    conn = sqlite3.connect(os.path.join(get_state_dir(target_dir), HISTORY_FILE_NAME), timeout=30)
+    for statement in _SCHEMA:
+        conn.execute(statement)
+    return conn
+
+
+def _to_key(path):
+    """统一使用 / 分隔的相对路径作为索引键"""
+    return path.replace(os.sep, '/')
+
+
+def manifest_files(manifest, hashes=None):
+    """把文件清单转换为 {路径: (大小, 修改时间纳秒, 内容哈希)}；hashes 为 {路径: 哈希}（可选）"""
+    hashes = hashes or {}
+    files = {}
+    for entry in manifest:
+        key = _to_key(entry.path)
+        files[key] = (entry.size, entry.mtime_ns, hashes.get(key))
+    return files
+
+
+def _prune(conn, backup_type, name):
+    """在已打开的连接中移除一个快照的记录，返回是否存在该快照"""
+    row = conn.execute("SELECT id, timestamp FROM snapshots WHERE type = ? AND name = ?",
+                       (backup_type, name)).fetchone()
+    if row is None:
+        return False
+    snapshot_id, timestamp = row
+
+    following = conn.execute(
+        "SELECT id FROM snapshots WHERE type = ? AND (timestamp > ? OR (timestamp = ? AND id > ?)) "
+        "ORDER BY timestamp, id LIMIT 1",
+        (backup_type, timestamp, timestamp, snapshot_id)
+    ).fetchone()
+
+    if following is not None:
+        # 下一个快照没有自己的记录的路径沿用本快照的版本，把记录移交给它
+        conn.execute(
+            "UPDATE changes SET snapshot_id = ? WHERE snapshot_id = ? AND path NOT IN "
+            "(SELECT path FROM changes WHERE snapshot_id = ?)",
+            (following[0], snapshot_id, following[0])
+        )
+    else:
+        # 删除的是层级中最新的快照：把 state 回退到上一个快照的状态
+        paths = [path for (path,) in conn.execute("SELECT path FROM changes WHERE snapshot_id = ?", (snapshot_id,))]
+        for path in paths:
+            previous = conn.execute(
+                "SELECT c.size, c.mtime_ns, c.hash FROM changes c JOIN snapshots s ON s.id = c.snapshot_id "
+                "WHERE s.type = ? AND c.path = ? AND s.id != ? AND (s.timestamp < ? OR (s.timestamp = ? AND s.id < ?)) "
+                "ORDER BY s.timestamp DESC, s.id DESC LIMIT 1",
+                (backup_type, path, snapshot_id, timestamp, timestamp, snapshot_id)
+            ).fetchone()
+            if previous is None or previous[0] is None:
+                conn.execute("DELETE FROM state WHERE type = ? AND path = ?", (backup_type, path))
+            else:
+                conn.execute("INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?, ?)", (backup_type, path) + previous)
+
+    conn.execute("DELETE FROM changes WHERE snapshot_id = ?", (snapshot_id,))
+    conn.execute("DELETE FROM snapshots WHERE id = ?", (snapshot_id,))
+    return True
+
+
+def _load_state(conn, backup_type):
+    """读取层级最新快照的完整文件状态"""
+    return {
+        path: (size, mtime_ns, file_hash)
+        for path, size, mtime_ns, file_hash in conn.execute(
+            "SELECT path, size, mtime_ns, hash FROM state WHERE type = ?", (backup_type,))
+    }
+
+
+def _record(conn, backup_type, name, timestamp, files):
+    """在已打开的连接中登记一个快照的文件，返回变化的路径数"""
+    _prune(conn, backup_type, name)
+
+    latest = conn.execute("SELECT MAX(timestamp) FROM snapshots WHERE type = ?", (backup_type,)).fetchone()[0]
+    if latest is not None and latest > timestamp:
+        # 比层级中最新快照还旧的快照（如重建索引时顺序错乱）不能基于 state 计算变化
+        logging.warning(f"快照早于层级中最新的快照，跳过历史索引: {backup_type}/{name}")
+        return 0
+
+    old = _load_state(conn, backup_type)
+    changes = []
+    for path, (size, mtime_ns, file_hash) in files.items():
+        previous = old.get(path)
+        if previous is None or previous[0] != size or previous[1] != mtime_ns:
+            changes.append((path, size, mtime_ns, file_hash))
+        elif file_hash and previous[2] != file_hash:
+            # 大小和修改时间相同但内容哈希不同（内容哈希模式下发现的变化）
+            changes.append((path, size, mtime_ns, file_hash))
+    deleted = [path for path in old if path not in files]
+
+    snapshot_id = conn.execute("INSERT INTO snapshots (type, name, timestamp) VALUES (?, ?, ?)",
+                               (backup_type, name, timestamp)).lastrowid
+    conn.executemany("INSERT INTO changes VALUES (?, ?, ?, ?, ?)",
+                     [(snapshot_id,) + change for change in changes])
+    conn.executemany("INSERT INTO changes VALUES (?, ?, NULL, NULL, NULL)",
+                     [(snapshot_id, path) for path in deleted])
+
+    conn.executemany("INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?, ?)",
+                     [(backup_type,) + change for change in changes])
+    conn.executemany("DELETE FROM state WHERE type = ? AND path = ?", [(backup_type, path) for path in deleted])
+    return len(changes) + len(deleted)
+
+
+def record_snapshot_files(target_dir, backup_path, timestamp, files):
+    """登记快照中的文件（在快照写入成功后调用），返回变化的路径数
+
+    files 为 {路径: (大小, 修改时间纳秒, 内容哈希)}（见 manifest_files）。
+    同名快照已存在时（同一时间段内重复运行）先移除旧记录。索引失败只记录错误，不影响备份。
+    """
+    backup_type, name = os.path.basename(os.path.dirname(backup_path)), os.path.basename(backup_path)
+    try:
+        with closing(_connect(target_dir)) as conn, conn:
+            changed = _record(conn, backup_type, name, timestamp, files)
+        logging.debug(f"历史索引登记: {backup_type}/{name}, {changed} 个路径变化")
+        return changed
+    except sqlite3.Error as e:
+        logging.error(f"登记文件历史失败: {backup_path}, 错误: {str(e)}")
+        return 0
+
+
+def record_promoted_snapshot(target_dir, source_path, backup_path, timestamp):
+    """登记由另一个层级最新快照提升而来的快照：文件状态直接取自来源层级的 state"""
+    source_type = os.path.basename(os.path.dirname(source_path))
+    try:
+        with closing(_connect(target_dir)) as conn:
+            files = _load_state(conn, source_type)
+    except sqlite3.Error as e:
+        logging.error(f"读取文件历史失败: {source_path}, 错误: {str(e)}")
+        return 0
+    return record_snapshot_files(target_dir, backup_path, timestamp, files)
+
+
+def remove_snapshot_files(target_dir, backup_paths):
+    """在一个事务中从历史索引中移除已删除的快照"""
+    keys = [(os.path.basename(os.path.dirname(path)), os.path.basename(path)) for path in backup_paths]
+    if not keys:
+        return
+    try:
+        with closing(_connect(target_dir)) as conn, conn:
+            for backup_type, name in keys:
+                _prune(conn, backup_type, name)
+    except sqlite3.Error as e:
+        logging.error(f"移除文件历史失败: {backup_paths}, 错误: {str(e)}")
+
+
+def get_file_history(target_dir, rel_path):
+    """查询一个相对路径的所有版本，返回版本列表（从新到旧）
+
+    每个版本为字典：size、mtime_ns、hash、snapshots（包含该版本的快照路径列表，从新到旧）。
+    大小、修改时间和哈希都相同的版本合并为一个（例如不同层级中的同一个版本）。
+    """
+    key = _to_key(rel_path).strip('/')
+    existing = {os.path.abspath(b['path']): b for b in list_snapshots(target_dir)}
+    versions = {}
+
+    with closing(_connect(target_dir)) as conn:
+        for backup_type in BACKUP_TYPES:
+            rows = conn.execute(
+                "SELECT s.timestamp, s.id, c.size, c.mtime_ns, c.hash FROM changes c "
+                "JOIN snapshots s ON s.id = c.snapshot_id WHERE s.type = ? AND c.path = ? "
+                "ORDER BY s.timestamp, s.id",
+                (backup_type, key)
+            ).fetchall()
+            if not rows:
+                continue
+            snapshots = conn.execute("SELECT timestamp, id, name FROM snapshots WHERE type = ? ORDER BY timestamp, id",
+                                     (backup_type,)).fetchall()
+
+            # 按顺序合并快照列表与变化记录：每个快照取不晚于它的最近一条记录
+            index = 0
+            current = None
+            for timestamp, snapshot_id, name in snapshots:
+                while index < len(rows) and (rows[index][0], rows[index][1]) <= (timestamp, snapshot_id):
+                    current = rows[index]
+                    index += 1
+                if current is None or current[2] is None:
+                    continue
+                path = os.path.join(target_dir, backup_type, name)
+                backup = existing.get(os.path.abspath(path))
+                if backup is None:
+                    continue
+                version = versions.setdefault(current[2:], {
+                    'size': current[2], 'mtime_ns': current[3], 'hash': current[4], 'snapshots': []
+                })
+                version['snapshots'].append(backup)
+
+    result = []
+    for version in versions.values():
+        version['snapshots'].sort(key=lambda b: b['created_at'], reverse=True)
+        version['snapshots'] = [b['path'] for b in version['snapshots']]
+        result.append(version)
+    result.sort(key=lambda v: (v['mtime_ns'], v['size']), reverse=True)
+    return result
+
+
+def get_snapshot_files(target_dir, backup_path):
+    """按历史索引还原快照中的文件状态，返回 {路径: (大小, 修改时间纳秒, 内容哈希)}；索引中没有该快照时返回 None"""
+    backup_type, name = os.path.basename(os.path.dirname(backup_path)), os.path.basename(backup_path)
+    with closing(_connect(target_dir)) as conn:
+        row = conn.execute("SELECT id, timestamp FROM snapshots WHERE type = ? AND name = ?",
+                           (backup_type, name)).fetchone()
+        if row is None:
+            return None
+        snapshot_id, timestamp = row
+        files = {}
+        for path, size, mtime_ns, file_hash in conn.execute(
+                "SELECT c.path, c.size, c.mtime_ns, c.hash FROM changes c JOIN snapshots s ON s.id = c.snapshot_id "
+                "WHERE s.type = ? AND (s.timestamp < ? OR (s.timestamp = ? AND s.id <= ?)) ORDER BY s.timestamp, s.id",
+                (backup_type, timestamp, timestamp, snapshot_id)):
+            if size is None:
+                files.pop(path, None)
+            else:
+                files[path] = (size, mtime_ns, file_hash)
+    return files
+
+
+def find_version_snapshot(target_dir, rel_path, version=1):
+    """返回包含路径第 version 个版本（1 为最新）的最新快照路径，没有该版本时返回 None"""
+    versions = get_file_history(target_dir, rel_path)
+    if version < 1 or version > len(versions):
+        return None
+    return versions[version - 1]['snapshots'][0]
+
+
+def read_snapshot_files(snapshot_path):
+    """从磁盘上的快照读取文件状态（重建索引时使用），返回 {路径: (大小, 修改时间纳秒, 内容哈希)}"""
+    files = {}
+    real_path = os.path.realpath(snapshot_path)
+    if os.path.isfile(real_path):
+        with zipfile.ZipFile(real_path, 'r') as zipf:
+            manifest = read_manifest_member(zipf)
+            for zinfo in zipf.infolist():
+                if zinfo.is_dir() or zinfo.filename in INTERNAL_FILES:
+                    continue
+                entry = manifest.get(zinfo.filename)
+                mtime_ns = entry[1] if entry else int(datetime(*zinfo.date_time).timestamp()) * 1000000000
+                file_hash = entry[3] if entry and len(entry) > 3 else f"crc32:{zinfo.CRC:08x}"
+                files[zinfo.filename] = (zinfo.file_size, mtime_ns, file_hash)
+        return files
+
+    # 按内容检测变化时，backup_info.json 中记录了每个文件的内容摘要
+    digests = {}
+    try:
+        with open(os.path.join(real_path, 'backup_info.json'), 'r', encoding='utf-8') as f:
+            digests = json.load(f).get('file_digests') or {}
+    except (OSError, ValueError):
+        pass
+
+    for root, dirs, names in os.walk(real_path):
+        rel_root = os.path.relpath(root, real_path)
+        if rel_root == '.' and DELTA_DIR_NAME in dirs:
+            dirs.remove(DELTA_DIR_NAME)
+        for name in names:
+            if rel_root == '.' and name in INTERNAL_FILES:
+                continue
+            st = os.lstat(os.path.join(root, name))
+            if stat.S_ISREG(st.st_mode):
+                key = _to_key(name if rel_root == '.' else os.path.join(rel_root, name))
+                files[key] = (st.st_size, st.st_mtime_ns, digests.get(key))
+    # 以差异存储的文件按其最新版本记录
+    for key, info in list_delta_files(real_path).items():
+        files[key] = (info['size'], info['mtime_ns'], digests.get(key))
+    return files
+
+
+def rebuild_history(target_dir):
+    """从磁盘上的快照重建历史索引，返回登记的快照数量"""
+    backups = sorted(list_snapshots(target_dir), key=lambda b: (b['type'], b['timestamp'], b['created_at']))
+    count = 0
+    with closing(_connect(target_dir)) as conn, conn:
+        conn.execute("DELETE FROM changes")
+        conn.execute("DELETE FROM snapshots")
+        conn.execute("DELETE FROM state")
+        for backup in backups:
+            try:
+                files = read_snapshot_files(backup['path'])
+            except (OSError, ValueError, zipfile.BadZipFile) as e:
+                logging.warning(f"读取快照文件失败，跳过历史索引: {backup['path']}, 错误: {str(e)}")
+                continue
+            _record(conn, backup['type'], os.path.basename(backup['path']), backup['timestamp'], files)
+            count += 1
+    logging.info(f"历史索引重建完成: {target_dir}, 共 {count} 个快照")
+    return count
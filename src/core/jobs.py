@@ -0,0 +1,114 @@
+"""
+备份任务模块
+一个配置文件中可以用 jobs 列表定义多个备份任务，每个任务有自己的源目录、目标目录、压缩和保留策略，
+未在任务中设置的参数继承配置文件顶层的值。
+各任务并发执行，但按源目录和目标目录所在的设备（st_dev）限制并发：
+位于不同磁盘上的任务并行，共享同一块磁盘的任务依次执行，避免相互争抢磁头
+"""
+
+import os
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# 未配置 jobs 列表时，整个配置文件作为一个任务，使用此名称
+DEFAULT_JOB_NAME = 'default'
+# 同一设备上默认同时运行的任务数
+DEFAULT_JOBS_PER_DEVICE = 1
+
+# 准备好的备份任务：config 为合并后的任务配置，settings 为 get_run_settings() 的结果，
+# devices 为任务读写的设备号集合
+Job = namedtuple('Job', ['name', 'config', 'settings', 'devices'])
+
+
+def load_jobs(config):
+    """把配置文件拆分为备份任务列表，返回 [(任务名称, 任务配置)]
+
+    每个任务的配置为顶层配置（不含 jobs）与该任务设置的合并结果。
+    任务名称重复或多个任务使用同一个目标目录（快照目录和 Merkle 树状态会互相覆盖）时抛出 ValueError。
+    """
+    job_list = config.get('jobs')
+    if not job_list:
+        return [(config.get('name') or DEFAULT_JOB_NAME, config)]
+
+    defaults = {key: value for key, value in config.items() if key != 'jobs'}
+    jobs = []
+    names = set()
+    targets = set()
+    for index, job in enumerate(job_list):
+        if not isinstance(job, dict):
+            raise ValueError(f"备份任务必须是对象: {job}")
+        job_config = dict(defaults)
+        job_config.update(job)
+        name = job.get('name') or f"job{index + 1}"
+        job_config['name'] = name
+
+        target = job_config.get('target_directory')
+        if name in names:
+            raise ValueError(f"备份任务名称重复: {name}")
+        if target and os.path.abspath(target) in targets:
+            raise ValueError(f"多个备份任务使用同一个目标目录: {target}")
+        names.add(name)
+        if target:
+            targets.add(os.path.abspath(target))
+        jobs.append((name, job_config))
+    return jobs
+
+
+def get_path_device(path):
+    """返回路径所在的设备号；路径尚不存在时（如首次运行的目标目录）取最近的已存在的上级目录"""
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+
+def get_job_devices(source_dir, target_dir):
+    """返回任务读写的设备号集合（源目录和目标目录在同一设备上时只有一个）"""
+    return frozenset(dev for dev in (get_path_device(source_dir), get_path_device(target_dir)) if dev is not None)
+
+
+def run_jobs(jobs, run_job, max_per_device=None, max_parallel=None):
+    """按设备限制并发执行备份任务，返回 {任务名称: run_job 的返回值}
+
+    任务按列表顺序启动：只有它读写的每个设备上正在运行的任务数都少于 max_per_device 时才会启动，
+    否则等待，后面不冲突的任务可以先启动。max_parallel 为同时运行的任务总数上限（默认不限）。
+    run_job 抛出异常的任务记录错误，结果为 None。
+    """
+    max_per_device = max(1, int(max_per_device or DEFAULT_JOBS_PER_DEVICE))
+    max_parallel = max(1, int(max_parallel or len(jobs) or 1))
+    results = {}
+    pending = list(jobs)
+    active = {}
+
+    with ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='backup-job') as pool:
+        running = {}
+        while pending or running:
+            for job in list(pending):
+                if len(running) >= max_parallel:
+                    break
+                if all(active.get(dev, 0) < max_per_device for dev in job.devices):
+                    for dev in job.devices:
+                        active[dev] = active.get(dev, 0) + 1
+                    pending.remove(job)
+                    running[pool.submit(run_job, job)] = job
+                    logging.info(f"备份任务 {job.name} 开始")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                for dev in job.devices:
+                    active[dev] -= 1
+                try:
+                    results[job.name] = future.result()
+                    logging.info(f"备份任务 {job.name} 完成")
+                except Exception as e:
+                    logging.error(f"备份任务 {job.name} 失败: {str(e)}", exc_info=True)
+                    results[job.name] = None
+
+    return results
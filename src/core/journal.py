@@ -0,0 +1,274 @@
+"""
+变化日志模块
+在 Linux 上用 inotify 监视源目录，在两次备份之间把变化的路径记录到内存中的日志里。
+守护进程模式下由后台线程维护，create_backup 据此在没有变化时直接判定"未变化"，
+有变化时只重新 stat 变化的路径，不再遍历整个源目录。
+监视数量达到上限、事件队列溢出或日志过大时，回退到完整扫描。
+"""
+
+import os
+import stat
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+from .scanner import FileEntry, is_excluded, scan_directory, manifest_sort_key
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+# 日志中最多记录的路径数，超过后视为溢出并回退到完整扫描
+MAX_JOURNAL_ENTRIES = 100000
+# 后台线程检查停止信号的间隔（秒）
+POLL_SECONDS = 1.0
+
+
+def _load_libc():
+    """加载 libc 中的 inotify 函数，不支持时返回 None"""
+    if not hasattr(os, 'uname') or os.uname().sysname != 'Linux':
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+def _is_excluded_path(rel_path, is_dir=False):
+    """判断相对路径中是否有被排除的部分"""
+    parts = rel_path.split(os.sep)
+    if any(is_excluded(part, is_dir=True) for part in parts[:-1]):
+        return True
+    return is_excluded(parts[-1], is_dir=is_dir)
+
+
+class ChangeJournal:
+    """基于 inotify 的源目录变化日志
+
+    用法：start() 启动后台监视线程；每次备份调用 take_changes() 取出自上次以来的变化，
+    返回 None 时需要完整扫描，并在得到新的文件清单后调用 set_base() 作为下次增量的基准。
+    """
+
+    def __init__(self, source_dir, max_entries=MAX_JOURNAL_ENTRIES):
+        self.source_dir = os.path.abspath(source_dir)
+        self.max_entries = max_entries
+        self.manifest = None
+        self.root_hash = None
+        self._libc = _load_libc()
+        self._fd = None
+        self._watches = {}
+        self._files = set()
+        self._dirs = set()
+        self._overflowed = True
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """开始监视源目录，当前平台不支持 inotify 或监视失败时返回 False"""
+        if self._libc is None:
+            logging.info("当前平台不支持 inotify，每次备份完整扫描源目录")
+            return False
+
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            logging.warning(f"inotify 初始化失败: {os.strerror(ctypes.get_errno())}")
+            return False
+        self._fd = fd
+
+        if not self._watch_tree(''):
+            self.stop()
+            return False
+
+        self._thread = threading.Thread(target=self._run, name='change-journal', daemon=True)
+        self._thread.start()
+        logging.info(f"变化日志已启动: 监视 {len(self._watches)} 个目录")
+        return True
+
+    def stop(self):
+        """停止监视"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _add_watch(self, rel_dir):
+        """监视一个目录，监视数量达到上限时返回 False"""
+        path = os.path.join(self.source_dir, rel_dir) if rel_dir else self.source_dir
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                logging.warning("inotify 监视数量达到上限（fs.inotify.max_user_watches），回退到完整扫描")
+                return False
+            # 目录在监视前已被删除等情况，由事件或下一次扫描处理
+            logging.debug(f"无法监视目录 {path}: {os.strerror(err)}")
+            return True
+        self._watches[wd] = rel_dir
+        return True
+
+    def _watch_tree(self, rel_dir):
+        """监视目录及其所有（未被排除的）子目录"""
+        pending = [rel_dir]
+        while pending:
+            current = pending.pop()
+            if not self._add_watch(current):
+                self._overflowed = True
+                return False
+            path = os.path.join(self.source_dir, current) if current else self.source_dir
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False) and not is_excluded(entry.name, is_dir=True):
+                            pending.append(os.path.join(current, entry.name) if current else entry.name)
+            except OSError:
+                continue
+        return True
+
+    def _run(self):
+        """后台线程：读取 inotify 事件并记录到日志"""
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._fd], [], [], POLL_SECONDS)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                logging.error(f"读取 inotify 事件失败: {str(e)}")
+                with self._lock:
+                    self._overflowed = True
+                return
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                self._handle_event(wd, mask, name)
+
+    def _handle_event(self, wd, mask, name):
+        """处理一个 inotify 事件"""
+        with self._lock:
+            if mask & IN_Q_OVERFLOW:
+                logging.warning("inotify 事件队列溢出，下次备份完整扫描")
+                self._overflowed = True
+                return
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                return
+
+            rel_dir = self._watches.get(wd)
+            if rel_dir is None or self._overflowed:
+                return
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if not rel_dir:
+                    logging.warning("源目录本身被删除或移动，下次备份完整扫描")
+                    self._overflowed = True
+                return
+
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            if mask & IN_ISDIR:
+                if _is_excluded_path(rel_path, is_dir=True):
+                    return
+                if mask & (IN_MOVED_FROM | IN_MOVED_TO):
+                    # 目录移动后已有的监视仍指向旧路径，回退到完整扫描并重新建立监视
+                    self._overflowed = True
+                    return
+                if mask & IN_CREATE and not self._watch_tree(rel_path):
+                    return
+                if mask & (IN_CREATE | IN_DELETE):
+                    self._dirs.add(rel_path)
+            else:
+                if _is_excluded_path(rel_path):
+                    return
+                self._files.add(rel_path)
+
+            if len(self._files) + len(self._dirs) > self.max_entries:
+                logging.warning(f"变化日志超过 {self.max_entries} 条，下次备份完整扫描")
+                self._overflowed = True
+
+    def take_changes(self):
+        """取出并清空自上次以来的变化
+
+        返回 (变化的文件路径集合, 需要重新扫描的目录集合)；
+        尚无基准清单或日志已溢出、需要完整扫描时返回 None。此时在完整扫描开始之前清除溢出标记并重新建立监视，
+        扫描期间（以及 set_base 之前）发生的变化照常记录，下次备份时重新 stat，不会被基准清单掩盖。
+        """
+        with self._lock:
+            files, dirs = self._files, self._dirs
+            self._files, self._dirs = set(), set()
+            if not self._overflowed and self.manifest is not None:
+                return files, dirs
+            rewatch = self._overflowed and self._fd is not None
+            self._overflowed = False
+            # 完整扫描失败、没有调用 set_base 时，下次仍需完整扫描
+            self.manifest = None
+            self.root_hash = None
+            if rewatch:
+                # 溢出期间新建的目录可能没有被监视，重新建立监视（已监视的目录不会重复添加）；
+                # 监视数量达到上限时重新标记溢出
+                self._watch_tree('')
+        return None
+
+    def set_base(self, manifest, root_hash):
+        """登记本次备份使用的文件清单和根哈希，作为下次增量的基准"""
+        with self._lock:
+            self.manifest = manifest
+            self.root_hash = root_hash
+
+    def apply_changes(self, changes):
+        """把变化应用到基准清单上，只 stat 变化的路径，返回新的文件清单"""
+        files, dirs = changes
+        entries = {entry.path: entry for entry in self.manifest}
+
+        for rel_dir in dirs:
+            prefix = rel_dir + os.sep
+            for path in [p for p in entries if p.startswith(prefix)]:
+                del entries[path]
+            dir_path = os.path.join(self.source_dir, rel_dir)
+            if os.path.isdir(dir_path):
+                for entry in scan_directory(dir_path):
+                    entries[os.path.join(rel_dir, entry.path)] = entry._replace(path=os.path.join(rel_dir, entry.path))
+
+        for rel_path in files:
+            try:
+                st = os.stat(os.path.join(self.source_dir, rel_path))
+            except OSError:
+                entries.pop(rel_path, None)
+                continue
+            if stat.S_ISREG(st.st_mode):
+                entries[rel_path] = FileEntry(rel_path, st.st_size, st.st_mtime_ns, st.st_mode, st.st_ino)
+            else:
+                entries.pop(rel_path, None)
+
+        return [entries[path] for path in sorted(entries, key=manifest_sort_key)]
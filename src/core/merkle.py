@@ -0,0 +1,178 @@
+"""
+目录 Merkle 树模块
+按目录维护持久化的 Merkle 树，键为 (相对路径, 大小, 修改时间纳秒, inode)，
+覆盖整个源目录（无文件数上限），每次只重新计算条目发生变化的子树，
+并返回变化的文件路径列表和根哈希
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+from contextlib import closing
+
+from .catalog import get_state_dir, STATE_DIR_NAME
+
+MERKLE_FILE_NAME = 'merkle.db'
+
+# 进程内缓存的各目录状态：{目标目录: (数据库文件的修改时间和大小, {目录: (条目摘要, 目录哈希, 文件条目)})}
+# 守护进程多次运行之间保持有效，数据库被其他进程修改后自动失效；从数据库加载时文件条目为 None
+_tree_cache = {}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    entries_digest TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    entries TEXT NOT NULL
+)
+"""
+
+
+def _connect(target_dir):
+    """打开 Merkle 树数据库，必要时创建表结构"""
+    conn = sqlite3.connect(os.path.join(get_state_dir(target_dir), MERKLE_FILE_NAME), timeout=30)
+    conn.execute(_SCHEMA)
+    return conn
+
+
+def _db_stamp(target_dir):
+    """返回 Merkle 树数据库文件的 (修改时间, 大小)"""
+    try:
+        st = os.stat(os.path.join(target_dir, STATE_DIR_NAME, MERKLE_FILE_NAME))
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _group_by_directory(manifest):
+    """将文件清单按所在目录分组，返回 {目录: {文件名: (大小, 修改时间, inode)}}
+
+    没有直接文件的中间目录也会出现在结果中，保证每个目录都能找到父目录。
+    """
+    groups = {'': {}}
+    for entry in manifest:
+        dir_path, name = os.path.split(entry.path)
+        files = groups.get(dir_path)
+        if files is None:
+            files = groups[dir_path] = {}
+            # 补齐所有上级目录
+            parent = os.path.dirname(dir_path)
+            while parent not in groups:
+                groups[parent] = {}
+                parent = os.path.dirname(parent)
+        files[name] = (entry.size, entry.mtime_ns, entry.inode)
+    return groups
+
+
+def _entries_digest(files):
+    """计算目录内文件条目的摘要"""
+    digest = hashlib.md5()
+    for name in sorted(files):
+        size, mtime_ns, inode = files[name]
+        digest.update(f"f:{name}:{size}:{mtime_ns}:{inode}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _diff_entries(dir_path, old_files, new_files):
+    """比较目录内的文件条目，返回变化（新增、修改、删除）的文件路径"""
+    changed = []
+    for name, key in new_files.items():
+        if old_files.get(name) != key:
+            changed.append(os.path.join(dir_path, name) if dir_path else name)
+    for name in old_files:
+        if name not in new_files:
+            changed.append(os.path.join(dir_path, name) if dir_path else name)
+    return changed
+
+
+def _load_entries(conn, dir_path):
+    """从数据库读取目录保存的文件条目"""
+    row = conn.execute("SELECT entries FROM dirs WHERE path = ?", (dir_path,)).fetchone()
+    return {name: tuple(key) for name, key in json.loads(row[0]).items()} if row else {}
+
+
+def update_merkle_tree(target_dir, manifest):
+    """根据文件清单更新持久化的 Merkle 树
+
+    返回 (根哈希, 变化的文件路径列表)；首次运行时所有文件都视为变化。
+    条目未变化、且没有子目录变化的目录直接沿用保存的哈希，不重新计算摘要；
+    变化从发生变化的目录逐级标记到根目录，只有这些目录重新计算。
+    缓存中有上次的文件条目时直接比较条目，否则按条目摘要与数据库中保存的摘要比较。
+    """
+    groups = _group_by_directory(manifest)
+
+    children = {}
+    for dir_path in groups:
+        if dir_path:
+            children.setdefault(os.path.dirname(dir_path), []).append(dir_path)
+
+    key = os.path.abspath(target_dir)
+    with closing(_connect(target_dir)) as conn:
+        cached = _tree_cache.get(key)
+        if cached and cached[0] == _db_stamp(target_dir):
+            stored = cached[1]
+        else:
+            stored = {
+                path: (entries_digest, dir_hash, None)
+                for path, entries_digest, dir_hash in conn.execute("SELECT path, entries_digest, hash FROM dirs")
+            }
+
+        changed_paths = []
+        digests = {}
+        dir_hashes = {}
+        updates = []
+
+        # 已不存在的目录：其中的文件全部视为删除，父目录的子目录列表发生变化
+        removed_dirs = [path for path in stored if path not in groups]
+        dirty = {os.path.dirname(path) for path in removed_dirs if path}
+
+        # 自底向上计算：子目录先于父目录处理，变化的子目录把父目录标记为需要重新计算
+        for dir_path in sorted(groups, key=lambda p: p.count(os.sep) + (1 if p else 0), reverse=True):
+            files = groups[dir_path]
+            old = stored.get(dir_path)
+            if old is not None and old[2] is not None:
+                entries_changed = old[2] != files
+                entries_digest = _entries_digest(files) if entries_changed else old[0]
+            else:
+                entries_digest = _entries_digest(files)
+                entries_changed = old is None or old[0] != entries_digest
+            digests[dir_path] = entries_digest
+
+            if not entries_changed and dir_path not in dirty:
+                # 该子树没有任何变化
+                dir_hashes[dir_path] = old[1]
+                continue
+            if dir_path:
+                dirty.add(os.path.dirname(dir_path))
+
+            digest = hashlib.md5(entries_digest.encode('utf-8'))
+            for child in sorted(children.get(dir_path, [])):
+                digest.update(f"d:{os.path.basename(child)}:{dir_hashes[child]}\n".encode('utf-8'))
+            dir_hash = digest.hexdigest()
+            dir_hashes[dir_path] = dir_hash
+
+            if entries_changed:
+                # 只有条目变化的目录才需要取出旧条目并比较
+                old_files = {}
+                if old is not None:
+                    old_files = old[2] if old[2] is not None else _load_entries(conn, dir_path)
+                changed_paths.extend(_diff_entries(dir_path, old_files, files))
+            if old is None or old[:2] != (entries_digest, dir_hash):
+                updates.append((dir_path, entries_digest, dir_hash, json.dumps(files, separators=(',', ':'))))
+
+        for dir_path in removed_dirs:
+            old_files = stored[dir_path][2]
+            changed_paths.extend(_diff_entries(dir_path, old_files if old_files is not None
+                                               else _load_entries(conn, dir_path), {}))
+
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)", updates)
+            conn.executemany("DELETE FROM dirs WHERE path = ?", [(path,) for path in removed_dirs])
+
+        _tree_cache[key] = (_db_stamp(target_dir),
+                            {path: (digests[path], dir_hashes[path], groups[path]) for path in groups})
+
+    logging.debug(f"Merkle 树更新: {len(updates)} 个目录重新计算, {len(removed_dirs)} 个目录已删除")
+    return dir_hashes[''], changed_paths
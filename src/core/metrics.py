@@ -0,0 +1,243 @@
+"""
+运行指标模块
+记录每次运行各阶段的耗时（扫描、哈希、复制或压缩、元数据、保留策略、磁盘空间检查、层级提升），
+以及每个备份的文件数、字节数、吞吐量和压缩率，输出为：
+- JSON 运行报告（默认为目标目录下的 .tier_backup/run_report.json）
+- Prometheus node_exporter 的 textfile collector 文件（可选）
+- 守护进程模式下最近 N 次运行的滚动历史（.tier_backup/run_history.json）
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from .catalog import STATE_DIR_NAME
+
+RUN_REPORT_FILE_NAME = 'run_report.json'
+RUN_HISTORY_FILE_NAME = 'run_history.json'
+# 守护进程默认保留的运行历史条数
+DEFAULT_HISTORY_SIZE = 100
+
+# 报告中各阶段的顺序；未经过的阶段耗时为 0
+PHASES = ('scan', 'hash', 'copy', 'archive', 'metadata', 'retention', 'disk_check', 'promote')
+
+# Prometheus 指标名称前缀
+METRIC_PREFIX = 'tier_backup'
+
+
+class RunMetrics:
+    """一次运行（一个备份任务）的指标，可在多个线程中共享
+
+    phase(name) 为累计该阶段耗时的上下文管理器；record_backup() 记录一个层级的备份结果。
+    profiler 为 profiling.Profiler（未启用剖析时为 None），各阶段同时交给它剖析。
+    """
+
+    def __init__(self, job=None, target_dir=None, profiler=None):
+        self.job = job
+        self.target_dir = target_dir
+        self.profiler = profiler
+        self.started_at = datetime.now()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.backups = []
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """计时一个阶段，同一阶段的多次耗时累加"""
+        start = time.monotonic()
+        try:
+            if self.profiler is None:
+                yield
+            else:
+                with self.profiler.phase(name):
+                    yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def phase_seconds(self, name):
+        """返回某阶段目前累计的耗时"""
+        with self._lock:
+            return self.phases.get(name, 0.0)
+
+    def record_backup(self, backup_type, result, path=None, files=0, size=0, written_bytes=0, seconds=0.0,
+                      transfer_seconds=0.0, compressed=False):
+        """记录一个层级的备份结果
+
+        result 为 created（实际备份）、linked（未变化，创建软链接）、promoted（由其他层级提升）或 failed；
+        written_bytes 为实际写入的字节数（复制的字节数或压缩包大小），transfer_seconds 为复制或压缩阶段的耗时，
+        用于计算吞吐量。压缩备份的压缩率为压缩包大小 / 源数据大小。
+        """
+        backup = {
+            'type': backup_type,
+            'result': result,
+            'path': path,
+            'files': files,
+            'bytes': size,
+            'written_bytes': written_bytes,
+            'seconds': round(seconds, 3),
+            'throughput_bytes_per_second': round(size / transfer_seconds) if transfer_seconds > 0 else None,
+            'compression_ratio': round(written_bytes / size, 4) if compressed and size else None
+        }
+        with self._lock:
+            self.backups.append(backup)
+        return backup
+
+    def report(self, throttled_seconds=None):
+        """生成运行报告（可直接写入 JSON）"""
+        with self._lock:
+            backups = [dict(backup) for backup in self.backups]
+            phases = {name: round(seconds, 3) for name, seconds in self.phases.items()}
+        failed = sum(1 for backup in backups if backup['result'] == 'failed')
+        if not backups:
+            status = 'idle'
+        else:
+            status = 'failed' if failed else 'success'
+        return {
+            'job': self.job,
+            'target': self.target_dir,
+            'started_at': self.started_at.isoformat(),
+            'finished_at': datetime.now().isoformat(),
+            'seconds': round(time.monotonic() - self._start, 3),
+            'status': status,
+            'phases': phases,
+            'backups': backups,
+            'totals': {
+                'backups': len(backups),
+                'failed': failed,
+                'files': sum(backup['files'] for backup in backups),
+                'bytes': sum(backup['bytes'] for backup in backups),
+                'written_bytes': sum(backup['written_bytes'] for backup in backups)
+            },
+            'throttled_seconds': round(throttled_seconds, 3) if throttled_seconds is not None else None
+        }
+
+
+def load_metrics_config(metrics_config=None):
+    """读取配置文件中的 metrics 设置，未设置的字段使用默认值；参数无效时抛出 ValueError
+
+    字段：enabled（默认 true）、report_path（默认为目标目录下的 .tier_backup/run_report.json）、
+    prometheus_textfile（textfile collector 的 .prom 文件路径，默认不输出）、
+    history_size（守护进程保留的运行历史条数，默认 100，0 为不保留）。
+    """
+    metrics_config = metrics_config or {}
+    unknown = set(metrics_config) - {'enabled', 'report_path', 'prometheus_textfile', 'history_size'}
+    if unknown:
+        raise ValueError(f"未知的 metrics 参数: {', '.join(sorted(unknown))}")
+
+    history_size = metrics_config.get('history_size', DEFAULT_HISTORY_SIZE)
+    if isinstance(history_size, bool) or not isinstance(history_size, int) or history_size < 0:
+        raise ValueError(f"history_size 必须是非负整数: {history_size}")
+    for key in ('report_path', 'prometheus_textfile'):
+        if metrics_config.get(key) is not None and not isinstance(metrics_config[key], str):
+            raise ValueError(f"{key} 必须是文件路径: {metrics_config[key]}")
+
+    return {
+        'enabled': bool(metrics_config.get('enabled', True)),
+        'report_path': metrics_config.get('report_path'),
+        'prometheus_textfile': metrics_config.get('prometheus_textfile'),
+        'history_size': history_size
+    }
+
+
+def get_job_path(path, job_name, default_job_name):
+    """多个备份任务共用同一个配置的输出路径时，在扩展名前加上任务名称"""
+    if not path or job_name in (None, default_job_name):
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{job_name}{ext}"
+
+
+def _write_atomic(path, text):
+    """先写入临时文件再重命名，读取方（如 node_exporter）不会读到写了一半的文件"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_run_report(report, path):
+    """把运行报告写入 JSON 文件"""
+    _write_atomic(path, json.dumps(report, ensure_ascii=False, indent=2))
+
+
+def _escape_label(value):
+    """转义 Prometheus 标签值"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + '}'
+
+
+def format_prometheus(report):
+    """把运行报告转换为 Prometheus 文本格式"""
+    job = report.get('job') or ''
+    finished = datetime.fromisoformat(report['finished_at']).timestamp()
+    metrics = [
+        ('last_run_timestamp_seconds', 'gauge', '最近一次运行结束的时间',
+         [(_labels(job=job), finished)]),
+        ('last_run_duration_seconds', 'gauge', '最近一次运行的总耗时',
+         [(_labels(job=job), report['seconds'])]),
+        ('last_run_success', 'gauge', '最近一次运行是否没有失败的备份',
+         [(_labels(job=job), 0 if report['status'] == 'failed' else 1)]),
+        ('phase_duration_seconds', 'gauge', '最近一次运行各阶段的耗时',
+         [(_labels(job=job, phase=phase), seconds) for phase, seconds in report['phases'].items()]),
+        ('throttled_seconds', 'gauge', '最近一次运行因 I/O 限速等待的时间',
+         [(_labels(job=job), report.get('throttled_seconds') or 0)])
+    ]
+
+    backup_metrics = (
+        ('backup_files', '备份的文件数', 'files'),
+        ('backup_bytes', '备份的源数据字节数', 'bytes'),
+        ('backup_written_bytes', '实际写入的字节数', 'written_bytes'),
+        ('backup_duration_seconds', '备份的耗时', 'seconds'),
+        ('backup_throughput_bytes_per_second', '复制或压缩阶段的吞吐量', 'throughput_bytes_per_second'),
+        ('backup_compression_ratio', '压缩包大小与源数据大小之比', 'compression_ratio')
+    )
+    for name, help_text, key in backup_metrics:
+        samples = [
+            (_labels(job=job, type=backup['type'], result=backup['result']), backup[key])
+            for backup in report['backups'] if backup.get(key) is not None
+        ]
+        if samples:
+            metrics.append((name, 'gauge', f"最近一次运行中{help_text}", samples))
+
+    lines = []
+    for name, metric_type, help_text, samples in metrics:
+        full_name = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# HELP {full_name} {help_text}")
+        lines.append(f"# TYPE {full_name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{full_name}{labels} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus_textfile(report, path):
+    """把运行报告写为 textfile collector 读取的 .prom 文件"""
+    _write_atomic(path, format_prometheus(report))
+
+
+class RunHistory:
+    """守护进程最近 N 次运行的报告，每次追加后写入目标目录下的 run_history.json（启动时读回）"""
+
+    def __init__(self, target_dir, size=DEFAULT_HISTORY_SIZE):
+        self.path = os.path.join(target_dir, STATE_DIR_NAME, RUN_HISTORY_FILE_NAME)
+        self.runs = deque(maxlen=size)
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.runs.extend(json.load(f))
+        except (OSError, ValueError, TypeError):
+            pass
+
+    def append(self, report):
+        """追加一次运行的报告并保存"""
+        self.runs.append(report)
+        write_run_report(list(self.runs), self.path)
@@ -0,0 +1,317 @@
+"""
+性能剖析模块
+备份超出时间窗口而无法在本地复现时，在生产环境中直接剖析：
+- 按阶段（见 metrics.PHASES，run 为整个任务的运行）用 cProfile 或采样剖析器记录耗时的调用
+- 用 tracemalloc 记录各阶段的内存峰值和运行结束时的主要内存分配
+- 慢文件追踪：单个文件的哈希、复制或压缩超过阈值时记录日志
+剖析结果按运行写入运行报告旁的 profiles/ 目录。未启用时不创建剖析器，各阶段只多一次 None 判断
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from .metrics import PHASES
+
+PROFILERS = ('cprofile', 'sampling')
+# 可剖析的阶段：run 为整个任务的运行，其余与运行报告中的阶段相同
+PROFILE_PHASES = ('run',) + PHASES
+PROFILES_DIR_NAME = 'profiles'
+
+DEFAULT_SAMPLE_INTERVAL = 0.005
+DEFAULT_KEEP_RUNS = 20
+# 文本报告中列出的函数（或内存分配位置）数
+DEFAULT_TOP = 40
+# tracemalloc 记录的调用栈深度
+TRACEMALLOC_FRAMES = 10
+# 运行报告中最多列出的慢文件数（日志中记录全部）
+SLOW_FILE_LIMIT = 100
+
+
+class SlowFileTracer:
+    """记录哈希、复制或压缩单个文件超过 threshold 秒的情况（可在多个线程中共享）"""
+
+    def __init__(self, threshold, limit=SLOW_FILE_LIMIT):
+        self.threshold = threshold
+        self.limit = limit
+        self.count = 0
+        self.slow_files = []
+        self._lock = threading.Lock()
+
+    def wrap(self, stage, func, target_index=0):
+        """返回计时的 func；第 target_index 个参数为清单条目（有 path 和 size）或文件路径"""
+        def traced(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.monotonic() - start
+                if elapsed >= self.threshold:
+                    self._record(stage, args[target_index], elapsed)
+        return traced
+
+    def _record(self, stage, target, elapsed):
+        path = getattr(target, 'path', target)
+        size = getattr(target, 'size', None)
+        logging.warning(f"慢文件: {stage} {path} 耗时 {elapsed:.3f} 秒"
+                        + (f" ({size} 字节)" if size is not None else ""))
+        with self._lock:
+            self.count += 1
+            if len(self.slow_files) < self.limit:
+                self.slow_files.append({'stage': stage, 'path': path, 'size': size, 'seconds': round(elapsed, 3)})
+
+
+class SamplingProfiler:
+    """采样剖析器：后台线程每隔 interval 秒记录一次所有其他线程的调用栈，开销与函数调用次数无关
+
+    可多次 start() / stop()，样本累计。结果为折叠栈格式（flamegraph.pl、speedscope 等工具可直接读取）。
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write(self, folded_path, text_path, top=DEFAULT_TOP):
+        """写出折叠栈文件和按自身样本数排序的函数列表"""
+        with open(folded_path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        with open(text_path, 'w', encoding='utf-8') as f:
+            f.write(f"采样 {self.samples} 次，间隔 {self.interval} 秒\n\n")
+            for function, count in leaves.most_common(top):
+                f.write(f"{count:8d} {count / total:7.2%}  {function}\n")
+
+
+def load_profiling_config(profiling_config=None):
+    """读取配置文件中的 profiling 设置，未设置的字段使用默认值；参数无效时抛出 ValueError
+
+    字段：enabled（是否剖析各阶段，默认 false）、profiler（cprofile/sampling）、phases（默认 ["run"]）、
+    tracemalloc（是否记录内存，默认 false）、sample_interval（采样间隔秒数）、
+    slow_file_seconds（慢文件阈值，未设置时不追踪；不需要 enabled）、keep_runs（保留的剖析结果数）、top。
+    """
+    profiling_config = profiling_config or {}
+    known = {'enabled', 'profiler', 'phases', 'tracemalloc', 'sample_interval', 'slow_file_seconds',
+             'keep_runs', 'top'}
+    unknown = set(profiling_config) - known
+    if unknown:
+        raise ValueError(f"未知的 profiling 参数: {', '.join(sorted(unknown))}")
+
+    config = {
+        'enabled': bool(profiling_config.get('enabled', False)),
+        'profiler': profiling_config.get('profiler', 'cprofile'),
+        'phases': profiling_config.get('phases', ['run']),
+        'tracemalloc': bool(profiling_config.get('tracemalloc', False)),
+        'sample_interval': profiling_config.get('sample_interval', DEFAULT_SAMPLE_INTERVAL),
+        'slow_file_seconds': profiling_config.get('slow_file_seconds'),
+        'keep_runs': profiling_config.get('keep_runs', DEFAULT_KEEP_RUNS),
+        'top': profiling_config.get('top', DEFAULT_TOP)
+    }
+    if config['profiler'] not in PROFILERS:
+        raise ValueError(f"未知的剖析器: {config['profiler']}，可选: {', '.join(PROFILERS)}")
+    if isinstance(config['phases'], str) or not all(phase in PROFILE_PHASES for phase in config['phases']):
+        raise ValueError(f"phases 必须是阶段名称的列表，可选: {', '.join(PROFILE_PHASES)}")
+    for key in ('sample_interval', 'slow_file_seconds'):
+        value = config[key]
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0):
+            raise ValueError(f"{key} 必须是正数: {value}")
+    for key in ('keep_runs', 'top'):
+        if isinstance(config[key], bool) or not isinstance(config[key], int) or config[key] < 1:
+            raise ValueError(f"{key} 必须是正整数: {config[key]}")
+    return config
+
+
+def enable_profiling(config):
+    """命令行的 --profile：为配置中的全部任务启用各阶段剖析，其余剖析设置保持不变"""
+    sections = [config] + [job for job in config.get('jobs') or [] if isinstance(job, dict) and 'profiling' in job]
+    for section in sections:
+        section['profiling'] = dict(section.get('profiling') or {}, enabled=True)
+
+
+def create_profiler(profiling_config, report_dir, job_name):
+    """按设置创建一次运行的剖析器；既未启用剖析也未设置慢文件阈值时返回 None"""
+    if not profiling_config or not (profiling_config['enabled'] or profiling_config['slow_file_seconds']):
+        return None
+    return Profiler(profiling_config, os.path.join(report_dir, PROFILES_DIR_NAME), job_name)
+
+
+class Profiler:
+    """一次运行（一个备份任务）的剖析器：phase() 剖析选中的阶段，finish() 写出结果"""
+
+    def __init__(self, config, profiles_dir, job_name):
+        self.config = config
+        self.profiles_dir = profiles_dir
+        self.job_name = job_name
+        self.started_at = datetime.now()
+        self.tracer = SlowFileTracer(config['slow_file_seconds']) if config['slow_file_seconds'] else None
+        self.phases = set(config['phases']) if config['enabled'] else set()
+        self.memory_peaks = {}
+        self._profiles = {}
+        self._active = threading.local()
+        self._lock = threading.Lock()
+        self._tracing = False
+        if config['enabled'] and config['tracemalloc'] and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._tracing = True
+
+    def _get_profile(self, name):
+        with self._lock:
+            if name not in self._profiles:
+                if self.config['profiler'] == 'sampling':
+                    self._profiles[name] = SamplingProfiler(self.config['sample_interval'])
+                else:
+                    self._profiles[name] = cProfile.Profile()
+            return self._profiles[name]
+
+    @contextmanager
+    def phase(self, name):
+        """剖析一个阶段；未选中的阶段、或同一线程中已在剖析外层阶段时直接执行"""
+        if name not in self.phases or getattr(self._active, 'phase', None):
+            yield
+            return
+
+        profile = self._get_profile(name)
+        try:
+            if self.config['profiler'] == 'sampling':
+                profile.start()
+            else:
+                profile.enable()
+        except ValueError as e:
+            # cProfile 在同一时间只能有一个（如并行的另一个任务正在剖析）
+            logging.warning(f"无法剖析阶段 {name}: {str(e)}")
+            yield
+            return
+
+        self._active.phase = name
+        if self._tracing and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            if self.config['profiler'] == 'sampling':
+                profile.stop()
+            else:
+                profile.disable()
+            self._active.phase = None
+            if self._tracing:
+                peak = tracemalloc.get_traced_memory()[1]
+                with self._lock:
+                    self.memory_peaks[name] = max(peak, self.memory_peaks.get(name, 0))
+
+    def _write_memory(self, path, top):
+        """写出运行结束时仍占用内存最多的分配位置"""
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>')
+        ])
+        current, peak = tracemalloc.get_traced_memory()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"当前 {current} 字节, 峰值 {peak} 字节\n")
+            for name, phase_peak in sorted(self.memory_peaks.items()):
+                f.write(f"阶段 {name} 峰值 {phase_peak} 字节\n")
+            f.write("\n")
+            for stat in snapshot.statistics('lineno')[:top]:
+                f.write(f"{stat}\n")
+        return peak
+
+    def _prune(self):
+        """只保留本任务最近 keep_runs 次运行的剖析结果"""
+        suffix = f"-{self.job_name}"
+        runs = sorted(name for name in os.listdir(self.profiles_dir) if name.endswith(suffix))
+        for name in runs[:-self.config['keep_runs']]:
+            shutil.rmtree(os.path.join(self.profiles_dir, name), ignore_errors=True)
+
+    def finish(self):
+        """写出本次运行的剖析结果，返回写入运行报告的摘要字典"""
+        summary = {}
+        if self.tracer is not None:
+            summary['slow_file_seconds'] = self.tracer.threshold
+            summary['slow_file_count'] = self.tracer.count
+            summary['slow_files'] = list(self.tracer.slow_files)
+        if not self.config['enabled']:
+            return summary
+
+        run_dir = os.path.join(self.profiles_dir, f"{self.started_at.strftime('%Y%m%d-%H%M%S')}-{self.job_name}")
+        os.makedirs(run_dir, exist_ok=True)
+        top = self.config['top']
+        files = []
+        for name, profile in sorted(self._profiles.items()):
+            text_path = os.path.join(run_dir, f"{name}.txt")
+            if isinstance(profile, SamplingProfiler):
+                folded_path = os.path.join(run_dir, f"{name}.folded")
+                profile.write(folded_path, text_path, top)
+                files.extend([folded_path, text_path])
+                continue
+            stats_path = os.path.join(run_dir, f"{name}.pstats")
+            profile.dump_stats(stats_path)
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(top)
+            with open(text_path, 'w', encoding='utf-8') as f:
+                f.write(stream.getvalue())
+            files.extend([stats_path, text_path])
+
+        if self._tracing:
+            memory_path = os.path.join(run_dir, 'memory.txt')
+            summary['memory_peak_bytes'] = self._write_memory(memory_path, top)
+            summary['phase_memory_peak_bytes'] = dict(self.memory_peaks)
+            files.append(memory_path)
+            tracemalloc.stop()
+            self._tracing = False
+
+        if self.tracer is not None:
+            slow_path = os.path.join(run_dir, 'slow_files.json')
+            with open(slow_path, 'w', encoding='utf-8') as f:
+                json.dump(self.tracer.slow_files, f, ensure_ascii=False, indent=2)
+            files.append(slow_path)
+
+        summary['profiler'] = self.config['profiler']
+        summary['directory'] = run_dir
+        summary['files'] = files
+        self._prune()
+        logging.info(f"性能剖析结果已写入 {run_dir}")
+        return summary
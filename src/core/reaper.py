@@ -0,0 +1,209 @@
+"""
+回收站模块
+过期的目录快照不再在备份过程中同步 rmtree，而是原子地重命名到目标目录下的 .trash 中，
+由回收线程在后台用线程池并行、限速地删除其中的文件。
+回收站中的条目在完全删除之前一直保留，中断的回收在下次运行时继续
+"""
+
+import os
+import time
+import errno
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .throttle import RateLimiter
+
+# 目标目录下的回收站目录，与快照在同一文件系统上，重命名是原子操作
+TRASH_DIR_NAME = '.trash'
+
+
+def get_reap_workers(workers=None):
+    """返回回收使用的线程数；unlink 会释放 GIL，默认与 ThreadPoolExecutor 一致"""
+    if workers:
+        return max(1, int(workers))
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def get_trash_dir(target_dir):
+    """获取目标目录下的回收站路径"""
+    return os.path.join(target_dir, TRASH_DIR_NAME)
+
+
+def list_trash(target_dir):
+    """列出回收站中等待删除的条目路径（按放入的先后排序）"""
+    trash_dir = get_trash_dir(target_dir)
+    try:
+        names = sorted(os.listdir(trash_dir))
+    except OSError:
+        return []
+    return [os.path.join(trash_dir, name) for name in names]
+
+
+def move_to_trash(backup_path):
+    """把快照目录原子地重命名到回收站中，返回回收站中的路径
+
+    备份路径为 <目标目录>/<类型>/<名称>；名称前加上纳秒时间，按放入顺序回收，且不会与同名快照冲突。
+    """
+    backup_type = os.path.basename(os.path.dirname(backup_path))
+    trash_dir = get_trash_dir(os.path.dirname(os.path.dirname(backup_path)))
+    os.makedirs(trash_dir, exist_ok=True)
+    trash_path = os.path.join(trash_dir, f"{time.time_ns()}-{backup_type}-{os.path.basename(backup_path)}")
+    os.rename(backup_path, trash_path)
+    logging.info(f"快照移入回收站: {backup_path} -> {trash_path}")
+    return trash_path
+
+
+def _unlink(path, limiter):
+    """删除一个文件（在工作线程中执行），已被其他回收者删除时忽略"""
+    limiter.acquire()
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        return 0
+    return 1
+
+
+def _rmdir(path):
+    """删除空目录，返回是否已不存在"""
+    try:
+        os.rmdir(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        if e.errno in (errno.ENOTEMPTY, errno.EEXIST):
+            # 另一个回收者仍在删除其中的文件，或本次回收被中断
+            return False
+        raise
+    return True
+
+
+def reap_entry(trash_path, pool, limiter, stop_event=None, window=128):
+    """删除回收站中的一个条目，返回 (是否已完全删除, 删除的文件数)
+
+    目录中的文件在线程池中并行删除，同时在途的数量有上限；子目录在其中的文件删除后自底向上删除。
+    stop_event 被设置时尽快返回，剩余部分留在回收站中下次继续。
+    """
+    if os.path.islink(trash_path) or not os.path.isdir(trash_path):
+        return True, _unlink(trash_path, limiter)
+
+    removed = 0
+    dirs = []
+    pending = set()
+
+    def collect(done):
+        nonlocal removed
+        for future in done:
+            pending.discard(future)
+            removed += future.result()
+
+    stack = [trash_path]
+    while stack:
+        dir_path = stack.pop()
+        dirs.append(dir_path)
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    if stop_event is not None and stop_event.is_set():
+                        collect(list(pending))
+                        return False, removed
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    pending.add(pool.submit(_unlink, entry.path, limiter))
+                    if len(pending) >= window:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+        except FileNotFoundError:
+            continue
+    collect(list(pending))
+
+    # 深度优先列出的目录倒序即为自底向上
+    complete = all([_rmdir(dir_path) for dir_path in reversed(dirs)])
+    return complete, removed
+
+
+def reap_trash(target_dir, workers=None, rate=None, stop_event=None):
+    """删除回收站中的全部条目，返回统计字典：entries（完全删除的条目数）、files（删除的文件数）、
+    remaining（仍留在回收站中的条目数）、seconds（耗时）
+
+    rate 为每秒最多删除的文件数，为 None 或 0 时不限速。
+    """
+    start = time.monotonic()
+    stats = {'entries': 0, 'files': 0, 'remaining': 0}
+    entries = list_trash(target_dir)
+    if entries:
+        workers = get_reap_workers(workers)
+        limiter = RateLimiter(rate)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for trash_path in entries:
+                if stop_event is not None and stop_event.is_set():
+                    stats['remaining'] += 1
+                    continue
+                try:
+                    complete, removed = reap_entry(trash_path, pool, limiter, stop_event, workers * 4)
+                except OSError as e:
+                    logging.error(f"回收站条目删除失败: {trash_path}, 错误: {str(e)}")
+                    complete, removed = False, 0
+                stats['files'] += removed
+                if complete:
+                    stats['entries'] += 1
+                else:
+                    stats['remaining'] += 1
+
+    stats['seconds'] = round(time.monotonic() - start, 3)
+    if entries:
+        logging.info(f"回收站清理: 删除 {stats['entries']} 个条目 ({stats['files']} 个文件), "
+                     f"剩余 {stats['remaining']} 个, 耗时 {stats['seconds']} 秒")
+    return stats
+
+
+class Reaper:
+    """后台回收线程
+
+    start() 在后台清空回收站（已在运行时不重复启动）；wait() 等待本轮回收完成；
+    stop() 让回收尽快停止，未删除的部分留到下次运行。
+    """
+
+    def __init__(self, target_dir, workers=None, rate=None):
+        self.target_dir = target_dir
+        self.workers = workers
+        self.rate = rate
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """回收站不为空时启动后台回收，返回是否有回收在进行"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return True
+            if not list_trash(self.target_dir):
+                return False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='trash-reaper', daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self):
+        """后台线程：清空回收站，直到为空或收到停止信号"""
+        try:
+            # 回收期间可能有新的条目放入回收站；某一轮没有任何进展时停止，避免空转
+            while not self._stop.is_set() and list_trash(self.target_dir):
+                if not reap_trash(self.target_dir, self.workers, self.rate, self._stop)['entries']:
+                    break
+        except Exception as e:
+            logging.error(f"后台回收失败: {str(e)}", exc_info=True)
+
+    def wait(self, timeout=None):
+        """等待后台回收完成，返回是否已完成"""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    def stop(self):
+        """停止后台回收并等待线程退出"""
+        self._stop.set()
+        self.wait()
@@ -0,0 +1,246 @@
+"""
+恢复模块
+从快照中恢复文件：软链接快照解析为实际存储数据的快照；
+压缩快照只读取中央目录并直接定位到需要的成员，恢复单个文件的耗时与压缩包大小无关；
+整棵目录树在线程池中并行解压或复制，目录快照支持时用 reflink 克隆或硬链接，并恢复修改时间；
+以差异存储的大文件按差异链重建
+"""
+
+import os
+import stat
+import time
+import fnmatch
+import logging
+import zipfile
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from .catalog import list_snapshots, BACKUP_TYPES
+from .archiver import read_manifest_member, MANIFEST_NAME
+from .copier import detect_copy_methods, copy_file, get_copy_workers
+from .retention import parse_snapshot_time
+from .delta import list_delta_files, restore_delta_file, DELTA_DIR_NAME
+
+# 快照中的内部文件，不会被恢复
+INTERNAL_FILES = ('backup_info.json', MANIFEST_NAME)
+# 解压时的块大小
+CHUNK_SIZE = 1024 * 1024
+
+
+def _snapshot_name(backup):
+    """返回快照的名称（压缩快照不含 .zip 后缀）"""
+    name = os.path.basename(backup['path'])
+    return name[:-4] if backup['compressed'] and name.endswith('.zip') else name
+
+
+def resolve_snapshot(target_dir, snapshot=None, backup_type=None):
+    """在快照目录中查找要恢复的快照，返回快照字典（另含 physical_path：实际存储数据的路径）
+
+    snapshot 可以是快照路径、名称（如 2025-01-15_0900，可带 .zip 后缀）或 <类型>/<名称>；
+    为 None 时选择 backup_type（默认所有层级）中最新的快照。软链接快照解析为其实际目标。
+    找不到时抛出 FileNotFoundError。
+    """
+    if snapshot and not os.path.isabs(snapshot):
+        head, sep, tail = snapshot.replace(os.sep, '/').partition('/')
+        if sep and head in BACKUP_TYPES:
+            backup_type, snapshot = head, tail
+
+    candidates = list_snapshots(target_dir, backup_type)
+    if snapshot:
+        wanted = snapshot[:-4] if snapshot.endswith('.zip') else snapshot
+        matches = [
+            b for b in candidates
+            if os.path.abspath(b['path']) == os.path.abspath(snapshot) or _snapshot_name(b) == wanted
+        ]
+    else:
+        matches = candidates
+    if not matches:
+        raise FileNotFoundError(f"找不到快照: {snapshot or backup_type or target_dir}")
+
+    # 选择最新的快照；同名快照（如同一天的每日和每周快照）选择最近创建的一个
+    backup = dict(max(matches, key=lambda b: (parse_snapshot_time(b['timestamp']) or datetime.min, b['created_at'])))
+    physical_path = backup.get('symlink_target') or backup['path']
+    if os.path.islink(physical_path):
+        physical_path = os.path.realpath(physical_path)
+    if not os.path.exists(physical_path):
+        raise FileNotFoundError(f"快照数据不存在: {physical_path}")
+    backup['physical_path'] = physical_path
+    return backup
+
+
+def matches_patterns(rel_path, patterns):
+    """判断相对路径（以 / 分隔）是否匹配任一 glob 模式；模式为目录时匹配其中的全部文件"""
+    if not patterns:
+        return True
+    for pattern in patterns:
+        pattern = pattern.replace(os.sep, '/').strip('/')
+        if fnmatch.fnmatchcase(rel_path, pattern) or rel_path.startswith(pattern + '/'):
+            return True
+    return False
+
+
+def _safe_dest(dest_dir, rel_path):
+    """返回成员在恢复目录中的路径，拒绝绝对路径和 .. 等越出恢复目录的成员名"""
+    parts = [part for part in rel_path.split('/') if part not in ('', '.')]
+    if not parts or '..' in parts or os.path.isabs(rel_path) or ':' in parts[0]:
+        raise ValueError(f"不安全的成员路径: {rel_path}")
+    return os.path.join(dest_dir, *parts)
+
+
+def _set_mtime(path, mtime_ns):
+    """恢复文件的修改时间（访问时间设为相同值）"""
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def _extract_member(zipf, zinfo, dest, mtime_ns):
+    """解压单个成员（在工作线程中执行），返回写入的字节数
+
+    各线程共享同一个 ZipFile：zipfile 对底层文件的读取加锁并各自定位，解压在锁外并行进行。
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if os.path.lexists(dest) and not os.path.isfile(dest):
+        raise IsADirectoryError(f"恢复目标已存在且不是文件: {dest}")
+    with zipf.open(zinfo) as src, open(dest, 'wb') as dst:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(chunk)
+
+    mode = (zinfo.external_attr >> 16) & 0xFFFF
+    if mode and stat.S_ISREG(mode):
+        os.chmod(dest, stat.S_IMODE(mode))
+    if mtime_ns is None:
+        mtime_ns = int(time.mktime(zinfo.date_time + (0, 0, -1))) * 1000000000
+    _set_mtime(dest, mtime_ns)
+    return zinfo.file_size
+
+
+def restore_archive(archive_path, dest_dir, patterns=None, workers=None):
+    """从压缩快照中恢复匹配 patterns 的文件，返回统计字典：files、bytes
+
+    只读取中央目录，然后直接定位到匹配的成员；修改时间取自压缩包内的文件清单（纳秒精度），
+    旧版本压缩包按 ZIP 中记录的时间（2 秒精度）恢复。
+    """
+    stats = {'files': 0, 'bytes': 0}
+    with zipfile.ZipFile(archive_path, 'r') as zipf:
+        manifest = read_manifest_member(zipf)
+        selected = [
+            zinfo for zinfo in zipf.infolist()
+            if not zinfo.is_dir() and zinfo.filename not in INTERNAL_FILES
+            and matches_patterns(zinfo.filename, patterns)
+        ]
+        if not selected:
+            return stats
+
+        def extract(zinfo):
+            entry = manifest.get(zinfo.filename)
+            return _extract_member(zipf, zinfo, _safe_dest(dest_dir, zinfo.filename), entry[1] if entry else None)
+
+        if len(selected) == 1:
+            sizes = [extract(selected[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=get_copy_workers(workers)) as pool:
+                sizes = list(pool.map(extract, selected))
+
+    stats['files'] = len(sizes)
+    stats['bytes'] = sum(sizes)
+    return stats
+
+
+def _restore_file(src, dest, st, methods, link):
+    """恢复目录快照中的一个文件（在工作线程中执行），返回使用的方式（linked/reflink/复制方式）"""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if os.path.lexists(dest):
+        os.unlink(dest)
+    if link:
+        try:
+            os.link(src, dest)
+            return 'linked'
+        except OSError as e:
+            logging.debug(f"硬链接失败，改为复制: {src}, 错误: {str(e)}")
+    method = copy_file(src, dest, methods)
+    os.chmod(dest, stat.S_IMODE(st.st_mode))
+    _set_mtime(dest, st.st_mtime_ns)
+    return method
+
+
+def _restore_delta(info, dest):
+    """重建一个以差异存储的文件（在工作线程中执行），返回 'rebuilt'"""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if os.path.lexists(dest):
+        os.unlink(dest)
+    restore_delta_file(info, dest)
+    return 'rebuilt'
+
+
+def restore_directory(snapshot_path, dest_dir, patterns=None, workers=None, link=False):
+    """从目录快照中恢复匹配 patterns 的文件，返回统计字典：files、bytes、linked、cloned、rebuilt
+
+    支持时用 reflink 克隆（写时复制，与快照互不影响），否则在内核中复制；
+    link 为 True 时直接硬链接到快照中的文件（最快，但修改恢复出的文件会同时修改快照）。
+    以差异存储的文件（见 delta 模块）按差异链重建，不受 link 影响。
+    """
+    stats = {'files': 0, 'bytes': 0, 'linked': 0, 'cloned': 0, 'rebuilt': 0}
+    methods = detect_copy_methods()
+    tasks = []
+
+    for root, dirs, files in os.walk(snapshot_path):
+        rel_root = os.path.relpath(root, snapshot_path)
+        if rel_root == '.' and DELTA_DIR_NAME in dirs:
+            dirs.remove(DELTA_DIR_NAME)
+        dirs.sort()
+        for name in sorted(files):
+            rel_path = name if rel_root == '.' else os.path.join(rel_root, name)
+            if rel_root == '.' and name in INTERNAL_FILES:
+                continue
+            if not matches_patterns(rel_path.replace(os.sep, '/'), patterns):
+                continue
+            src = os.path.join(root, name)
+            st = os.lstat(src)
+            if stat.S_ISREG(st.st_mode):
+                tasks.append((src, os.path.join(dest_dir, rel_path), st))
+    deltas = [
+        (info, _safe_dest(dest_dir, rel_path)) for rel_path, info in sorted(list_delta_files(snapshot_path).items())
+        if matches_patterns(rel_path, patterns)
+    ]
+
+    with ThreadPoolExecutor(max_workers=get_copy_workers(workers)) as pool:
+        futures = [pool.submit(_restore_file, src, dest, st, methods, link) for src, dest, st in tasks]
+        futures.extend(pool.submit(_restore_delta, info, dest) for info, dest in deltas)
+        sizes = [st.st_size for _, _, st in tasks] + [info['size'] for info, _ in deltas]
+        for size, future in zip(sizes, futures):
+            method = future.result()
+            stats['files'] += 1
+            stats['bytes'] += size
+            if method == 'linked':
+                stats['linked'] += 1
+            elif method == 'reflink':
+                stats['cloned'] += 1
+            elif method == 'rebuilt':
+                stats['rebuilt'] += 1
+    return stats
+
+
+def restore_snapshot(target_dir, dest_dir, snapshot=None, backup_type=None, patterns=None, workers=None,
+                     link=False):
+    """把快照（默认最新的一个）中匹配 patterns 的文件恢复到 dest_dir
+
+    patterns 为相对快照根目录的 glob 模式列表（以 / 分隔，目录匹配其中的全部文件），为空时恢复整棵目录树。
+    返回统计字典：snapshot（实际读取的快照路径）、files、bytes、seconds 等。
+    """
+    start = time.monotonic()
+    backup = resolve_snapshot(target_dir, snapshot, backup_type)
+    physical_path = backup['physical_path']
+    os.makedirs(dest_dir, exist_ok=True)
+
+    if backup['compressed']:
+        stats = restore_archive(physical_path, dest_dir, patterns, workers)
+    else:
+        stats = restore_directory(physical_path, dest_dir, patterns, workers, link)
+
+    stats['snapshot'] = physical_path
+    stats['seconds'] = round(time.monotonic() - start, 3)
+    logging.info(f"恢复完成: {backup['path']} -> {dest_dir}, {stats['files']} 个文件 ({stats['bytes']} 字节), "
+                 f"耗时 {stats['seconds']} 秒")
+    return stats
@@ -0,0 +1,140 @@
+"""
+保留策略模块
+按配置文件中的 retention 为每个层级计算要删除的快照：
+支持 keep_last、keep_hourly/daily/weekly/monthly/yearly、keep_within_days 以及按年龄稀疏化（thin）规则，
+任一规则选中的快照都会保留。所有快照按解析后的时间排序，一次遍历得到完整的删除集合
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+from .catalog import BACKUP_TYPES
+
+# 快照名称中的时间格式：每小时备份带时分，每日和每周备份只有日期
+TIMESTAMP_FORMATS = ('%Y-%m-%d_%H%M', '%Y-%m-%d')
+
+# 各层级的默认保留数量
+DEFAULT_RETENTION = {
+    'hourly': {'keep_last': 24},
+    'daily': {'keep_last': 30},
+    'weekly': {'keep_last': 52}
+}
+
+# 按时间段保留的规则：每个时间段保留最新的一个快照，共保留最近 N 个时间段
+BUCKET_RULES = {
+    'keep_hourly': lambda t: (t.year, t.month, t.day, t.hour),
+    'keep_daily': lambda t: t.date(),
+    'keep_weekly': lambda t: t.isocalendar()[:2],
+    'keep_monthly': lambda t: (t.year, t.month),
+    'keep_yearly': lambda t: t.year
+}
+
+RULE_KEYS = ('keep_last', 'keep_within_days', 'thin') + tuple(BUCKET_RULES)
+
+
+def parse_snapshot_time(timestamp):
+    """解析快照名称中的时间戳，无法识别时返回 None"""
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(timestamp, fmt)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def load_retention_policy(retention_config=None):
+    """合并配置文件中的 retention 与默认保留策略，返回 {层级: 规则}
+
+    配置了某个层级时使用该层级的完整规则，未配置的层级使用默认值；
+    规则名称或取值错误、或者某个层级的规则不保留任何快照（如 {} 或全部为 0）时抛出 ValueError。
+    """
+    policy = {}
+    retention_config = retention_config or {}
+    for backup_type in retention_config:
+        if backup_type not in BACKUP_TYPES:
+            raise ValueError(f"未知的备份类型: {backup_type}")
+
+    for backup_type in BACKUP_TYPES:
+        rules = dict(retention_config.get(backup_type, DEFAULT_RETENTION[backup_type]))
+        for key, value in rules.items():
+            if key not in RULE_KEYS:
+                raise ValueError(f"未知的保留规则: {backup_type}.{key}")
+            if key == 'thin':
+                for rule in value:
+                    if rule.get('keep_every_days', 0) <= 0 or rule.get('older_than_days', -1) < 0:
+                        raise ValueError(f"稀疏化规则需要 older_than_days 和正数的 keep_every_days: {rule}")
+            elif not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(f"保留规则的值必须是非负数: {backup_type}.{key}")
+        if not any(rules.values()):
+            raise ValueError(f"保留规则不保留任何快照: {backup_type}")
+        policy[backup_type] = rules
+    return policy
+
+
+def select_kept(snapshots, rules, now):
+    """按规则选出要保留的快照
+
+    snapshots 为 [(时间, 快照)]，按时间从新到旧排序；返回保留的快照下标集合。
+    最新的快照（通常是刚创建的备份）总是保留。
+    """
+    kept = set(range(min(max(int(rules.get('keep_last', 0)), 1), len(snapshots))))
+
+    for key, bucket_of in BUCKET_RULES.items():
+        count = int(rules.get(key, 0))
+        last_bucket = None
+        for index, (time, _) in enumerate(snapshots):
+            if count <= 0:
+                break
+            bucket = bucket_of(time)
+            if bucket != last_bucket:
+                kept.add(index)
+                last_bucket = bucket
+                count -= 1
+
+    if rules.get('keep_within_days'):
+        cutoff = now - timedelta(days=rules['keep_within_days'])
+        kept.update(index for index, (time, _) in enumerate(snapshots) if time >= cutoff)
+
+    for rule in rules.get('thin', []):
+        # 早于 older_than_days 的快照从旧到新，每 keep_every_days 最多保留一个
+        cutoff = now - timedelta(days=rule['older_than_days'])
+        interval = timedelta(days=rule['keep_every_days'])
+        last_kept = None
+        for index in range(len(snapshots) - 1, -1, -1):
+            time = snapshots[index][0]
+            if time > cutoff:
+                break
+            if last_kept is None or time - last_kept >= interval:
+                kept.add(index)
+                last_kept = time
+
+    return kept
+
+
+def plan_retention(backups_by_type, policy, now=None):
+    """计算所有层级中要删除的快照，返回快照字典列表（按时间从旧到新）
+
+    backups_by_type 为 {层级: [快照]}；时间无法解析的快照一律保留。
+    """
+    now = now or datetime.now()
+    to_delete = []
+
+    for backup_type, backups in backups_by_type.items():
+        rules = policy.get(backup_type)
+        if rules is None:
+            continue
+
+        dated = []
+        for backup in backups:
+            time = parse_snapshot_time(backup['timestamp'])
+            if time is None:
+                logging.warning(f"无法解析快照时间，跳过保留策略: {backup['path']}")
+                continue
+            dated.append((time, backup))
+        dated.sort(key=lambda item: item[0], reverse=True)
+
+        kept = select_kept(dated, rules, now)
+        to_delete.extend(item for index, item in enumerate(dated) if index not in kept)
+
+    to_delete.sort(key=lambda item: item[0])
+    return [backup for _, backup in to_delete]
@@ -0,0 +1,120 @@
+"""
+源目录扫描模块
+每次运行只用 os.scandir 遍历一次源目录，生成文件清单（manifest），
+供哈希计算、复制、压缩和元数据统计共同使用，每个文件只 stat 一次。
+目录的列出在线程池中并行进行，结果顺序与单线程遍历相同
+"""
+
+import os
+import stat
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# 跳过的系统目录和垃圾文件（隐藏文件和目录始终跳过）
+EXCLUDED_DIRS = ('$RECYCLE.BIN', 'System Volume Information')
+EXCLUDED_FILES = ('Thumbs.db',)
+
+# 文件清单条目：path 为相对源目录的路径
+FileEntry = namedtuple('FileEntry', ['path', 'size', 'mtime_ns', 'mode', 'inode'])
+
+
+def is_excluded(name, is_dir=False):
+    """判断文件或目录是否应被跳过"""
+    if name.startswith('.'):
+        return True
+    if is_dir:
+        return name in EXCLUDED_DIRS
+    return name in EXCLUDED_FILES or name.endswith('~')
+
+
+def get_scan_workers(workers=None):
+    """返回扫描使用的线程数；scandir 和 stat 会释放 GIL，网络存储上线程数可以多于 CPU 核心数"""
+    if workers:
+        return max(1, int(workers))
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def _list_directory(rel_dir, dir_path):
+    """列出一个目录（在工作线程中执行），返回 (按名称排序的文件条目, 按名称排序的子目录)
+
+    stat 结果直接取自 DirEntry，文件的软链接按其指向的文件处理，目录的软链接不进入。
+    """
+    try:
+        with os.scandir(dir_path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError as e:
+        logging.warning(f"无法访问目录 {dir_path}: {str(e)}")
+        return [], []
+
+    files = []
+    subdirs = []
+    for entry in entries:
+        rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if not is_excluded(entry.name, is_dir=True):
+                    subdirs.append((rel_path, entry.path))
+                continue
+
+            if is_excluded(entry.name):
+                continue
+
+            st = entry.stat()
+            if not stat.S_ISREG(st.st_mode):
+                continue
+
+            files.append(FileEntry(rel_path, st.st_size, st.st_mtime_ns, st.st_mode, st.st_ino))
+        except OSError as e:
+            logging.warning(f"无法访问文件 {entry.path}: {str(e)}")
+            continue
+
+    return files, subdirs
+
+
+def iter_directory(source_dir, workers=None):
+    """并行扫描源目录，按稳定的顺序逐个产出文件条目
+
+    目录的列出和 stat 在线程池中并行进行，但产出顺序与单线程深度优先遍历完全相同：
+    同一目录内按名称排序，先列文件再进入子目录，保证哈希结果稳定。
+    只预取即将遍历的若干个目录，内存占用有界。
+    """
+    workers = get_scan_workers(workers)
+    prefetch = workers * 4
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # 栈中每项为 [相对路径, 绝对路径, future]；栈顶是下一个要遍历的目录
+        stack = [['', source_dir, None]]
+        while stack:
+            # 为栈顶附近即将遍历的目录提前提交扫描任务
+            for item in stack[-prefetch:]:
+                if item[2] is None:
+                    item[2] = pool.submit(_list_directory, item[0], item[1])
+
+            files, subdirs = stack.pop()[2].result()
+            yield from files
+
+            # 倒序入栈，使子目录按名称顺序出栈
+            stack.extend([rel_path, dir_path, None] for rel_path, dir_path in reversed(subdirs))
+
+
+def scan_directory(source_dir, workers=None):
+    """扫描源目录，返回按目录顺序排列的文件清单（见 iter_directory）"""
+    return list(iter_directory(source_dir, workers))
+
+
+def manifest_sort_key(rel_path):
+    """返回与 scan_directory 输出顺序一致的排序键：同一目录内先文件后子目录，各自按名称排序"""
+    parts = rel_path.split(os.sep)
+    return tuple((1, part) for part in parts[:-1]) + ((0, parts[-1]),)
+
+
+def summarize_manifest(manifest):
+    """统计文件清单的文件数和总字节数"""
+    return len(manifest), sum(entry.size for entry in manifest)
+
+
+def mtime_from_ns(mtime_ns):
+    """将纳秒时间戳转换为与 os.path.getmtime 相同的浮点秒数"""
+    seconds, nanoseconds = divmod(mtime_ns, 1000000000)
+    return seconds + nanoseconds * 1e-9
@@ -0,0 +1,432 @@
+"""
+完整性校验（scrub）模块
+逐个读取已有快照的全部数据并与备份时记录的元数据比对：
+压缩快照逐个成员解压并校验 CRC，与文件清单中的大小比对；
+目录快照读取每个文件，与 backup_info.json 中的文件数、总大小和历史索引中记录的大小、修改时间比对；
+按内容检测变化的快照还会重新计算每个文件的 BLAKE2b 摘要，与备份时记录的摘要比对；
+以差异存储的大文件按差异链重建，逐块比对备份时记录的块摘要；
+软链接快照检查目标是否存在。
+成员和文件在线程池中并行读取（解压和 CRC 计算会释放 GIL），按字节数限速并可限制每次运行读取的总量；
+校验进度保存在 .tier_backup/scrub_state.json 中，大的目标目录可以分多次运行完成一轮校验
+"""
+
+import os
+import json
+import stat
+import time
+import zlib
+import logging
+import zipfile
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .catalog import get_state_dir, list_snapshots, read_snapshot_info, BACKUP_TYPES
+from .archiver import read_manifest_member, MANIFEST_NAME
+from .history import get_snapshot_files
+from .throttle import RateLimiter
+from .hasher import new_hasher, format_digest, DIGEST_PREFIX
+from .delta import list_delta_files, iter_delta_file, DELTA_DIR_NAME
+
+SCRUB_STATE_FILE = 'scrub_state.json'
+SCRUB_REPORT_FILE = 'scrub_report.json'
+
+# 快照中的内部文件，不参与比对
+INTERNAL_FILES = ('backup_info.json', MANIFEST_NAME)
+# 读取时的块大小
+CHUNK_SIZE = 1024 * 1024
+
+# 校验结果：ok 正常；corrupt 数据损坏或与元数据不符；dangling 软链接快照的目标不存在；
+# unregistered 磁盘上存在但不在快照目录中（通常是无法读取的压缩包）
+STATUSES = ('ok', 'corrupt', 'dangling', 'unregistered')
+
+
+def get_scrub_workers(workers=None):
+    """返回校验使用的线程数；读取和解压会释放 GIL，默认与 ThreadPoolExecutor 一致"""
+    if workers:
+        return max(1, int(workers))
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def get_state_path(target_dir):
+    """获取校验进度文件路径"""
+    return os.path.join(get_state_dir(target_dir), SCRUB_STATE_FILE)
+
+
+def load_scrub_state(target_dir):
+    """读取校验进度：{'pass_started': 本轮开始时间, 'verified': {快照路径: 结果}}；不存在或损坏时从头开始"""
+    try:
+        with open(get_state_path(target_dir), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if isinstance(state.get('verified'), dict):
+            return state
+    except (OSError, ValueError):
+        pass
+    return {'pass_started': None, 'verified': {}}
+
+
+def _write_json(path, data):
+    """原子地写入 JSON 文件（先写临时文件再重命名），中断时不会留下半个文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_stream(f, limiter=None, hasher=None):
+    """读完一个文件对象，返回读取的字节数；每块读取前按字节数限速，给出 hasher 时同时计算摘要"""
+    total = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire(CHUNK_SIZE)
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            return total
+        total += len(chunk)
+        if hasher is not None:
+            hasher.update(chunk)
+
+
+def _expected_digest(*candidates):
+    """返回第一个 BLAKE2b 内容摘要（CRC 等其他哈希不需要重新计算），都没有时返回 None"""
+    for candidate in candidates:
+        if candidate and candidate.startswith(DIGEST_PREFIX):
+            return candidate
+    return None
+
+
+def _check_member(zipf, zinfo, limiter, digest=None):
+    """解压并校验一个成员（在工作线程中执行），返回 (从磁盘读取的字节数, 错误信息或 None)
+
+    各线程共享同一个 ZipFile；读到成员末尾时 zipfile 会比对 CRC，不一致时抛出 BadZipFile。
+    限速按成员的压缩后大小（即实际从磁盘读取的字节数）计算。digest 为备份时记录的内容摘要（可选）。
+    """
+    limiter.acquire(zinfo.compress_size)
+    hasher = new_hasher() if digest else None
+    try:
+        with zipf.open(zinfo) as f:
+            size = _read_stream(f, hasher=hasher)
+    except (zipfile.BadZipFile, zlib.error, EOFError, OSError, NotImplementedError) as e:
+        return zinfo.compress_size, f"{zinfo.filename}: {str(e)}"
+    if size != zinfo.file_size:
+        return zinfo.compress_size, f"{zinfo.filename}: 解压得到 {size} 字节，中央目录记录 {zinfo.file_size} 字节"
+    if hasher is not None and format_digest(hasher) != digest:
+        return zinfo.compress_size, f"{zinfo.filename}: 内容摘要与备份时记录的不一致"
+    return zinfo.compress_size, None
+
+
+def _check_file(path, rel_path, expected, limiter, digest=None):
+    """读取并校验目录快照中的一个文件（在工作线程中执行），返回 (读取的字节数, 错误信息或 None)
+
+    expected 为历史索引中的 (大小, 修改时间纳秒, 哈希)，digest 为备份时记录的内容摘要（均可选）。
+    """
+    size = 0
+    hasher = new_hasher() if digest else None
+    try:
+        st = os.stat(path)
+        with open(path, 'rb') as f:
+            size = _read_stream(f, limiter, hasher)
+    except OSError as e:
+        return size, f"{rel_path}: {str(e)}"
+    if size != st.st_size:
+        return size, f"{rel_path}: 读取到 {size} 字节，文件大小为 {st.st_size} 字节"
+    if expected is not None:
+        exp_size, exp_mtime_ns = expected[0], expected[1]
+        if size != exp_size:
+            return size, f"{rel_path}: 大小 {size} 字节，备份时记录 {exp_size} 字节"
+        if exp_mtime_ns is not None and st.st_mtime_ns != exp_mtime_ns:
+            return size, f"{rel_path}: 修改时间与备份时记录的不一致"
+    if hasher is not None and format_digest(hasher) != digest:
+        return size, f"{rel_path}: 内容摘要与备份时记录的不一致"
+    return size, None
+
+
+def _check_delta_file(info, rel_path, expected, limiter, digest=None):
+    """重建并校验以差异存储的文件（在工作线程中执行），返回 (读取的字节数, 错误信息或 None)
+
+    每个块与差异链中记录的块摘要比对，其余同 _check_file。
+    """
+    size = 0
+    hasher = new_hasher() if digest else None
+    try:
+        for block in iter_delta_file(info['chain_dir'], info['index'], verify=True):
+            limiter.acquire(len(block))
+            size += len(block)
+            if hasher is not None:
+                hasher.update(block)
+    except (OSError, ValueError, KeyError) as e:
+        return size, f"{rel_path}: 差异链: {str(e)}"
+    if expected is not None:
+        exp_size, exp_mtime_ns = expected[0], expected[1]
+        if size != exp_size:
+            return size, f"{rel_path}: 大小 {size} 字节，备份时记录 {exp_size} 字节"
+        if exp_mtime_ns is not None and info['mtime_ns'] != exp_mtime_ns:
+            return size, f"{rel_path}: 修改时间与备份时记录的不一致"
+    if hasher is not None and format_digest(hasher) != digest:
+        return size, f"{rel_path}: 内容摘要与备份时记录的不一致"
+    return size, None
+
+
+def _run_checks(pool, tasks, window):
+    """在线程池中执行校验任务（每个任务返回 (字节数, 错误信息或 None)），同时在途的数量有上限，
+    返回 (读取的总字节数, 错误列表)"""
+    total = 0
+    errors = []
+    pending = set()
+
+    def collect(done):
+        nonlocal total
+        for future in done:
+            size, error = future.result()
+            total += size
+            if error:
+                errors.append(error)
+
+    for func, args in tasks:
+        pending.add(pool.submit(func, *args))
+        if len(pending) >= window:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+    collect(pending)
+    errors.sort()
+    return total, errors
+
+
+def verify_archive(archive_path, pool, limiter, expected=None, window=128):
+    """校验压缩快照，返回 (文件数, 读取的字节数, 错误列表)
+
+    每个成员解压后校验 CRC（包内清单或历史索引中有内容摘要时同时比对摘要）；文件清单中的大小与中央目录不一致、
+    清单中的文件缺失，或 CRC 与历史索引中记录的不一致（expected 为 {路径: (大小, 修改时间纳秒, 哈希)}）都视为损坏。
+    """
+    try:
+        zipf = zipfile.ZipFile(archive_path, 'r')
+    except (zipfile.BadZipFile, OSError) as e:
+        return 0, 0, [f"无法打开压缩包: {str(e)}"]
+
+    with zipf:
+        errors = []
+        members = [zinfo for zinfo in zipf.infolist() if not zinfo.is_dir()]
+        names = {zinfo.filename: zinfo for zinfo in members}
+        try:
+            manifest = read_manifest_member(zipf)
+        except (zipfile.BadZipFile, zlib.error, ValueError, KeyError) as e:
+            errors.append(f"{MANIFEST_NAME}: {str(e)}")
+            manifest = {}
+
+        for path, entry in sorted(manifest.items()):
+            zinfo = names.get(path)
+            if zinfo is None:
+                errors.append(f"{path}: 文件清单中有记录但压缩包中缺失")
+            elif zinfo.file_size != entry[0]:
+                errors.append(f"{path}: 大小 {zinfo.file_size} 字节，文件清单记录 {entry[0]} 字节")
+        expected = expected or {}
+        for path, (size, mtime_ns, file_hash) in sorted(expected.items()):
+            zinfo = names.get(path)
+            if zinfo is None:
+                errors.append(f"{path}: 历史索引中有记录但压缩包中缺失")
+            elif file_hash and file_hash.startswith('crc32:') and file_hash != f"crc32:{zinfo.CRC:08x}":
+                errors.append(f"{path}: CRC 与备份时记录的不一致")
+
+        def member_digest(name):
+            entry = manifest.get(name)
+            state = expected.get(name)
+            return _expected_digest(entry[3] if entry and len(entry) > 3 else None, state[2] if state else None)
+
+        tasks = ((_check_member, (zipf, zinfo, limiter, member_digest(zinfo.filename))) for zinfo in members)
+        size, member_errors = _run_checks(pool, tasks, window)
+        errors.extend(member_errors)
+    files = sum(1 for zinfo in members if zinfo.filename not in INTERNAL_FILES)
+    return files, size, errors
+
+
+def verify_directory(snapshot_path, pool, limiter, expected=None, seen=None, window=128):
+    """校验目录快照，返回 (文件数, 读取的字节数, 错误列表)
+
+    读取每个文件的全部内容，与 backup_info.json 中的文件数和总大小以及历史索引中每个文件的记录比对；
+    有内容摘要（backup_info.json 中的 file_digests 或历史索引）时同时比对摘要。
+    以差异存储的文件按差异链重建后校验。
+    seen 为本次运行已读取过的 (设备号, inode) 集合：硬链接共享的文件只读取一次。
+    """
+    errors = []
+    info = None
+    try:
+        with open(os.path.join(snapshot_path, 'backup_info.json'), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+    except (OSError, ValueError) as e:
+        errors.append(f"backup_info.json: {str(e)}")
+
+    expected = expected or {}
+    digests = (info or {}).get('file_digests') or {}
+    tasks = []
+    found = set()
+    total_size = 0
+    for root, dirs, files in os.walk(snapshot_path):
+        rel_root = os.path.relpath(root, snapshot_path)
+        if rel_root == '.' and DELTA_DIR_NAME in dirs:
+            dirs.remove(DELTA_DIR_NAME)
+        dirs.sort()
+        for name in sorted(files):
+            if rel_root == '.' and name in INTERNAL_FILES:
+                continue
+            rel_path = (name if rel_root == '.' else os.path.join(rel_root, name)).replace(os.sep, '/')
+            path = os.path.join(root, name)
+            try:
+                st = os.lstat(path)
+            except OSError as e:
+                errors.append(f"{rel_path}: {str(e)}")
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            found.add(rel_path)
+            total_size += st.st_size
+            key = (st.st_dev, st.st_ino)
+            if seen is not None and st.st_nlink > 1:
+                if key in seen:
+                    continue
+                seen.add(key)
+            state = expected.get(rel_path)
+            digest = _expected_digest(digests.get(rel_path), state[2] if state else None)
+            tasks.append((_check_file, (path, rel_path, state, limiter, digest)))
+
+    try:
+        delta_files = list_delta_files(snapshot_path)
+    except (OSError, ValueError) as e:
+        errors.append(f"{DELTA_DIR_NAME}: {str(e)}")
+        delta_files = {}
+    for rel_path, delta_info in sorted(delta_files.items()):
+        found.add(rel_path)
+        total_size += delta_info['size']
+        state = expected.get(rel_path)
+        digest = _expected_digest(digests.get(rel_path), state[2] if state else None)
+        tasks.append((_check_delta_file, (delta_info, rel_path, state, limiter, digest)))
+
+    if info is not None:
+        if info.get('file_count') is not None and info['file_count'] != len(found):
+            errors.append(f"文件数 {len(found)}，备份时记录 {info['file_count']}")
+        if info.get('total_size') is not None and info['total_size'] != total_size:
+            errors.append(f"总大小 {total_size} 字节，备份时记录 {info['total_size']} 字节")
+    for rel_path in sorted(set(expected) - found):
+        errors.append(f"{rel_path}: 历史索引中有记录但快照中缺失")
+
+    size, file_errors = _run_checks(pool, tasks, window)
+    errors.extend(file_errors)
+    return len(found), size, errors
+
+
+def _find_unregistered(target_dir, registered):
+    """列出磁盘上存在但不在快照目录中的快照，返回结果列表（附带读取元数据时的错误）"""
+    results = []
+    for backup_type in BACKUP_TYPES:
+        type_dir = os.path.join(target_dir, backup_type)
+        try:
+            names = sorted(os.listdir(type_dir))
+        except OSError:
+            continue
+        for name in names:
+            item_path = os.path.join(type_dir, name)
+            if os.path.abspath(item_path) in registered:
+                continue
+            try:
+                read_snapshot_info(item_path, backup_type)
+                error = '不在快照目录中（可运行 rebuild-catalog 重新登记）'
+            except Exception as e:
+                error = f"无法读取备份信息: {str(e)}"
+            results.append({'path': item_path, 'type': backup_type, 'status': 'unregistered',
+                            'files': 0, 'bytes': 0, 'errors': [error]})
+    return results
+
+
+def scrub_target(target_dir, workers=None, bytes_per_second=None, max_bytes=None, report_path=None,
+                 restart=False, stop_event=None):
+    """校验目标目录中的快照，返回报告字典，并写入 report_path（默认 .tier_backup/scrub_report.json）
+
+    按从旧到新的顺序校验本轮尚未校验的快照；bytes_per_second 为读取速度上限，
+    max_bytes 为本次运行读取的字节数上限（正在校验的快照会校验完），达到上限或 stop_event 被设置时停止，
+    下次运行从未校验的快照继续。一轮中所有快照都校验完成后，下次运行开始新的一轮；restart 为 True 时立即重新开始。
+    报告中的 complete 表示本轮是否已完成，remaining 为本轮剩余的快照数。
+    """
+    start = time.monotonic()
+    started_at = datetime.now().isoformat()
+    state = {'pass_started': None, 'verified': {}} if restart else load_scrub_state(target_dir)
+    if not state['pass_started']:
+        state['pass_started'] = started_at
+
+    backups = list_snapshots(target_dir)
+    registered = {os.path.abspath(b['path']) for b in backups}
+    pending = [b for b in backups if b['path'] not in state['verified']]
+
+    results = _find_unregistered(target_dir, registered)
+    workers = get_scrub_workers(workers)
+    limiter = RateLimiter(bytes_per_second)
+    seen = set()
+    bytes_read = 0
+    checked = 0
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scrub') as pool:
+        for backup in pending:
+            if stop_event is not None and stop_event.is_set():
+                break
+            if max_bytes and bytes_read >= max_bytes:
+                break
+
+            path = backup['path']
+            result = {'path': path, 'type': backup['type'], 'status': 'ok', 'files': 0, 'bytes': 0, 'errors': []}
+            if backup['is_symlink'] or os.path.islink(path):
+                if not os.path.exists(path):
+                    result['status'] = 'dangling'
+                    result['errors'].append(f"软链接目标不存在: {os.readlink(path)}")
+            else:
+                waited = limiter.waited
+                snapshot_start = time.monotonic()
+                expected = get_snapshot_files(target_dir, path)
+                if backup['compressed']:
+                    files, size, errors = verify_archive(path, pool, limiter, expected, workers * 4)
+                else:
+                    files, size, errors = verify_directory(path, pool, limiter, expected, seen, workers * 4)
+                result['files'] = files
+                result['bytes'] = size
+                result['errors'] = errors
+                result['seconds'] = round(time.monotonic() - snapshot_start - (limiter.waited - waited), 3)
+                if errors:
+                    result['status'] = 'corrupt'
+                bytes_read += result['bytes']
+
+            if result['status'] == 'ok':
+                logging.info(f"快照校验通过: {path}, {result['files']} 个文件")
+            else:
+                logging.error(f"快照校验失败: {path}, {len(result['errors'])} 个问题, 首个: {result['errors'][0]}")
+            results.append(result)
+            state['verified'][path] = {'status': result['status'], 'verified_at': datetime.now().isoformat()}
+            checked += 1
+            _write_json(get_state_path(target_dir), state)
+
+    remaining = len(pending) - checked
+    report = {
+        'target': target_dir,
+        'started_at': started_at,
+        'finished_at': datetime.now().isoformat(),
+        'pass_started': state['pass_started'],
+        'complete': remaining == 0,
+        'remaining': remaining,
+        'bytes_read': bytes_read,
+        'throttled_seconds': round(limiter.waited, 3),
+        'seconds': round(time.monotonic() - start, 3),
+        'summary': {status: sum(1 for r in results if r['status'] == status) for status in STATUSES},
+        'snapshots': results
+    }
+
+    if remaining == 0:
+        # 本轮完成，下次运行开始新的一轮
+        state = {'pass_started': None, 'verified': {}}
+    _write_json(get_state_path(target_dir), state)
+    _write_json(report_path or os.path.join(get_state_dir(target_dir), SCRUB_REPORT_FILE), report)
+
+    summary = report['summary']
+    logging.info(f"完整性校验: {target_dir}, 本次校验 {checked} 个快照 ({bytes_read} 字节), 正常 {summary['ok']}, "
+                 f"损坏 {summary['corrupt']}, 悬空软链接 {summary['dangling']}, 未登记 {summary['unregistered']}, "
+                 f"本轮剩余 {remaining} 个, 耗时 {report['seconds']} 秒")
+    return report
+
+
+def is_report_clean(report):
+    """报告中没有损坏、悬空或未登记的快照时返回 True"""
+    return all(count == 0 for status, count in report['summary'].items() if status != 'ok')
@@ -0,0 +1,175 @@
+"""
+磁盘空间规划模块
+根据扫描清单预估本次备份的大小，在写入之前一次算出需要删除的快照集合，
+不再"删除一个、重新检查磁盘、再删除"地循环。
+释放的空间按快照目录中记录的独占大小（unique_size）计算，没有记录时才遍历快照按 inode 统计：
+硬链接快照共享的数据只有在所有链接都被删除时才会释放，软链接快照不占空间，
+被软链接引用的实际快照只有在引用者一并删除时才会删除；
+回收站中等待删除的条目在回收完成后即可释放空间，规划时先计入
+"""
+
+import os
+import stat
+import shutil
+import logging
+from datetime import datetime
+
+from .retention import parse_snapshot_time
+
+# 磁盘使用率超过上限后清理到低于上限的百分点数
+CLEANUP_BUFFER_PERCENT = 5
+
+
+def get_bytes_to_free(target_dir, incoming_bytes, max_usage_percent):
+    """计算写入 incoming_bytes 后为满足使用率上限需要释放的字节数，空间充足时返回 0"""
+    total, used, free = shutil.disk_usage(target_dir)
+    if incoming_bytes > free:
+        # 连写入本次备份的空间都不够
+        return incoming_bytes - free + int(total * CLEANUP_BUFFER_PERCENT / 100)
+    if (used + incoming_bytes) / total * 100 <= max_usage_percent:
+        return 0
+    return int(used + incoming_bytes - total * (max_usage_percent - CLEANUP_BUFFER_PERCENT) / 100)
+
+
+def estimate_backup_size(manifest, compress=False, changed_paths=None, compression_ratio=None):
+    """根据扫描清单预估本次备份写入的字节数
+
+    changed_paths 为相对上一个快照变化的文件（硬链接增量快照时只复制这些文件）；
+    compression_ratio 为同一层级上一个压缩快照的压缩率，未知时按不压缩估算。
+    """
+    if changed_paths is not None:
+        changed = set(changed_paths)
+        total = sum(entry.size for entry in manifest if entry.path in changed)
+    else:
+        total = sum(entry.size for entry in manifest)
+    if compress and compression_ratio:
+        total = int(total * compression_ratio)
+    return total
+
+
+def get_changed_paths(manifest, previous_files):
+    """找出相对参照快照大小或修改时间变化的文件（硬链接增量快照需要复制的文件）
+
+    previous_files 为参照快照的文件状态 {路径: (大小, 修改时间纳秒, 内容哈希)}（来自历史索引），
+    为 None（索引中没有参照快照）时返回 None，按完整清单预估。
+    """
+    if previous_files is None:
+        return None
+    changed = []
+    for entry in manifest:
+        state = previous_files.get(entry.path.replace(os.sep, '/'))
+        if state is None or state[:2] != (entry.size, entry.mtime_ns):
+            changed.append(entry.path)
+    return changed
+
+
+def get_compression_ratio(backups):
+    """根据最近一个记录了源数据大小的压缩快照计算压缩率"""
+    for backup in reversed(backups):
+        if backup['compressed'] and not backup['is_symlink'] and backup.get('source_size') and backup.get('size'):
+            return min(1.0, backup['size'] / backup['source_size'])
+    return None
+
+
+def _inode_usage(path):
+    """统计快照占用的 inode：{(设备, inode): (链接数, 占用字节数)}；软链接快照不占空间"""
+    usage = {}
+
+    def add(st):
+        blocks = getattr(st, 'st_blocks', None)
+        usage[(st.st_dev, st.st_ino)] = (st.st_nlink, blocks * 512 if blocks is not None else st.st_size)
+
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return usage
+    if stat.S_ISLNK(st.st_mode):
+        return usage
+    if stat.S_ISREG(st.st_mode):
+        add(st)
+        return usage
+
+    pending = [path]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        add(entry.stat(follow_symlinks=False))
+        except OSError as e:
+            logging.warning(f"无法统计快照占用: {str(e)}")
+    return usage
+
+
+def plan_space_cleanup(backups_by_type, bytes_to_free, protected=(), pending=()):
+    """计算为释放 bytes_to_free 字节需要删除的快照，返回 (快照列表, 预计释放的字节数)
+
+    候选快照按时间从旧到新依次加入；每个层级最新的快照和 protected 中的路径（如本次备份的参照快照）
+    不会被删除。被软链接引用的实际快照只有在所有引用者都加入删除集合时才会删除，
+    否则删除它只会把数据移交给引用者而不释放空间。
+    每个快照按快照目录中的 unique_size（创建时写入的字节数）计入，不再遍历快照中的文件；
+    unique_size 为空（如重建的快照目录）时才遍历快照按 inode 统计。unique_size 是估计值：
+    仍被较新的快照硬链接的数据不会释放，调用方删除后应按实际磁盘使用重新检查。
+    pending 为回收站中等待删除的路径：其占用的空间按 inode 先计入预计释放的字节数。
+    """
+    protected = {os.path.abspath(path) for path in protected}
+    candidates = []
+    for backups in backups_by_type.values():
+        ordered = sorted(backups, key=lambda b: parse_snapshot_time(b['timestamp']) or datetime.min)
+        if ordered:
+            protected.add(os.path.abspath(ordered[-1]['path']))
+        candidates.extend(ordered)
+    candidates.sort(key=lambda b: parse_snapshot_time(b['timestamp']) or datetime.min)
+
+    referrers = {}
+    for backup in candidates:
+        if backup['is_symlink'] and backup.get('symlink_target'):
+            referrers.setdefault(os.path.abspath(backup['symlink_target']), set()).add(os.path.abspath(backup['path']))
+    by_path = {os.path.abspath(b['path']): b for b in candidates}
+
+    selected = []
+    selected_paths = set()
+    link_counts = {}
+    freed = 0
+
+    def account(path):
+        nonlocal freed
+        for key, (nlink, size) in _inode_usage(path).items():
+            link_counts[key] = link_counts.get(key, 0) + 1
+            if link_counts[key] == nlink:
+                freed += size
+
+    def select(backup):
+        nonlocal freed
+        path = os.path.abspath(backup['path'])
+        selected.append(backup)
+        selected_paths.add(path)
+        if backup['is_symlink']:
+            return
+        if backup.get('unique_size') is not None:
+            freed += backup['unique_size']
+        else:
+            account(path)
+
+    for path in pending:
+        account(path)
+
+    def deletable(path):
+        return path not in protected and referrers.get(path, set()) <= selected_paths
+
+    for backup in candidates:
+        if freed >= bytes_to_free:
+            break
+        path = os.path.abspath(backup['path'])
+        if path in selected_paths or not deletable(path):
+            continue
+        select(backup)
+
+        # 软链接加入后，其指向的实际快照可能已经没有其他引用者
+        target = os.path.abspath(backup['symlink_target']) if backup.get('symlink_target') else None
+        if target in by_path and target not in selected_paths and deletable(target):
+            select(by_path[target])
+
+    return selected, freed
@@ -0,0 +1,195 @@
+"""
+I/O 限速模块
+备份与业务服务运行在同一台机器上时，按配置文件的 resources 设置限制备份对磁盘和页缓存的影响：
+- 读、写带宽上限（字节/秒）和 IOPS 上限，在哈希、复制和压缩各阶段的所有线程之间共享
+- 读取源文件时用 posix_fadvise 提示内核不再缓存（NOREUSE，读完后 DONTNEED），避免挤掉业务的热数据
+- 把备份线程的 I/O 优先级设为 idle，磁盘空闲时才处理备份的请求，运行结束后恢复（仅 Linux）
+每次运行统计因限速而等待的时间
+"""
+
+import os
+import sys
+import time
+import ctypes
+import logging
+import platform
+import threading
+from contextlib import contextmanager
+
+# 限速时每次读写的最大字节数：内核复制默认一次 64 MB，限速后会形成突发
+THROTTLED_CHUNK_SIZE = 1024 * 1024
+
+# (ioprio_set, ioprio_get) 的系统调用号（按处理器架构）
+_IOPRIO_SYSCALLS = {
+    'x86_64': (251, 252), 'amd64': (251, 252), 'i386': (289, 290), 'i686': (289, 290),
+    'aarch64': (30, 31), 'arm64': (30, 31), 'armv7l': (314, 315), 'ppc64le': (273, 274), 's390x': (282, 283)
+}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_NONE = 0
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+
+class RateLimiter:
+    """按每秒操作次数（或字节数）限速，rate 为 None 或 0 时不限速（可在多个线程中共享）"""
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.waited = 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """等待到允许执行下一次数量为 amount 的操作；waited 累计等待的秒数"""
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + amount / self.rate
+            if delay > 0:
+                self.waited += delay
+        if delay > 0:
+            time.sleep(delay)
+
+
+class IOThrottle:
+    """一次备份任务共享的 I/O 限速器，各阶段和各线程共用
+
+    read() / write() / copy() 在每次读写之后按实际字节数计费（copy 同时计读和写）；
+    每次调用计一次 I/O 操作（copy 计两次）。throttled_seconds 为累计的限速等待时间。
+    """
+
+    def __init__(self, read_bytes_per_second=None, write_bytes_per_second=None, iops=None, fadvise=False):
+        self.read_limiter = RateLimiter(read_bytes_per_second)
+        self.write_limiter = RateLimiter(write_bytes_per_second)
+        self.iops_limiter = RateLimiter(iops)
+        self.fadvise = bool(fadvise) and hasattr(os, 'posix_fadvise')
+        self.limited = bool(read_bytes_per_second or write_bytes_per_second or iops)
+
+    def read(self, nbytes):
+        """计入一次读取"""
+        self.iops_limiter.acquire()
+        self.read_limiter.acquire(nbytes)
+
+    def write(self, nbytes):
+        """计入一次写入"""
+        self.iops_limiter.acquire()
+        self.write_limiter.acquire(nbytes)
+
+    def copy(self, nbytes):
+        """计入一次复制（读取和写入同样的字节数）"""
+        self.read(nbytes)
+        self.write(nbytes)
+
+    def chunk_size(self, default):
+        """返回每次读写的字节数：限速时使用较小的块，使等待均匀分布"""
+        return min(default, THROTTLED_CHUNK_SIZE) if self.limited else default
+
+    def open_source(self, fd):
+        """开始读取源文件：提示内核这些数据只读一次"""
+        if self.fadvise:
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_NOREUSE)
+            except OSError:
+                pass
+
+    def release_source(self, fd):
+        """源文件读取完毕：丢弃其在页缓存中的干净页，把缓存留给业务服务"""
+        if self.fadvise:
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            except OSError:
+                pass
+
+    @property
+    def throttled_seconds(self):
+        """累计的限速等待时间（秒）"""
+        return self.read_limiter.waited + self.write_limiter.waited + self.iops_limiter.waited
+
+
+# 不限速、不使用 fadvise 的共享实例，供未配置 resources 的调用方使用
+UNLIMITED = IOThrottle()
+
+
+def load_resources(resources_config=None):
+    """读取配置文件中的 resources 设置，返回 (IOThrottle, 是否使用 idle I/O 优先级)
+
+    字段：read_bytes_per_second、write_bytes_per_second、iops（为 0 或未设置时不限）、
+    fadvise（true/false）、idle_io_priority（true/false）。数值无效时抛出 ValueError。
+    """
+    resources_config = resources_config or {}
+    unknown = set(resources_config) - {
+        'read_bytes_per_second', 'write_bytes_per_second', 'iops', 'fadvise', 'idle_io_priority'
+    }
+    if unknown:
+        raise ValueError(f"未知的 resources 参数: {', '.join(sorted(unknown))}")
+
+    rates = {}
+    for key in ('read_bytes_per_second', 'write_bytes_per_second', 'iops'):
+        value = resources_config.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+            raise ValueError(f"{key} 必须是非负数: {value}")
+        rates[key] = value or None
+
+    fadvise = bool(resources_config.get('fadvise', False))
+    if fadvise and not hasattr(os, 'posix_fadvise'):
+        logging.warning("当前平台不支持 posix_fadvise，fadvise 设置不生效")
+    throttle = IOThrottle(rates['read_bytes_per_second'], rates['write_bytes_per_second'], rates['iops'], fadvise)
+    return throttle, bool(resources_config.get('idle_io_priority', False))
+
+
+def _ioprio_syscall(get, *args):
+    """对当前线程调用 ioprio_get（get 为 True）或 ioprio_set，返回系统调用的结果；不支持的平台返回 None"""
+    if not sys.platform.startswith('linux'):
+        logging.warning("idle I/O 优先级仅支持 Linux，设置不生效")
+        return None
+    numbers = _IOPRIO_SYSCALLS.get(platform.machine())
+    if numbers is None:
+        logging.warning(f"未知的处理器架构 {platform.machine()}，无法设置 I/O 优先级")
+        return None
+    libc = ctypes.CDLL(None, use_errno=True)
+    return libc.syscall(numbers[1 if get else 0], IOPRIO_WHO_PROCESS, 0, *args)
+
+
+def set_idle_io_priority():
+    """把当前线程（及其之后创建的线程）的 I/O 优先级设为 idle（仅 Linux）
+
+    返回设置之前的 I/O 优先级，供 restore_io_priority 恢复；失败或不支持时返回 None。
+    """
+    previous = _ioprio_syscall(True)
+    if previous is None:
+        return None
+    if previous < 0:
+        logging.warning(f"读取 I/O 优先级失败: {os.strerror(ctypes.get_errno())}")
+        return None
+    if _ioprio_syscall(False, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) != 0:
+        logging.warning(f"设置 idle I/O 优先级失败: {os.strerror(ctypes.get_errno())}")
+        return None
+    logging.debug("已设置 idle I/O 优先级")
+    return previous
+
+
+def restore_io_priority(priority):
+    """恢复当前线程的 I/O 优先级（set_idle_io_priority 的返回值），返回是否成功
+
+    ioprio 只作用于调用线程，线程被之后的任务复用（任务线程池、守护进程主循环）时需要恢复。
+    """
+    if priority >> IOPRIO_CLASS_SHIFT == IOPRIO_CLASS_NONE:
+        # 未单独设置过的线程读到的是 NONE 类加上按 nice 值推算的级别，设置时 NONE 类只接受级别 0
+        priority = 0
+    if _ioprio_syscall(False, priority) != 0:
+        logging.warning(f"恢复 I/O 优先级失败: {os.strerror(ctypes.get_errno())}")
+        return False
+    return True
+
+
+@contextmanager
+def idle_io_priority():
+    """在 with 块内把当前线程的 I/O 优先级设为 idle，退出时（包括异常时）恢复；as 得到是否设置成功"""
+    previous = set_idle_io_priority()
+    try:
+        yield previous is not None
+    finally:
+        if previous is not None:
+            restore_io_priority(previous)
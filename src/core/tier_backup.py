@@ -6,16 +6,34 @@ import logging
 import zipfile
 import hashlib
 import platform
-import subprocess
 from datetime import datetime, timedelta
 import re
+from contextlib import nullcontext
 
-# 配置日志
-logging.basicConfig(
-    filename='backup.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+from .catalog import list_snapshots, record_snapshot, remove_snapshot, remove_snapshots, STATE_DIR_NAME
+from .retention import load_retention_policy, plan_retention, parse_snapshot_time
+from .scanner import scan_directory, summarize_manifest, mtime_from_ns
+from .space import (get_bytes_to_free, estimate_backup_size, get_changed_paths, get_compression_ratio,
+                    plan_space_cleanup)
+from .merkle import update_merkle_tree
+from .copier import create_directory_snapshot, link_file, link_tree
+from .archiver import write_archive
+from .codec import load_codec_policy
+from .reaper import Reaper, move_to_trash, list_trash, reap_trash
+from .jobs import Job, load_jobs, get_job_devices, run_jobs, DEFAULT_JOB_NAME
+from .history import (manifest_files, record_snapshot_files, record_promoted_snapshot, remove_snapshot_files,
+                      get_snapshot_files)
+from .hasher import hash_manifest, content_root_hash, plan_content_links, CHANGE_DETECTION_MODES
+from .throttle import UNLIMITED, load_resources, idle_io_priority
+from .metrics import (RunMetrics, load_metrics_config, get_job_path, write_run_report,
+                      write_prometheus_textfile, RUN_REPORT_FILE_NAME)
+from .profiling import load_profiling_config, create_profiler, enable_profiling
+from .delta import load_delta_config
+
+DEFAULT_LOG_FILE = 'backup.log'
+DEFAULT_LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# configure_logging() 安装的处理器，再次配置时替换
+_log_handler = None
 
 def get_platform():
     """获取当前操作系统平台"""
@@ -42,6 +60,31 @@ def load_config(config_file='back_config.json'):
         logging.error(f"加载配置文件失败: {str(e)}")
         raise
 
+def configure_logging(config=None):
+    """按配置设置日志：log_level（默认 INFO）、log_file（默认 backup.log，为空时输出到标准错误）、log_format
+
+    替代导入模块时的 basicConfig：作为库导入时不再改动调用方的日志设置，再次调用时替换之前的处理器。
+    日志级别无效时抛出 ValueError。
+    """
+    global _log_handler
+    config = config or {}
+    level_name = str(config.get('log_level') or 'INFO').upper()
+    level = logging.getLevelName(level_name)
+    if not isinstance(level, int):
+        raise ValueError(f"未知的日志级别: {level_name}")
+
+    log_file = config.get('log_file', DEFAULT_LOG_FILE)
+    handler = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(config.get('log_format') or DEFAULT_LOG_FORMAT))
+
+    root = logging.getLogger()
+    if _log_handler is not None:
+        root.removeHandler(_log_handler)
+        _log_handler.close()
+    root.addHandler(handler)
+    root.setLevel(level)
+    _log_handler = handler
+
 def should_create_backup():
     """判断当前是否需要创建备份"""
     now = datetime.now()
@@ -61,46 +104,30 @@ def should_create_backup():
         'weekly': weekly_backup
     }
 
-def calculate_directory_hash(source_dir, max_files=1000):
-    """计算目录的哈希值，用于检测文件变化"""
+def calculate_directory_hash(source_dir, max_files=None, manifest=None):
+    """计算目录的哈希值，用于检测文件变化
+
+    默认覆盖全部文件；max_files 仅用于需要限制计算量的场合。
+    传入 manifest 时直接使用已有的文件清单，不再重新遍历源目录。
+    备份流程使用 merkle.update_merkle_tree() 进行增量变化检测。
+    """
     try:
+        if manifest is None:
+            manifest = scan_directory(source_dir)
+        
         hash_md5 = hashlib.md5()
         file_count = 0
         
-        for root, dirs, files in os.walk(source_dir):
-            # 跳过隐藏文件和系统文件
-            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in ['$RECYCLE.BIN', 'System Volume Information']]
-            
-            # 按文件名排序，确保哈希值的一致性
-            files.sort()
+        for entry in manifest:
+            # 将文件的相对路径、修改时间和大小添加到哈希中
+            file_info = f"{entry.path}:{mtime_from_ns(entry.mtime_ns)}:{entry.size}"
+            hash_md5.update(file_info.encode('utf-8'))
             
-            for file in files:
-                if file.startswith('.'):
-                    continue
-                    
-                file_path = os.path.join(root, file)
-                try:
-                    # 计算文件的相对路径和修改时间
-                    rel_path = os.path.relpath(file_path, source_dir)
-                    mtime = os.path.getmtime(file_path)
-                    size = os.path.getsize(file_path)
-                    
-                    # 将文件信息添加到哈希中
-                    file_info = f"{rel_path}:{mtime}:{size}"
-                    hash_md5.update(file_info.encode('utf-8'))
-                    
-                    file_count += 1
-                    
-                    # 限制文件数量，避免计算时间过长
-                    if file_count >= max_files:
-                        logging.warning(f"文件数量超过{max_files}，停止计算哈希")
-                        break
-                        
-                except (OSError, IOError) as e:
-                    logging.warning(f"无法访问文件 {file_path}: {str(e)}")
-                    continue
+            file_count += 1
             
-            if file_count >= max_files:
+            # 限制文件数量，避免计算时间过长
+            if max_files and file_count >= max_files:
+                logging.warning(f"文件数量超过{max_files}，停止计算哈希")
                 break
         
         # 添加目录信息到哈希中
@@ -115,52 +142,7 @@ def calculate_directory_hash(source_dir, max_files=1000):
 def get_last_backup_info(backup_dir, backup_type):
     """获取最后一次备份的信息"""
     try:
-        type_dir = os.path.join(backup_dir, backup_type)
-        if not os.path.exists(type_dir):
-            return None
-        
-        backups = []
-        for item in os.listdir(type_dir):
-            item_path = os.path.join(type_dir, item)
-            
-            if os.path.isdir(item_path):
-                # 目录备份
-                info_file = os.path.join(item_path, 'backup_info.json')
-                if os.path.exists(info_file):
-                    try:
-                        with open(info_file, 'r', encoding='utf-8') as f:
-                            info = json.load(f)
-                            if info.get('type') == backup_type:
-                                backups.append({
-                                    'path': item_path,
-                                    'timestamp': info.get('timestamp', ''),
-                                    'created_at': info.get('created_at', ''),
-                                    'compressed': False,
-                                    'hash': info.get('directory_hash', ''),
-                                    'is_symlink': os.path.islink(item_path)
-                                })
-                    except Exception as e:
-                        logging.warning(f"读取备份信息失败: {item_path}, 错误: {str(e)}")
-                        continue
-            elif item.endswith('.zip'):
-                # 压缩备份
-                try:
-                    with zipfile.ZipFile(item_path, 'r') as zipf:
-                        if 'backup_info.json' in zipf.namelist():
-                            info_json = zipf.read('backup_info.json').decode('utf-8')
-                            info = json.loads(info_json)
-                            if info.get('type') == backup_type:
-                                backups.append({
-                                    'path': item_path,
-                                    'timestamp': info.get('timestamp', ''),
-                                    'created_at': info.get('created_at', ''),
-                                    'compressed': True,
-                                    'hash': info.get('directory_hash', ''),
-                                    'is_symlink': os.path.islink(item_path)
-                                })
-                except Exception as e:
-                    logging.warning(f"读取压缩备份信息失败: {item_path}, 错误: {str(e)}")
-                    continue
+        backups = list_snapshots(backup_dir, backup_type)
         
         # 按时间排序，获取最新的备份
         if backups:
@@ -173,7 +155,7 @@ def get_last_backup_info(backup_dir, backup_type):
         logging.error(f"获取最后备份信息失败: {str(e)}")
         return None
 
-def create_symlink_backup(target_path, source_path, backup_type, timestamp, compress=False):
+def create_symlink_backup(target_path, source_path, backup_type, timestamp, compress=False, directory_hash='', file_count=None):
     """创建软链接备份"""
     try:
         # 确保目标目录存在
@@ -184,33 +166,26 @@ def create_symlink_backup(target_path, source_path, backup_type, timestamp, comp
             if os.path.islink(target_path):
                 os.unlink(target_path)
             elif os.path.isdir(target_path):
-                shutil.rmtree(target_path)
+                move_to_trash(target_path)
             else:
                 os.remove(target_path)
         
         # 创建软链接
         os.symlink(source_path, target_path)
         
-        # 创建元数据文件
-        backup_info = {
+        # 软链接备份的元数据登记在快照目录中，不再写入（写穿到）被链接的快照
+        record_snapshot(os.path.dirname(os.path.dirname(target_path)), {
+            'path': target_path,
             'timestamp': timestamp,
             'created_at': datetime.now().isoformat(),
-            'type': backup_type,
-            'source_directory': source_path,
             'compressed': compress,
+            'hash': directory_hash,
+            'size': 0,
+            'file_count': file_count,
             'is_symlink': True,
+            'unique_size': 0,
             'symlink_target': source_path
-        }
-        
-        if compress:
-            # 压缩备份的软链接，将元数据添加到ZIP文件中
-            with zipfile.ZipFile(target_path, 'a', zipfile.ZIP_DEFLATED) as zipf:
-                metadata_json = json.dumps(backup_info, ensure_ascii=False, indent=2)
-                zipf.writestr('backup_info.json', metadata_json)
-        else:
-            # 目录备份的软链接，创建元数据文件
-            with open(os.path.join(target_path, 'backup_info.json'), 'w', encoding='utf-8') as f:
-                json.dump(backup_info, f, ensure_ascii=False, indent=2)
+        })
         
         logging.info(f"创建软链接备份: {target_path} -> {source_path}")
         return target_path
@@ -219,164 +194,409 @@ def create_symlink_backup(target_path, source_path, backup_type, timestamp, comp
         logging.error(f"创建软链接备份失败: {str(e)}")
         return None
 
-def create_compressed_backup(source_dir, backup_path, compression_level=6):
-    """创建压缩备份"""
+def create_compressed_backup(source_dir, backup_path, compression_level=6, manifest=None, workers=None,
+                             reuse_from=None, policy=None, digests=None, throttle=UNLIMITED, tracer=None):
+    """创建压缩备份
+
+    成员在多个线程中并行压缩，按清单顺序写入；workers 为压缩线程数，默认使用全部 CPU 核心。
+    reuse_from 为上一个压缩快照，其中未变化的文件直接复用已压缩的数据。
+    policy 为按文件选择压缩算法的策略，为 None 时全部使用 DEFLATED。
+    digests 为按内容检测变化时的文件摘要，写入包内清单并作为复用成员的条件。
+    throttle 为 I/O 限速器，tracer 为慢文件追踪器（见 profiling.SlowFileTracer）。
+    成功时返回压缩统计字典，失败时返回 None。
+    """
     try:
+        if manifest is None:
+            manifest = scan_directory(source_dir)
+        
         with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=compression_level) as zipf:
-            for root, dirs, files in os.walk(source_dir):
-                # 跳过隐藏文件和系统文件
-                dirs[:] = [d for d in dirs if not d.startswith('.') and d not in ['$RECYCLE.BIN', 'System Volume Information']]
-                
-                for file in files:
-                    if not file.startswith('.'):
-                        file_path = os.path.join(root, file)
-                        # 计算相对路径
-                        arcname = os.path.relpath(file_path, source_dir)
-                        zipf.write(file_path, arcname)
-                        logging.debug(f"添加文件到压缩包: {arcname}")
-        
-        logging.info(f"压缩备份创建成功: {backup_path}")
-        return True
+            stats = write_archive(zipf, source_dir, manifest, compression_level, workers, reuse_from, policy,
+                                  digests, throttle, tracer)
+        
+        logging.info(f"压缩备份创建成功: {backup_path} (压缩 {stats['compressed']} 个文件, 复用 {stats['reused']} 个文件)")
+        for codec, codec_stats in stats['codecs'].items():
+            logging.info(f"压缩算法 {codec}: {codec_stats['files']} 个文件, 节省 {codec_stats['bytes_saved']} 字节, "
+                         f"耗时 {codec_stats['seconds']} 秒")
+        return stats
     except Exception as e:
         logging.error(f"创建压缩备份失败: {str(e)}")
-        return False
+        return None
 
-def create_backup(source_dir, target_base_dir, backup_type, compress=False, compression_level=6, enable_symlink=True):
-    """创建新备份"""
-    if not os.path.exists(source_dir):
-        logging.error(f"源目录不存在: {source_dir}")
+def get_snapshot_hash(target_base_dir, snapshot_path):
+    """返回快照目录中登记的实际快照的目录哈希"""
+    for backup in list_snapshots(target_base_dir):
+        if not backup['is_symlink'] and os.path.abspath(backup['path']) == os.path.abspath(snapshot_path):
+            return backup['hash']
+    return None
+
+def find_previous_snapshot(target_base_dir, backup_type, backup_path, compressed=False):
+    """查找同一层级中上一个同类（目录或压缩）快照的实际路径
+
+    软链接快照解析为其实际目标；不会返回本次备份自身的路径（同一时间段内重复运行时）。
+    目录快照用于硬链接，压缩快照用于复用已压缩的成员。
+    """
+    candidates = [
+        backup for backup in list_snapshots(target_base_dir, backup_type)
+        if backup['compressed'] == compressed and os.path.abspath(backup['path']) != os.path.abspath(backup_path)
+    ]
+    if not candidates:
         return None
     
-    # 根据备份类型创建不同的目录结构
-    now = datetime.now()
-    
+    candidates.sort(key=lambda x: x['created_at'])
+    last_backup = candidates[-1]
+    snapshot_path = last_backup.get('symlink_target') or last_backup['path']
+    if os.path.abspath(snapshot_path) == os.path.abspath(backup_path):
+        return None
+    if compressed:
+        return snapshot_path if os.path.isfile(snapshot_path) else None
+    return snapshot_path if os.path.isdir(snapshot_path) else None
+
+def get_backup_dir(target_base_dir, backup_type, now):
+    """返回 (时间戳, 备份路径)（压缩备份另加 .zip 后缀），未知的备份类型返回 (None, None)"""
     if backup_type == 'hourly':
         # 每小时备份：YYYY-MM-DD_HHMM 格式
         timestamp = now.strftime("%Y-%m-%d_%H%M")
-        backup_dir = os.path.join(target_base_dir, 'hourly', timestamp)
-    elif backup_type == 'daily':
-        # 每日备份：YYYY-MM-DD 格式
+    elif backup_type in ('daily', 'weekly'):
+        # 每日备份和每周备份（周日）：YYYY-MM-DD 格式
         timestamp = now.strftime("%Y-%m-%d")
-        backup_dir = os.path.join(target_base_dir, 'daily', timestamp)
-    elif backup_type == 'weekly':
-        # 每周备份：YYYY-MM-DD 格式（周日）
-        timestamp = now.strftime("%Y-%m-%d")
-        backup_dir = os.path.join(target_base_dir, 'weekly', timestamp)
     else:
+        return None, None
+    return timestamp, os.path.join(target_base_dir, backup_type, timestamp)
+
+def rewrite_backup_info(backup_path, updates):
+    """更新目录快照中的 backup_info.json（先删除再写入，不影响与其共享硬链接的其他快照）
+
+    压缩快照内嵌的元数据无法单独修改，重建快照目录时层级以所在目录为准。
+    """
+    info_path = os.path.join(backup_path, 'backup_info.json')
+    if not os.path.isdir(backup_path) or not os.path.exists(info_path):
+        return
+    with open(info_path, 'r', encoding='utf-8') as f:
+        backup_info = json.load(f)
+    os.remove(info_path)
+    backup_info.update(updates)
+    with open(info_path, 'w', encoding='utf-8') as f:
+        json.dump(backup_info, f, ensure_ascii=False, indent=2)
+
+def promote_backup(snapshot_path, target_base_dir, backup_type, mode='hardlink'):
+    """把本次运行已创建的快照提升为另一个层级的快照，源目录不再重新复制或压缩
+
+    mode 为 'hardlink' 时把快照硬链接（无法硬链接时克隆或复制）到新层级，两个层级共享数据但各自独立；
+    为 'reference' 时只创建指向实际快照的软链接并登记在快照目录中，删除实际快照时数据会移交给引用它的快照。
+    两种方式下各层级的保留策略互不影响。成功时返回新快照路径，失败时返回 None。
+    """
+    try:
+        snapshots = list_snapshots(target_base_dir)
+        source = next((b for b in snapshots if os.path.abspath(b['path']) == os.path.abspath(snapshot_path)), None)
+        if source is None:
+            logging.error(f"快照目录中没有要提升的快照: {snapshot_path}")
+            return None
+        
+        # 始终以实际存储数据的快照为来源，避免形成链接链
+        physical_path = os.path.abspath(source.get('symlink_target') or source['path'])
+        compress = source['compressed']
+        now = datetime.now()
+        timestamp, backup_path = get_backup_dir(target_base_dir, backup_type, now)
+        if backup_path is None:
+            logging.error(f"未知的备份类型: {backup_type}")
+            return None
+        backup_path += '.zip' if compress else ''
+        
+        if mode == 'reference':
+            backup_path = create_symlink_backup(backup_path, physical_path, backup_type, timestamp, compress,
+                                                source['hash'], source['file_count'])
+            if backup_path:
+                record_promoted_snapshot(target_base_dir, source['path'], backup_path, timestamp)
+            return backup_path
+        
+        os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+        if os.path.lexists(backup_path):
+            # 同一时间段内重复运行，重新生成本时间段的快照
+            delete_backup(backup_path)
+        
+        if compress:
+            link_file(physical_path, backup_path)
+        else:
+            report = link_tree(physical_path, backup_path)
+            if report['errors']:
+                logging.error(f"{backup_type}快照提升失败，{len(report['errors'])} 个文件链接失败")
+                return None
+            
+            # backup_info.json 是共享的硬链接，为新层级单独写一份
+            rewrite_backup_info(backup_path, {'timestamp': timestamp, 'created_at': now.isoformat(),
+                                              'type': backup_type, 'promoted_from': physical_path})
+        
+        record_snapshot(target_base_dir, {
+            'path': backup_path,
+            'timestamp': timestamp,
+            'created_at': now.isoformat(),
+            'compressed': compress,
+            'hash': source['hash'],
+            'size': source['size'],
+            'file_count': source['file_count'],
+            'is_symlink': False,
+            'source_size': source.get('source_size'),
+            'unique_size': 0
+        })
+        record_promoted_snapshot(target_base_dir, source['path'], backup_path, timestamp)
+        
+        logging.info(f"{backup_type}备份由快照提升: {backup_path} <= {physical_path}")
+        return backup_path
+    
+    except Exception as e:
+        logging.error(f"{backup_type}快照提升失败: {str(e)}")
+        return None
+
+def create_backup(source_dir, target_base_dir, backup_type, compress=False, compression_level=6, enable_symlink=True,
+                  hardlink=False, compression_workers=None, compression_policy=None, copy_workers=None, journal=None,
+                  scan_workers=None, max_disk_usage_percent=None, change_detection='metadata', hash_workers=None,
+                  throttle=None, metrics=None, delta=None):
+    """创建新备份
+
+    目录备份在进程内按文件清单复制，copy_workers 为复制线程数。
+    hardlink 为 True 且不压缩时，创建硬链接增量快照：未变化的文件硬链接到同一层级的上一个快照，
+    只复制新增或修改的文件。
+    compression_workers 为压缩备份使用的线程数，默认使用全部 CPU 核心。
+    compression_policy 为 load_codec_policy() 返回的压缩策略，按文件类型选择压缩算法。
+    scan_workers 为并行扫描源目录的线程数。
+    journal 为守护进程维护的 ChangeJournal：有日志时不再遍历源目录，没有变化时直接沿用上次的清单和哈希。
+    max_disk_usage_percent 不为 None 时，复制之前根据文件清单预估本次备份的大小，
+    并一次性删除足够的旧快照，使写入后的磁盘使用率不超过该值。
+    change_detection 为 'content' 时按文件内容检测变化：用 hash_workers 个线程计算 BLAKE2b 摘要（有缓存），
+    目录哈希由摘要得出，硬链接增量快照和复用压缩成员都要求内容一致，摘要写入快照元数据。
+    throttle 为 load_resources() 返回的 IOThrottle，限制哈希、复制和压缩阶段的带宽和 IOPS，
+    本次备份因限速等待的时间记录在元数据的 throttled_seconds 中。
+    metrics 为本次运行的 RunMetrics，记录各阶段的耗时和本次备份的文件数、字节数、吞吐量和压缩率；
+    其中的剖析器剖析选中的阶段，并追踪哈希、复制或压缩过慢的文件。
+    delta 为 load_delta_config() 返回的差异存储设置：目录备份时大文件只保存与同一层级上一个快照相比变化的块。
+    """
+    throttle = throttle or UNLIMITED
+    throttled_before = throttle.throttled_seconds
+    metrics = metrics or RunMetrics()
+    tracer = metrics.profiler.tracer if metrics.profiler is not None else None
+    started = time.monotonic()
+    if not os.path.exists(source_dir):
+        logging.error(f"源目录不存在: {source_dir}")
+        metrics.record_backup(backup_type, 'failed')
+        return None
+    
+    # 根据备份类型创建不同的目录结构
+    now = datetime.now()
+    timestamp, backup_dir = get_backup_dir(target_base_dir, backup_type, now)
+    if backup_dir is None:
         logging.error(f"未知的备份类型: {backup_type}")
+        metrics.record_backup(backup_type, 'failed')
         return None
     
     # 确保目标目录存在
     os.makedirs(os.path.dirname(backup_dir), exist_ok=True)
     
+    total_files = total_bytes = 0
     try:
+        # 生成的文件清单供哈希、复制、压缩和元数据统计共同使用
+        with metrics.phase('scan'):
+            changes = journal.take_changes() if journal is not None else None
+            previous_hash = journal.root_hash if changes is not None else None
+            if changes is not None and not any(changes) and previous_hash:
+                # 变化日志为空：源目录未变化，沿用上次的清单和根哈希
+                manifest = journal.manifest
+                directory_hash, changed_paths = previous_hash, []
+                logging.info("变化日志为空，源目录未变化")
+            else:
+                if changes is not None:
+                    # 只重新 stat 变化日志中的路径
+                    manifest = journal.apply_changes(changes)
+                    logging.info(f"按变化日志更新文件清单: {len(changes[0])} 个文件, {len(changes[1])} 个目录")
+                else:
+                    # 并行遍历一次源目录
+                    manifest = scan_directory(source_dir, scan_workers)
+                
+                # 更新 Merkle 树，得到覆盖整个源目录的根哈希和变化的文件列表
+                directory_hash, changed_paths = update_merkle_tree(target_base_dir, manifest)
+                if journal is not None:
+                    journal.set_base(manifest, directory_hash)
+        
+        # 按内容检测变化：修改时间被保留或时钟不准时，元数据不变但内容变化的文件同样能被发现
+        digests = None
+        if change_detection == 'content':
+            with metrics.phase('hash'):
+                digests, _ = hash_manifest(source_dir, manifest, target_base_dir, hash_workers, throttle, tracer)
+            directory_hash = content_root_hash(digests)
+        
+        total_files, total_bytes = summarize_manifest(manifest)
+        logging.info(f"当前目录哈希: {directory_hash[:8]}... (文件数: {total_files}, 总大小 {total_bytes} 字节, "
+                     f"自上次扫描变化: {len(changed_paths)})")
+        
         # 检查是否启用软链接功能
         if enable_symlink:
-            # 计算当前目录的哈希值
-            current_hash, file_count = calculate_directory_hash(source_dir)
-            if current_hash:
-                logging.info(f"当前目录哈希: {current_hash[:8]}... (文件数: {file_count})")
+            # 获取最后一次备份信息
+            last_backup = get_last_backup_info(target_base_dir, backup_type)
+            if last_backup and last_backup.get('hash') == directory_hash:
+                logging.info(f"检测到目录内容未变化，创建软链接备份")
                 
-                # 获取最后一次备份信息
-                last_backup = get_last_backup_info(target_base_dir, backup_type)
-                if last_backup and last_backup.get('hash') == current_hash:
-                    logging.info(f"检测到目录内容未变化，创建软链接备份")
-                    
-                    # 创建软链接备份
-                    backup_path = backup_dir + ('.zip' if compress else '')
-                    return create_symlink_backup(backup_path, last_backup['path'], backup_type, timestamp, compress)
+                # 创建软链接备份（始终指向实际存储数据的快照，避免形成链接链）
+                backup_path = backup_dir + ('.zip' if compress else '')
+                link_target = last_backup.get('symlink_target') or last_backup['path']
+                if os.path.abspath(last_backup['path']) == os.path.abspath(backup_path):
+                    # 同一时间段内重复运行，已有的备份就是本次备份，不能把它替换成指向自身的链接
+                    logging.info(f"本时间段的备份已存在: {backup_path}")
+                    metrics.record_backup(backup_type, 'linked', backup_path, total_files, total_bytes,
+                                          seconds=time.monotonic() - started)
+                    return backup_path
+                with metrics.phase('metadata'):
+                    backup_path = create_symlink_backup(backup_path, link_target, backup_type, timestamp, compress,
+                                                        directory_hash, total_files)
+                    if backup_path:
+                        record_snapshot_files(target_base_dir, backup_path, timestamp,
+                                              manifest_files(manifest, digests))
+                metrics.record_backup(backup_type, 'linked' if backup_path else 'failed', backup_path, total_files,
+                                      total_bytes, seconds=time.monotonic() - started)
+                return backup_path
+        
+        # 确定本次备份的参照快照
+        reuse_from = link_dest = known_changes = link_map = delta_base = None
+        if compress:
+            backup_path = backup_dir + '.zip'
+            reuse_from = find_previous_snapshot(target_base_dir, backup_type, backup_path, compressed=True)
+        else:
+            backup_path = backup_dir
+            if hardlink:
+                # 硬链接增量快照（类似 rsync --link-dest）
+                link_dest = find_previous_snapshot(target_base_dir, backup_type, backup_path)
+                logging.info(f"创建硬链接增量快照，参照快照: {link_dest or '无（完整复制）'}")
+            # 参照快照恰好是上次扫描时的状态时，变化列表是精确的，其余文件无需再比较
+            if link_dest and previous_hash and previous_hash == get_snapshot_hash(target_base_dir, link_dest):
+                known_changes = set(changed_paths)
+            if link_dest and digests is not None:
+                # 按内容决定链接哪些文件；参照快照没有登记摘要时全部复制
+                link_map = plan_content_links(manifest, digests, get_snapshot_files(target_base_dir, link_dest) or {})
+            if delta is not None:
+                # 差异存储的基础为同一层级的上一个目录快照（未启用硬链接快照时同样需要）
+                delta_base = link_dest or find_previous_snapshot(target_base_dir, backup_type, backup_path)
+        
+        # 写入之前按预估大小一次性腾出磁盘空间，参照快照不会被删除
+        if max_disk_usage_percent is not None:
+            with metrics.phase('disk_check'):
+                # changed_paths 相对的是任一层级的上一次扫描，只有参照快照恰好是上次扫描的状态时才能用于预估；
+                # 否则按历史索引与参照快照比较，索引中没有参照快照时按完整清单预估
+                if known_changes is not None:
+                    copied_paths = known_changes
+                elif link_map is not None:
+                    copied_paths = [entry.path for entry in manifest if entry.path not in link_map]
+                elif link_dest:
+                    copied_paths = get_changed_paths(manifest, get_snapshot_files(target_base_dir, link_dest))
+                else:
+                    copied_paths = None
+                incoming = estimate_backup_size(
+                    manifest, compress, copied_paths,
+                    get_compression_ratio(get_backups_by_type(target_base_dir)[backup_type]) if compress else None
+                )
+                free_disk_space(target_base_dir, max_disk_usage_percent, incoming,
+                                protected=[path for path in (reuse_from, link_dest, delta_base) if path])
         
         # 创建实际备份
+        transfer_phase = 'archive' if compress else 'copy'
+        transfer_before = metrics.phase_seconds(transfer_phase)
         if compress:
             # 创建压缩备份
-            backup_path = backup_dir + '.zip'
-            success = create_compressed_backup(source_dir, backup_path, compression_level)
-            if not success:
+            with metrics.phase('archive'):
+                archive_stats = create_compressed_backup(source_dir, backup_path, compression_level, manifest,
+                                                         compression_workers, reuse_from, compression_policy,
+                                                         digests, throttle, tracer)
+            if archive_stats is None:
+                metrics.record_backup(backup_type, 'failed', backup_path, total_files, total_bytes,
+                                      seconds=time.monotonic() - started)
                 return None
         else:
-            # 创建目录备份
-            backup_path = backup_dir
-            
-            # 根据操作系统选择不同的复制方法
-            if is_windows():
-                # Windows 系统使用 robocopy
-                cmd = f'robocopy "{source_dir}" "{backup_path}" /MIR /Z /COPY:DAT /R:3 /W:10 /NFL /NDL'
-                result = os.system(cmd)
+            # 创建目录备份：在进程内复制（reflink / copy_file_range / sendfile），不依赖 rsync 或 robocopy
+            with metrics.phase('copy'):
+                if os.path.isdir(backup_path) and not os.path.islink(backup_path):
+                    # 同一时间段内重复运行，重新生成本时间段的快照（旧快照移入回收站）
+                    move_to_trash(backup_path)
                 
-                # robocopy返回码：0-7表示成功，8及以上表示错误
-                if result > 7:
-                    logging.error(f"{backup_type}备份失败，robocopy返回码: {result}")
-                    return None
-            else:
-                # macOS/Linux 系统使用 rsync
-                try:
-                    # 确保目标目录存在
-                    os.makedirs(backup_path, exist_ok=True)
-                    
-                    # 使用 rsync 进行高效复制
-                    # -a: 归档模式，保持文件属性
-                    # -v: 详细输出
-                    # -z: 压缩传输
-                    # --delete: 删除目标目录中源目录没有的文件
-                    # --exclude: 排除隐藏文件和系统文件
-                    cmd = [
-                        'rsync', '-avz', '--delete',
-                        '--exclude=.*',
-                        '--exclude=*~',
-                        '--exclude=.DS_Store',
-                        '--exclude=Thumbs.db',
-                        f'{source_dir}/',
-                        f'{backup_path}/'
-                    ]
-                    
-                    result = subprocess.run(cmd, capture_output=True, text=True)
-                    
-                    if result.returncode != 0:
-                        logging.error(f"{backup_type}备份失败，rsync返回码: {result.returncode}")
-                        logging.error(f"rsync错误输出: {result.stderr}")
-                        return None
-                    else:
-                        logging.info(f"rsync备份成功: {result.stdout}")
-                        
-                except FileNotFoundError:
-                    logging.error("rsync 命令未找到，请确保已安装 rsync")
-                    return None
-                except Exception as e:
-                    logging.error(f"rsync备份失败: {str(e)}")
-                    return None
-        
-        # 计算目录哈希值
-        directory_hash, file_count = calculate_directory_hash(source_dir)
+                link_report = create_directory_snapshot(source_dir, backup_path, manifest, link_dest, copy_workers,
+                                                        known_changes, link_map, throttle, tracer, delta, delta_base)
+            if link_report['errors']:
+                for error in link_report['errors']:
+                    logging.error(f"复制失败: {error['path']} (errno={error['errno']}): {error['error']}")
+                logging.error(f"{backup_type}备份失败，{len(link_report['errors'])} 个文件复制失败")
+                metrics.record_backup(backup_type, 'failed', backup_path, total_files, total_bytes,
+                                      seconds=time.monotonic() - started)
+                return None
+        transfer_seconds = metrics.phase_seconds(transfer_phase) - transfer_before
         
         # 添加备份元数据文件
-        backup_info = {
-            'timestamp': timestamp,
-            'created_at': now.isoformat(),
-            'type': backup_type,
-            'source_directory': source_dir,
-            'compressed': compress,
-            'compression_level': compression_level if compress else None,
-            'directory_hash': directory_hash,
-            'file_count': file_count,
-            'is_symlink': False
-        }
+        with metrics.phase('metadata'):
+            backup_info = {
+                'timestamp': timestamp,
+                'created_at': now.isoformat(),
+                'type': backup_type,
+                'source_directory': source_dir,
+                'compressed': compress,
+                'compression_level': compression_level if compress else None,
+                'directory_hash': directory_hash,
+                'file_count': total_files,
+                'total_size': total_bytes,
+                'is_symlink': False,
+                'change_detection': change_detection,
+                'throttled_seconds': round(throttle.throttled_seconds - throttled_before, 3)
+            }
+            if compress:
+                backup_info['reused_files'] = archive_stats['reused']
+                backup_info['reused_bytes'] = archive_stats['reused_bytes']
+                backup_info['codec_stats'] = archive_stats['codecs']
+            else:
+                backup_info['hardlink'] = hardlink
+                backup_info['linked_files'] = link_report['linked']
+                backup_info['copied_files'] = link_report['copied']
+                backup_info['cloned_files'] = link_report['cloned']
+                backup_info['copied_bytes'] = link_report['copied_bytes']
+                if delta is not None:
+                    backup_info['delta_files'] = link_report['deltas']
+                if digests is not None:
+                    # 每个文件的内容摘要，供校验和去重使用（压缩快照的摘要在包内清单中）
+                    backup_info['file_digests'] = digests
         
-        # 如果是压缩备份，将元数据文件添加到压缩包中
-        if compress:
-            with zipfile.ZipFile(backup_path, 'a', zipfile.ZIP_DEFLATED) as zipf:
-                # 创建元数据JSON字符串
-                metadata_json = json.dumps(backup_info, ensure_ascii=False, indent=2)
-                zipf.writestr('backup_info.json', metadata_json)
-        else:
-            # 目录备份，创建元数据文件
-            with open(os.path.join(backup_path, 'backup_info.json'), 'w', encoding='utf-8') as f:
-                json.dump(backup_info, f, ensure_ascii=False, indent=2)
+            # 如果是压缩备份，将元数据文件添加到压缩包中
+            content_hashes = digests
+            if compress:
+                with zipfile.ZipFile(backup_path, 'a', zipfile.ZIP_DEFLATED) as zipf:
+                    # 创建元数据JSON字符串
+                    metadata_json = json.dumps(backup_info, ensure_ascii=False, indent=2)
+                    zipf.writestr('backup_info.json', metadata_json)
+                    # 成员的 CRC 作为历史索引中的内容哈希
+                    if content_hashes is None:
+                        content_hashes = {zinfo.filename: f"crc32:{zinfo.CRC:08x}" for zinfo in zipf.infolist()}
+            else:
+                # 目录备份，创建元数据文件
+                with open(os.path.join(backup_path, 'backup_info.json'), 'w', encoding='utf-8') as f:
+                    json.dump(backup_info, f, ensure_ascii=False, indent=2)
+        
+            record_snapshot(target_base_dir, {
+                'path': backup_path,
+                'timestamp': timestamp,
+                'created_at': backup_info['created_at'],
+                'compressed': compress,
+                'hash': directory_hash,
+                'size': os.path.getsize(backup_path) if compress else total_bytes,
+                'file_count': total_files,
+                'is_symlink': False,
+                'source_size': total_bytes,
+                'unique_size': os.path.getsize(backup_path) if compress else link_report['copied_bytes']
+            })
+            record_snapshot_files(target_base_dir, backup_path, timestamp, manifest_files(manifest, content_hashes))
+        
+        written_bytes = os.path.getsize(backup_path) if compress else link_report['copied_bytes']
+        metrics.record_backup(backup_type, 'created', backup_path, total_files, total_bytes, written_bytes,
+                              time.monotonic() - started, transfer_seconds, compress)
                 
         logging.info(f"{backup_type}备份成功: {backup_path}")
         return backup_path
             
     except Exception as e:
         logging.error(f"{backup_type}备份失败: {str(e)}")
+        metrics.record_backup(backup_type, 'failed', None, total_files, total_bytes,
+                              seconds=time.monotonic() - started)
         return None
 
 def get_backups_by_type(backup_dir):
@@ -387,177 +607,465 @@ def get_backups_by_type(backup_dir):
         'weekly': []
     }
     
+    # 从快照目录读取，无需重新打开每个备份
+    for backup in list_snapshots(backup_dir):
+        if backup['type'] in backups:
+            backups[backup['type']].append(backup)
+    
+    # 按解析后的快照时间排序（旧到新）；每小时和每日快照的名称格式不同，不能按字符串排序
     for backup_type in backups.keys():
-        type_dir = os.path.join(backup_dir, backup_type)
-        if not os.path.exists(type_dir):
-            continue
-            
-        for item in os.listdir(type_dir):
-            item_path = os.path.join(type_dir, item)
-            
-            # 检查是否为目录或压缩文件
-            if os.path.isdir(item_path):
-                # 目录备份
-                info_file = os.path.join(item_path, 'backup_info.json')
-                if os.path.exists(info_file):
-                    try:
-                        with open(info_file, 'r', encoding='utf-8') as f:
-                            info = json.load(f)
-                            if info.get('type') == backup_type:
-                                backups[backup_type].append({
-                                    'path': item_path,
-                                    'timestamp': info.get('timestamp', ''),
-                                    'created_at': info.get('created_at', ''),
-                                    'compressed': False,
-                                    'is_symlink': info.get('is_symlink', False),
-                                    'hash': info.get('directory_hash', '')
-                                })
-                    except Exception as e:
-                        logging.warning(f"读取备份信息失败: {item_path}, 错误: {str(e)}")
-                        continue
-            elif item.endswith('.zip'):
-                # 压缩备份
-                try:
-                    with zipfile.ZipFile(item_path, 'r') as zipf:
-                        if 'backup_info.json' in zipf.namelist():
-                            info_json = zipf.read('backup_info.json').decode('utf-8')
-                            info = json.loads(info_json)
-                            if info.get('type') == backup_type:
-                                backups[backup_type].append({
-                                    'path': item_path,
-                                    'timestamp': info.get('timestamp', ''),
-                                    'created_at': info.get('created_at', ''),
-                                    'compressed': True,
-                                    'is_symlink': info.get('is_symlink', False),
-                                    'hash': info.get('directory_hash', '')
-                                })
-                except Exception as e:
-                    logging.warning(f"读取压缩备份信息失败: {item_path}, 错误: {str(e)}")
-                    continue
-    
-    # 按时间排序（旧到新）
-    for backup_type in backups.keys():
-        backups[backup_type].sort(key=lambda x: x['timestamp'])
+        backups[backup_type].sort(key=lambda x: parse_snapshot_time(x['timestamp']) or datetime.min)
     
     return backups
 
-def cleanup_old_backups(config, backup_dir):
-    """清理旧备份"""
-    backups = get_backups_by_type(backup_dir)
-    
-    # 清理每小时备份：保留最近24个
-    if len(backups['hourly']) > 24:
-        for old_backup in backups['hourly'][:-24]:
-            delete_backup(old_backup['path'])
-            logging.info(f"删除过期每小时备份: {old_backup['timestamp']}")
+def cleanup_old_backups(config, backup_dir, policy=None, metrics=None):
+    """按保留策略清理旧备份，然后检查磁盘空间
+
+    快照只列出一次：保留策略在内存中一次计算出完整的删除集合并批量删除，
+    磁盘空间检查使用剩余的快照列表。policy 为 load_retention_policy() 的结果，默认从配置读取。
+    metrics 为 RunMetrics 时分别记录保留策略和磁盘空间检查的耗时。
+    """
+    if policy is None:
+        policy = load_retention_policy(config.get('retention'))
+    metrics = metrics or RunMetrics()
     
-    # 清理每日备份：保留最近30个
-    if len(backups['daily']) > 30:
-        for old_backup in backups['daily'][:-30]:
-            delete_backup(old_backup['path'])
-            logging.info(f"删除过期每日备份: {old_backup['timestamp']}")
+    with metrics.phase('retention'):
+        backups = get_backups_by_type(backup_dir)
+        to_delete = plan_retention(backups, policy)
+        
+        type_names = {'hourly': '每小时', 'daily': '每日', 'weekly': '每周'}
+        for old_backup in to_delete:
+            logging.info(f"删除过期{type_names.get(old_backup['type'], old_backup['type'])}备份: "
+                         f"{old_backup['timestamp']}")
+        delete_backups([old_backup['path'] for old_backup in to_delete])
     
-    # 清理每周备份：保留最近52个（约一年）
-    if len(backups['weekly']) > 52:
-        for old_backup in backups['weekly'][:-52]:
-            delete_backup(old_backup['path'])
-            logging.info(f"删除过期每周备份: {old_backup['timestamp']}")
+    deleted = {old_backup['path'] for old_backup in to_delete}
+    remaining = {
+        backup_type: [backup for backup in items if backup['path'] not in deleted]
+        for backup_type, items in backups.items()
+    }
     
     # 检查磁盘空间，必要时删除最旧的备份
-    check_disk_space_and_cleanup(config, backup_dir)
+    with metrics.phase('disk_check'):
+        check_disk_space_and_cleanup(config, backup_dir, remaining)
+
+def _index_snapshots(snapshots):
+    """按路径索引快照记录，并建立实际快照到引用它的软链接快照的映射"""
+    records = {os.path.abspath(b['path']): b for b in snapshots}
+    referrers = {}
+    for b in snapshots:
+        if b['is_symlink'] and b.get('symlink_target'):
+            referrers.setdefault(os.path.abspath(b['symlink_target']), []).append(b)
+    return records, referrers
+
+def _hand_off_snapshot(backup_path, records, referrers):
+    """把即将删除的实际快照移交给引用它的软链接快照
+
+    引用者优先选择保留时间最长的层级（每周 → 每日 → 每小时）中最新的一个：
+    该软链接被替换为实际快照，其余引用者改为指向它。没有引用者时返回 None。
+    records 和 referrers 由 _index_snapshots 建立，移交后原地更新。
+    """
+    target_base_dir = os.path.dirname(os.path.dirname(backup_path))
+    key = os.path.abspath(backup_path)
+    candidates = referrers.pop(key, [])
+    if not candidates:
+        return None
+    
+    source = records.pop(key, None)
+    tier_order = {'hourly': 0, 'daily': 1, 'weekly': 2}
+    candidates.sort(key=lambda b: (tier_order.get(b['type'], -1), b['created_at']))
+    heir = candidates.pop()
+    heir_key = os.path.abspath(heir['path'])
+    
+    os.unlink(heir['path'])
+    os.rename(backup_path, heir['path'])
+    rewrite_backup_info(heir['path'], {'timestamp': heir['timestamp'], 'created_at': heir['created_at'],
+                                       'type': heir['type'], 'handed_off_from': key})
+    remove_snapshot(target_base_dir, backup_path)
+    heir_record = {
+        'path': heir['path'],
+        'timestamp': heir['timestamp'],
+        'created_at': heir['created_at'],
+        'type': heir['type'],
+        'compressed': heir['compressed'],
+        'hash': heir['hash'],
+        'size': source['size'] if source else None,
+        'file_count': heir['file_count'],
+        'is_symlink': False,
+        'source_size': source.get('source_size') if source else None,
+        'unique_size': source.get('unique_size') if source else None
+    }
+    record_snapshot(target_base_dir, heir_record)
+    records[heir_key] = heir_record
+    
+    for referrer in candidates:
+        os.unlink(referrer['path'])
+        os.symlink(heir_key, referrer['path'])
+        referrer['symlink_target'] = heir_key
+        record_snapshot(target_base_dir, referrer)
+    if candidates:
+        referrers[heir_key] = candidates
+    
+    logging.info(f"快照数据移交: {backup_path} -> {heir['path']}（另有 {len(candidates)} 个引用已更新）")
+    return heir['path']
+
+def _delete_backup_files(backup_path, records, referrers):
+    """删除备份在磁盘上的数据，返回是否需要从快照目录中移除该记录
+
+    被其他软链接快照引用的实际快照不会被删除，而是移交给引用者，保证各层级的保留策略互不影响。
+    目录快照原子地移入回收站，由回收线程在后台删除其中的文件。
+    """
+    if os.path.lexists(backup_path) and not os.path.islink(backup_path):
+        if _hand_off_snapshot(backup_path, records, referrers):
+            return False
+    
+    record = records.pop(os.path.abspath(backup_path), None)
+    if record and record['is_symlink'] and record.get('symlink_target'):
+        siblings = referrers.get(os.path.abspath(record['symlink_target']), [])
+        siblings[:] = [b for b in siblings if b['path'] != record['path']]
+    
+    if os.path.lexists(backup_path):
+        if os.path.islink(backup_path):
+            # 删除软链接
+            os.unlink(backup_path)
+        elif os.path.isdir(backup_path):
+            move_to_trash(backup_path)
+        else:
+            os.remove(backup_path)
+        logging.info(f"删除备份: {backup_path}")
+    return True
+
+def delete_backups(backup_paths):
+    """批量删除备份，快照目录的记录在一个事务中移除
+
+    先删除软链接快照，再删除实际快照，避免把数据移交给同一批中即将删除的软链接。
+    每个目标目录只列出一次快照，引用关系在内存中随删除和移交更新。
+    """
+    indexes = {}
+    removed = {}
+    for backup_path in sorted(backup_paths, key=lambda path: not os.path.islink(path)):
+        # 备份路径为 <目标目录>/<类型>/<名称>
+        target_base_dir = os.path.dirname(os.path.dirname(backup_path))
+        try:
+            if target_base_dir not in indexes:
+                indexes[target_base_dir] = _index_snapshots(list_snapshots(target_base_dir))
+            if _delete_backup_files(backup_path, *indexes[target_base_dir]):
+                removed.setdefault(target_base_dir, []).append(backup_path)
+        except Exception as e:
+            logging.error(f"删除备份失败: {backup_path}, 错误: {str(e)}")
+    
+    for target_base_dir, paths in removed.items():
+        remove_snapshots(target_base_dir, paths)
+    
+    # 已删除或数据已移交给引用者的快照从历史索引中移除
+    pruned = {}
+    for backup_path in backup_paths:
+        if not os.path.lexists(backup_path):
+            pruned.setdefault(os.path.dirname(os.path.dirname(backup_path)), []).append(backup_path)
+    for target_base_dir, paths in pruned.items():
+        remove_snapshot_files(target_base_dir, paths)
 
 def delete_backup(backup_path):
-    """删除指定备份"""
-    try:
-        if os.path.exists(backup_path):
-            if os.path.islink(backup_path):
-                # 删除软链接
-                os.unlink(backup_path)
-            elif os.path.isdir(backup_path):
-                shutil.rmtree(backup_path)
-            else:
-                os.remove(backup_path)
-            logging.info(f"删除备份: {backup_path}")
-    except Exception as e:
-        logging.error(f"删除备份失败: {backup_path}, 错误: {str(e)}")
+    """删除指定备份（见 delete_backups）"""
+    delete_backups([backup_path])
 
-def check_disk_space_and_cleanup(config, backup_dir):
-    """检查磁盘空间并清理"""
-    try:
-        # 获取磁盘使用情况
-        total, used, free = shutil.disk_usage(backup_dir)
-        max_usage_percent = config.get('max_disk_usage_percent', 85)
-        current_usage_percent = (used / total) * 100
+def free_disk_space(backup_dir, max_usage_percent, incoming_bytes=0, backups=None, protected=()):
+    """确保写入 incoming_bytes 后磁盘使用率不超过 max_usage_percent
+
+    根据快照目录中记录的独占大小一次计算出需要删除的快照集合并批量删除，不再逐个删除后重新检查磁盘。
+    独占大小是估计值（仍被较新的快照硬链接的数据不会释放），删除后按实际磁盘使用重新检查，
+    空间仍不足时在剩余的快照中再规划一次。
+    每个层级最新的快照、protected 中的快照以及仍被软链接引用的实际快照不会被删除。
+    回收站中尚未删除的条目先计入可释放的空间；需要腾出空间时立即（不限速）清空回收站，
+    保证写入之前空间已经真正释放。返回预计释放的字节数。
+    """
+    total, used, free = shutil.disk_usage(backup_dir)
+    logging.info(f"磁盘使用情况: {used / total * 100:.2f}%, 本次写入预计 {incoming_bytes} 字节, "
+                 f"最大允许: {max_usage_percent}%")
+    
+    bytes_to_free = get_bytes_to_free(backup_dir, incoming_bytes, max_usage_percent)
+    if bytes_to_free <= 0:
+        return 0
+    
+    logging.warning(f"磁盘空间不足，需要释放 {bytes_to_free} 字节")
+    if backups is None:
+        backups = get_backups_by_type(backup_dir)
+    protected = list(protected)
+    total_freed = deleted = 0
+    while True:
+        to_delete, expected_freed = plan_space_cleanup(backups, bytes_to_free, protected, list_trash(backup_dir))
+        if expected_freed < bytes_to_free:
+            logging.warning(f"删除所有可删除的快照也只能释放 {expected_freed} 字节")
         
-        logging.info(f"磁盘使用情况: {current_usage_percent:.2f}%, 最大允许: {max_usage_percent}%")
+        for backup in to_delete:
+            logging.info(f"为腾出磁盘空间删除备份: {backup['path']}")
+        delete_backups([backup['path'] for backup in to_delete])
+        reap_trash(backup_dir)
+        total_freed += expected_freed
+        deleted += len(to_delete)
+        if not to_delete:
+            break
         
-        # 如果磁盘使用率超过限制，开始清理
-        if current_usage_percent > max_usage_percent:
-            logging.warning(f"磁盘空间不足，开始清理...")
-            
-            # 获取所有备份并按时间排序
-            all_backups = []
-            backups = get_backups_by_type(backup_dir)
-            
-            # 按优先级排序：先删除每小时备份，再删除每日备份，最后删除每周备份
-            for backup_type in ['hourly', 'daily', 'weekly']:
-                all_backups.extend(backups[backup_type])
-            
-            # 按创建时间排序（旧到新）
-            all_backups.sort(key=lambda x: x['created_at'])
-            
-            # 逐个删除最旧的备份，直到空间足够
-            for backup in all_backups:
-                delete_backup(backup['path'])
-                total, used, free = shutil.disk_usage(backup_dir)
-                current_usage_percent = (used / total) * 100
-                
-                if current_usage_percent <= max_usage_percent - 5:  # 留出一些缓冲空间
-                    logging.info(f"磁盘空间清理完成，当前使用率: {current_usage_percent:.2f}%")
-                    break
+        bytes_to_free = get_bytes_to_free(backup_dir, incoming_bytes, max_usage_percent)
+        if bytes_to_free <= 0:
+            break
+        logging.warning(f"删除后仍需释放 {bytes_to_free} 字节，继续清理")
+        # 删除失败的快照不再重复选择
+        protected.extend(backup['path'] for backup in to_delete)
+        backups = get_backups_by_type(backup_dir)
+    logging.info(f"磁盘空间清理完成，删除 {deleted} 个快照，预计释放 {total_freed} 字节")
+    return total_freed
+
+def check_disk_space_and_cleanup(config, backup_dir, backups=None):
+    """检查磁盘空间并清理（见 free_disk_space）
+
+    backups 为调用方已经列出的 {层级: [快照]}，为 None 时从快照目录读取。
+    """
+    try:
+        free_disk_space(backup_dir, config.get('max_disk_usage_percent', 85), backups=backups)
     except Exception as e:
         logging.error(f"检查磁盘空间失败: {str(e)}")
 
-def main(config_file='back_config.json'):
-    """主函数"""
+def get_run_settings(config):
+    """从配置中读取并校验备份参数，配置无效时返回 None"""
+    settings = {
+        'source_dir': config.get('source_directory', ''),
+        'target_dir': config.get('target_directory', ''),
+        'compress': config.get('compress_backup', False),
+        'compression_level': config.get('compression_level', 6),
+        'enable_symlink': config.get('enable_symlink', True),
+        'hardlink': config.get('hardlink_snapshots', False),
+        'compression_workers': config.get('compression_workers'),
+        'copy_workers': config.get('copy_workers'),
+        'scan_workers': config.get('scan_workers'),
+        'change_detection': config.get('change_detection', 'metadata'),
+        'hash_workers': config.get('hash_workers'),
+        'tier_promotion': config.get('tier_promotion'),
+        'max_disk_usage_percent': config.get('max_disk_usage_percent', 85),
+        'job_name': config.get('name') or DEFAULT_JOB_NAME
+    }
+    
+    if not settings['source_dir'] or not settings['target_dir']:
+        logging.error("源目录或目标目录未配置")
+        return None
+    
+    # 过期快照移入回收站后由后台线程删除；trash_reap_rate 为每秒最多删除的文件数
+    settings['reaper'] = Reaper(settings['target_dir'], config.get('trash_reap_workers'),
+                                config.get('trash_reap_rate'))
+    
+    if settings['change_detection'] not in CHANGE_DETECTION_MODES:
+        logging.error(f"未知的变化检测方式: {settings['change_detection']}")
+        return None
+    
+    if settings['tier_promotion'] not in (None, False, 'hardlink', 'reference'):
+        logging.error(f"未知的层级提升方式: {settings['tier_promotion']}")
+        return None
+    
+    try:
+        settings['compression_policy'] = load_codec_policy(config.get('compression_policy'))
+    except (KeyError, TypeError, ValueError) as e:
+        logging.error(f"压缩策略配置无效: {str(e)}")
+        return None
+    
+    try:
+        settings['retention'] = load_retention_policy(config.get('retention'))
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        logging.error(f"保留策略配置无效: {str(e)}")
+        return None
+    
+    try:
+        settings['throttle'], settings['idle_io_priority'] = load_resources(config.get('resources'))
+    except (AttributeError, TypeError, ValueError) as e:
+        logging.error(f"资源限制配置无效: {str(e)}")
+        return None
+    
+    try:
+        settings['metrics'] = load_metrics_config(config.get('metrics'))
+    except ValueError as e:
+        logging.error(f"运行指标配置无效: {str(e)}")
+        return None
+    
+    try:
+        settings['profiling'] = load_profiling_config(config.get('profiling'))
+    except (AttributeError, TypeError, ValueError) as e:
+        logging.error(f"性能剖析配置无效: {str(e)}")
+        return None
+    
+    try:
+        settings['delta'] = load_delta_config(config.get('delta_storage'))
+    except (AttributeError, TypeError, ValueError) as e:
+        logging.error(f"差异存储配置无效: {str(e)}")
+        return None
+    if settings['delta'] is not None and settings['compress']:
+        logging.warning("差异存储只用于目录备份，压缩备份仍保存每个文件的完整内容")
+    
+    return settings
+
+def prepare_jobs(config):
+    """按配置文件中的 jobs 列表准备备份任务，返回 Job 列表；配置无效的任务记录错误后跳过"""
+    try:
+        job_configs = load_jobs(config)
+    except ValueError as e:
+        logging.error(f"备份任务配置无效: {str(e)}")
+        return []
+    
+    jobs = []
+    for name, job_config in job_configs:
+        settings = get_run_settings(job_config)
+        if settings is None:
+            logging.error(f"备份任务 {name} 配置无效，已跳过")
+            continue
+        jobs.append(Job(name, job_config, settings, get_job_devices(settings['source_dir'], settings['target_dir'])))
+    return jobs
+
+def run_backups(config, settings, backup_types):
+    """执行需要的各层级备份并清理旧备份，返回成功创建的备份类型列表
+
+    启用层级提升时源目录只备份一次，其余层级由该快照提升。
+    过期快照移入回收站后由后台线程删除，不阻塞下一个层级的备份；上次中断的回收在开始时继续。
+    运行结束后把各阶段的耗时和各备份的统计写入运行报告（见 write_run_outputs）；
+    启用性能剖析时，剖析结果写入运行报告旁的 profiles/ 目录。
+    """
+    target_dir = settings['target_dir']
+    profiler = create_profiler(settings.get('profiling'), os.path.dirname(get_report_path(settings)),
+                               settings.get('job_name') or DEFAULT_JOB_NAME)
+    metrics = RunMetrics(settings.get('job_name'), target_dir, profiler)
+    throttle = settings.get('throttle') or UNLIMITED
+    throttled_before = throttle.throttled_seconds
+    reaper = settings['reaper']
+    created_backups = []
+    # 本线程之后创建的复制、压缩和回收线程继承 idle I/O 优先级；ioprio 只作用于当前线程，
+    # 运行结束时恢复，不影响之后复用本线程的任务（任务线程池、守护进程主循环）
+    with idle_io_priority() if settings.get('idle_io_priority') else nullcontext():
+        reaper.start()
+        # 整个运行作为 run 阶段剖析；未启用剖析时不做任何事
+        with profiler.phase('run') if profiler is not None else nullcontext():
+            captured_path = None
+            for backup_type, should_backup in backup_types.items():
+                if should_backup:
+                    if settings['tier_promotion'] and captured_path:
+                        started = time.monotonic()
+                        with metrics.phase('promote'):
+                            backup_path = promote_backup(captured_path, target_dir, backup_type,
+                                                         settings['tier_promotion'])
+                        metrics.record_backup(backup_type, 'promoted' if backup_path else 'failed', backup_path,
+                                              seconds=time.monotonic() - started)
+                    else:
+                        backup_path = create_backup(settings['source_dir'], target_dir, backup_type,
+                                                    settings['compress'], settings['compression_level'],
+                                                    settings['enable_symlink'], settings['hardlink'],
+                                                    settings['compression_workers'], settings['compression_policy'],
+                                                    settings['copy_workers'], journal=settings.get('journal'),
+                                                    scan_workers=settings['scan_workers'],
+                                                    max_disk_usage_percent=settings['max_disk_usage_percent'],
+                                                    change_detection=settings['change_detection'],
+                                                    hash_workers=settings['hash_workers'], throttle=throttle,
+                                                    metrics=metrics, delta=settings.get('delta'))
+                        captured_path = backup_path
+                    if backup_path:
+                        created_backups.append(backup_type)
+    
+            # 如果有备份创建成功，执行清理
+            if created_backups:
+                cleanup_old_backups(config, target_dir, settings['retention'], metrics)
+                logging.info(f"成功创建备份类型: {', '.join(created_backups)}")
+        reaper.start()
+    throttled_seconds = throttle.throttled_seconds - throttled_before
+    if throttle.limited:
+        logging.info(f"本次运行因 I/O 限速等待 {throttled_seconds:.3f} 秒")
+    
+    report = metrics.report(throttled_seconds)
+    if profiler is not None:
+        try:
+            report['profile'] = profiler.finish()
+        except OSError as e:
+            logging.error(f"写入性能剖析结果失败: {str(e)}")
+    write_run_outputs(settings, report)
+    return created_backups
+
+def get_report_path(settings):
+    """返回运行报告的路径（默认为目标目录下的 .tier_backup/run_report.json）"""
+    metrics_config = settings.get('metrics') or load_metrics_config()
+    return (get_job_path(metrics_config['report_path'], settings.get('job_name'), DEFAULT_JOB_NAME)
+            or os.path.join(settings['target_dir'], STATE_DIR_NAME, RUN_REPORT_FILE_NAME))
+
+def write_run_outputs(settings, report):
+    """按 metrics 设置写入运行报告、Prometheus textfile 和守护进程的运行历史；写入失败只记录错误
+
+    多个备份任务共用同一个输出路径时，文件名加上任务名称。
+    """
+    metrics_config = settings.get('metrics') or load_metrics_config()
+    if not metrics_config['enabled']:
+        return
+    phases = ', '.join(f"{name} {seconds:.3f}s" for name, seconds in report['phases'].items() if seconds)
+    logging.info(f"运行耗时 {report['seconds']:.3f} 秒（{phases or '无'}）")
+    
+    job_name = settings.get('job_name')
+    outputs = [(write_run_report, get_report_path(settings))]
+    if metrics_config['prometheus_textfile']:
+        outputs.append((write_prometheus_textfile,
+                        get_job_path(metrics_config['prometheus_textfile'], job_name, DEFAULT_JOB_NAME)))
+    for write, path in outputs:
+        try:
+            write(report, path)
+        except OSError as e:
+            logging.error(f"写入运行报告失败: {path}, 错误: {str(e)}")
+    
+    history = settings.get('run_history')
+    if history is not None:
+        try:
+            history.append(report)
+        except OSError as e:
+            logging.error(f"写入运行历史失败: {history.path}, 错误: {str(e)}")
+
+def main(config_file='back_config.json', profile=False):
+    """主函数；profile 为 True 时（命令行 --profile）为全部任务启用性能剖析
+
+    返回退出码：全部任务和需要的备份都成功时为 0；有任务配置无效、运行失败或应创建的备份未创建时为 1。
+    """
     try:
-        logging.info("=== 备份脚本启动 ===")
         config = load_config(config_file)
-        
-        source_dir = config.get('source_directory', '')
-        target_dir = config.get('target_directory', '')
-        compress = config.get('compress_backup', False)
-        compression_level = config.get('compression_level', 6)
-        enable_symlink = config.get('enable_symlink', True)
-        
-        if not source_dir or not target_dir:
-            logging.error("源目录或目标目录未配置")
-            return
-        
-        logging.info(f"备份配置: 压缩={compress}, 压缩级别={compression_level}, 软链接={enable_symlink}")
+        configure_logging(config)
+        if profile:
+            enable_profiling(config)
+        logging.info("=== 备份脚本启动 ===")
+        jobs = prepare_jobs(config)
+        if not jobs:
+            return 1
+        # prepare_jobs 跳过了配置无效的任务
+        failed = len(jobs) < len(load_jobs(config))
         
         # 判断需要执行的备份类型
         backup_types = should_create_backup()
         logging.info(f"备份策略判断结果: {backup_types}")
         
-        # 执行相应的备份
-        created_backups = []
-        for backup_type, should_backup in backup_types.items():
-            if should_backup:
-                backup_path = create_backup(source_dir, target_dir, backup_type, compress, compression_level, enable_symlink)
-                if backup_path:
-                    created_backups.append(backup_type)
-        
-        # 如果有备份创建成功，执行清理
-        if created_backups:
-            cleanup_old_backups(config, target_dir)
-            logging.info(f"成功创建备份类型: {', '.join(created_backups)}")
-        else:
+        def run_job(job):
+            settings = job.settings
+            logging.info(f"备份任务 {job.name} 配置: 源目录={settings['source_dir']}, 目标目录={settings['target_dir']}, "
+                         f"压缩={settings['compress']}, 压缩级别={settings['compression_level']}, "
+                         f"软链接={settings['enable_symlink']}, 硬链接增量={settings['hardlink']}")
+            created = run_backups(job.config, settings, backup_types)
+            # 备份已全部完成，任务结束前等待后台回收；被中断时剩余部分下次运行继续
+            settings['reaper'].wait()
+            return created
+        
+        # 执行相应的备份：不同设备上的任务并行，共享设备的任务依次执行
+        results = run_jobs(jobs, run_job, config.get('max_jobs_per_device'), config.get('max_parallel_jobs'))
+        if not any(results.values()):
             logging.info("当前时间无需创建备份")
+        for name, created in results.items():
+            # run_job 抛出异常的任务结果为 None
+            missing = [backup_type for backup_type, due in backup_types.items()
+                       if due and backup_type not in (created or [])]
+            if created is None or missing:
+                logging.error(f"备份任务 {name} 失败" + (f": 未创建 {', '.join(missing)} 备份" if missing else ""))
+                failed = True
         
         logging.info("=== 备份脚本执行完成 ===")
+        return 1 if failed else 0
     except Exception as e:
         logging.critical(f"备份脚本运行失败: {str(e)}", exc_info=True)
+        return 1
 
 if __name__ == "__main__":
-    main()    
\ No newline at end of file
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试并行压缩功能
+用于验证并行写入的压缩包是标准 ZIP，成员顺序确定且内容正确
+"""
+
+import os
+import sys
+import zipfile
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core import archiver
+from core.codec import load_codec_policy
+from core.scanner import scan_directory
+
+
+def create_test_files(source_dir):
+    """创建小文件和一个按块并行压缩的大文件"""
+    os.makedirs(os.path.join(source_dir, "sub"), exist_ok=True)
+    for i in range(20):
+        with open(os.path.join(source_dir, "sub", f"file{i:02d}.txt"), 'w', encoding='utf-8') as f:
+            f.write(f"这是测试文件 {i} 的内容\n" * (i + 1))
+
+    with open(os.path.join(source_dir, "large.bin"), 'wb') as f:
+        for i in range(3000):
+            f.write(os.urandom(64) + b"compressible text block " * 40)
+
+
+def test_parallel_archive():
+    """测试并行压缩结果"""
+    print("=== 并行压缩测试 ===\n")
+
+    # 降低阈值，让测试文件走大文件分块路径
+    old_threshold, old_block = archiver.LARGE_FILE_THRESHOLD, archiver.BLOCK_SIZE
+    archiver.LARGE_FILE_THRESHOLD = 1024 * 1024
+    archiver.BLOCK_SIZE = 256 * 1024
+
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_dir = os.path.join(temp_dir, "source")
+            create_test_files(source_dir)
+            manifest = scan_directory(source_dir)
+
+            backup_path = os.path.join(temp_dir, "backup.zip")
+            with zipfile.ZipFile(backup_path, 'w') as zipf:
+                archiver.write_archive(zipf, source_dir, manifest, compression_level=6, workers=4)
+
+            with zipfile.ZipFile(backup_path, 'r') as zipf:
+                assert zipf.testzip() is None
+                names = [entry.path.replace(os.sep, '/') for entry in manifest]
+                assert zipf.namelist() == names + [archiver.MANIFEST_NAME]
+                for entry in manifest:
+                    with open(os.path.join(source_dir, entry.path), 'rb') as f:
+                        assert zipf.read(entry.path.replace(os.sep, '/')) == f.read()
+
+                large = zipf.getinfo("large.bin")
+                assert large.compress_type == zipfile.ZIP_DEFLATED
+                assert large.compress_size < large.file_size
+            print(f"✓ 压缩包包含 {len(manifest)} 个文件，CRC 校验通过")
+    finally:
+        archiver.LARGE_FILE_THRESHOLD, archiver.BLOCK_SIZE = old_threshold, old_block
+
+
+def test_reuse_previous_archive():
+    """测试复用上一个压缩包中未变化的成员"""
+    print("=== 复用已压缩成员测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        create_test_files(source_dir)
+
+        first = os.path.join(temp_dir, "first.zip")
+        with zipfile.ZipFile(first, 'w') as zipf:
+            archiver.write_archive(zipf, source_dir, scan_directory(source_dir), workers=2)
+
+        # 修改一个文件，其余文件保持不变
+        changed_file = os.path.join(source_dir, "sub", "file03.txt")
+        with open(changed_file, 'w', encoding='utf-8') as f:
+            f.write("修改后的内容\n")
+        os.utime(changed_file, ns=(0, 1700000000000000000))
+
+        second = os.path.join(temp_dir, "second.zip")
+        manifest = scan_directory(source_dir)
+        with zipfile.ZipFile(second, 'w') as zipf:
+            stats = archiver.write_archive(zipf, source_dir, manifest, workers=2, reuse_from=first)
+
+        assert stats['compressed'] == 1 and stats['reused'] == len(manifest) - 1
+
+        with zipfile.ZipFile(second, 'r') as zipf:
+            assert zipf.testzip() is None
+            assert zipf.read("sub/file03.txt").decode('utf-8') == "修改后的内容\n"
+            files = archiver.read_manifest_member(zipf)
+            assert files["sub/file03.txt"][1] == 1700000000000000000
+        print(f"✓ 复用 {stats['reused']} 个成员，重新压缩 {stats['compressed']} 个成员")
+
+
+def test_codec_policy():
+    """测试按文件类型选择压缩算法"""
+    print("=== 压缩算法选择测试 ===\n")
+
+    # 降低阈值，让随机数据的大文件也经过算法选择
+    old_threshold, old_block = archiver.LARGE_FILE_THRESHOLD, archiver.BLOCK_SIZE
+    archiver.LARGE_FILE_THRESHOLD = 1024 * 1024
+    archiver.BLOCK_SIZE = 256 * 1024
+
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_dir = os.path.join(temp_dir, "source")
+            create_test_files(source_dir)
+            with open(os.path.join(source_dir, "photo.jpg"), 'wb') as f:
+                f.write(b"fake jpeg " * 1000)
+            with open(os.path.join(source_dir, "random.dat"), 'wb') as f:
+                f.write(os.urandom(2 * 1024 * 1024))
+            with open(os.path.join(source_dir, "notes.log"), 'w', encoding='utf-8') as f:
+                f.write("日志内容\n" * 1000)
+
+            policy = load_codec_policy({'lzma_extensions': ['.log']})
+            backup_path = os.path.join(temp_dir, "backup.zip")
+            with zipfile.ZipFile(backup_path, 'w') as zipf:
+                stats = archiver.write_archive(zipf, source_dir, scan_directory(source_dir), workers=2,
+                                               policy=policy)
+
+            with zipfile.ZipFile(backup_path, 'r') as zipf:
+                assert zipf.testzip() is None
+                assert zipf.getinfo("photo.jpg").compress_type == zipfile.ZIP_STORED
+                assert zipf.getinfo("random.dat").compress_type == zipfile.ZIP_STORED
+                assert zipf.getinfo("notes.log").compress_type == zipfile.ZIP_LZMA
+                assert zipf.getinfo("large.bin").compress_type == zipfile.ZIP_DEFLATED
+                assert zipf.getinfo("sub/file19.txt").compress_type == zipfile.ZIP_DEFLATED
+
+            codecs = stats['codecs']
+            assert codecs['stored']['files'] >= 2
+            assert codecs['lzma']['files'] == 1
+            assert codecs['deflated']['bytes_saved'] > 0
+            print(f"✓ 各算法统计: {codecs}")
+    finally:
+        archiver.LARGE_FILE_THRESHOLD, archiver.BLOCK_SIZE = old_threshold, old_block
+
+
+if __name__ == "__main__":
+    test_parallel_archive()
+    test_reuse_previous_archive()
+    test_codec_policy()
+
+    print("=== 测试完成 ===")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试性能基准工具
+用于验证合成源目录可复现、各种目录布局和大小分布，基准结果的格式以及与基线的比较
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'benchmarks'))
+
+from core.scanner import scan_directory
+from synthetic import TreeSpec, generate_tree, iter_tree_files, get_spec_name, SIZE_DISTRIBUTIONS
+from run_benchmarks import run_suite, compare_results, BENCHMARKS
+
+
+def read_tree(root):
+    """读取目录中全部文件的 (路径, 修改时间, 内容)"""
+    files = {}
+    for entry in scan_directory(root):
+        with open(os.path.join(root, entry.path), 'rb') as f:
+            files[entry.path] = (entry.mtime_ns, f.read())
+    return files
+
+
+def test_generated_tree_is_reproducible():
+    """测试同样的参数生成完全相同的目录，已生成的目录直接复用"""
+    print("=== 合成源目录测试 ===\n")
+
+    spec = TreeSpec(120, 'deep', 'small', 'mixed', seed=7)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        first = os.path.join(temp_dir, "a")
+        second = os.path.join(temp_dir, "b")
+        stats = generate_tree(first, spec)
+        generate_tree(second, spec)
+        assert stats['files'] == 120 and not stats['reused']
+        assert read_tree(first) == read_tree(second)
+        assert generate_tree(first, spec)['reused']
+        print("✓ 同样的参数生成相同的文件，参数文件不计入备份")
+
+        other = generate_tree(first, spec._replace(seed=8))
+        assert not other['reused'] and read_tree(first) != read_tree(second)
+
+
+def test_layouts_and_sizes():
+    """测试目录布局的深度和大小分布的范围"""
+    deep = [path for path, _, _ in iter_tree_files(TreeSpec(256, 'deep', 'tiny', 'random'))]
+    wide = [path for path, _, _ in iter_tree_files(TreeSpec(2000, 'wide', 'tiny', 'random'))]
+    assert max(path.count(os.sep) for path in deep) == 32
+    assert max(path.count(os.sep) for path in wide) == 1
+    assert len({os.path.dirname(path) for path in wide}) == 2
+
+    largest = SIZE_DISTRIBUTIONS['small'][-1][2]
+    sizes = [size for _, size, _ in iter_tree_files(TreeSpec(500, 'balanced', 'small', 'compressible'))]
+    assert 0 <= min(sizes) and max(sizes) <= largest
+    assert get_spec_name(TreeSpec(500)) == 'balanced-500-small-mixed'
+
+    try:
+        list(iter_tree_files(TreeSpec(10, 'spiral')))
+        assert False, "未知的目录布局应抛出异常"
+    except ValueError:
+        pass
+
+
+def test_run_suite_and_compare():
+    """测试基准结果的格式和与基线的比较"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        report = run_suite([TreeSpec(50, 'balanced', 'small', 'compressible')], 20, temp_dir, repeat=1)
+    assert {result['benchmark'] for result in report['results']} == set(BENCHMARKS)
+    archive = next(result for result in report['results'] if result['benchmark'] == 'archive')
+    assert archive['files'] == 50 and 0 < archive['compression_ratio'] < 1
+    assert archive['seconds']['median'] > 0 and len(archive['seconds']['runs']) == 1
+    assert report['trees']['balanced-50-small-compressible']['files'] == 50
+
+    baseline = {'results': [dict(result, seconds={'median': result['seconds']['median'] * 2})
+                            for result in report['results'][:-1]]}
+    slower = {'results': [dict(result, seconds={'median': result['seconds']['median'] * 3})
+                          for result in report['results']]}
+    statuses = {item['name']: item['status'] for item in compare_results(slower, baseline, 0.2)}
+    assert statuses[report['results'][-1]['name']] == 'new'
+    assert set(statuses.values()) == {'regression', 'new'}
+    assert {item['status'] for item in compare_results(report, baseline)} <= {'improvement', 'new'}
+
+
+if __name__ == "__main__":
+    test_generated_tree_is_reproducible()
+    test_layouts_and_sizes()
+    test_run_suite_and_compare()
+
+    print("=== 测试完成 ===")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试快照目录功能
+用于验证快照目录的登记、移除和重建是否正常工作
+"""
+
+import os
+import sys
+import json
+import zipfile
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.catalog import record_snapshot, remove_snapshot, list_snapshots, rebuild_catalog
+
+
+def create_test_snapshots(target_dir):
+    """在目标目录下创建一个目录快照和一个压缩快照"""
+    dir_snapshot = os.path.join(target_dir, 'hourly', '2025-01-15_1000')
+    os.makedirs(dir_snapshot, exist_ok=True)
+    with open(os.path.join(dir_snapshot, 'file1.txt'), 'w', encoding='utf-8') as f:
+        f.write("测试内容\n")
+    with open(os.path.join(dir_snapshot, 'backup_info.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'timestamp': '2025-01-15_1000',
+            'created_at': '2025-01-15T10:00:00',
+            'type': 'hourly',
+            'directory_hash': 'abc',
+            'file_count': 1
+        }, f)
+
+    zip_snapshot = os.path.join(target_dir, 'daily', '2025-01-15.zip')
+    os.makedirs(os.path.dirname(zip_snapshot), exist_ok=True)
+    with zipfile.ZipFile(zip_snapshot, 'w') as zipf:
+        zipf.writestr('file1.txt', "测试内容\n")
+        zipf.writestr('backup_info.json', json.dumps({
+            'timestamp': '2025-01-15',
+            'created_at': '2025-01-15T23:59:00',
+            'type': 'daily',
+            'directory_hash': 'def',
+            'file_count': 1
+        }))
+
+    return dir_snapshot, zip_snapshot
+
+
+def test_rebuild_catalog():
+    """测试从磁盘重建快照目录"""
+    print("=== 快照目录重建测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as target_dir:
+        dir_snapshot, zip_snapshot = create_test_snapshots(target_dir)
+
+        # 软链接快照
+        link_snapshot = os.path.join(target_dir, 'hourly', '2025-01-15_1100')
+        os.symlink(dir_snapshot, link_snapshot)
+
+        assert rebuild_catalog(target_dir) == 3
+
+        hourly = list_snapshots(target_dir, 'hourly')
+        assert [b['timestamp'] for b in hourly] == ['2025-01-15_1000', '2025-01-15_1100']
+        assert hourly[0]['hash'] == 'abc'
+        assert hourly[1]['is_symlink'] and hourly[1]['symlink_target'] == dir_snapshot
+
+        daily = list_snapshots(target_dir, 'daily')
+        assert len(daily) == 1 and daily[0]['compressed']
+        assert daily[0]['size'] == os.path.getsize(zip_snapshot)
+        print("✓ 快照目录重建成功")
+
+
+def test_record_and_remove():
+    """测试登记和移除快照"""
+    print("=== 快照登记与移除测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as target_dir:
+        dir_snapshot, _ = create_test_snapshots(target_dir)
+        rebuild_catalog(target_dir)
+
+        new_snapshot = os.path.join(target_dir, 'weekly', '2025-01-19')
+        os.makedirs(new_snapshot)
+        record_snapshot(target_dir, {
+            'path': new_snapshot,
+            'timestamp': '2025-01-19',
+            'created_at': '2025-01-19T23:55:00',
+            'hash': 'ghi',
+            'size': 0,
+            'file_count': 0
+        })
+        assert [b['path'] for b in list_snapshots(target_dir, 'weekly')] == [new_snapshot]
+
+        remove_snapshot(target_dir, new_snapshot)
+        assert list_snapshots(target_dir, 'weekly') == []
+
+        # 被外部删除的快照应自动从目录中移除
+        os.remove(os.path.join(dir_snapshot, 'file1.txt'))
+        os.remove(os.path.join(dir_snapshot, 'backup_info.json'))
+        os.rmdir(dir_snapshot)
+        assert list_snapshots(target_dir, 'hourly') == []
+        print("✓ 快照登记与移除成功")
+
+
+if __name__ == "__main__":
+    test_rebuild_catalog()
+    test_record_and_remove()
+
+    print("=== 测试完成 ===")
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试目录复制功能
+用于验证进程内复制的结果正确，以及硬链接增量快照只复制变化的文件
+"""
+
+import os
+import sys
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.scanner import scan_directory, FileEntry
+from core import copier
+from core.copier import create_directory_snapshot
+
+
+def write_file(path, content):
+    """写入测试文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def test_hardlink_snapshot():
+    """测试硬链接增量快照"""
+    print("=== 硬链接增量快照测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        write_file(os.path.join(source_dir, "file1.txt"), "不变的文件\n")
+        write_file(os.path.join(source_dir, "sub", "file2.txt"), "会被修改的文件\n")
+
+        # 第一个快照：没有参照快照，全部复制
+        snapshot1 = os.path.join(temp_dir, "hourly", "2025-01-15_1000")
+        report1 = create_directory_snapshot(source_dir, snapshot1, scan_directory(source_dir))
+        assert report1['copied'] == 2 and report1['linked'] == 0
+
+        src_stat = os.stat(os.path.join(source_dir, "file1.txt"))
+        dst_stat = os.stat(os.path.join(snapshot1, "file1.txt"))
+        assert dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+
+        # 修改一个文件后创建第二个快照
+        time.sleep(0.01)
+        write_file(os.path.join(source_dir, "sub", "file2.txt"), "修改后的内容\n")
+        write_file(os.path.join(source_dir, "file3.txt"), "新文件\n")
+
+        snapshot2 = os.path.join(temp_dir, "hourly", "2025-01-15_1100")
+        report2 = create_directory_snapshot(source_dir, snapshot2, scan_directory(source_dir), snapshot1)
+        assert report2['linked'] == 1 and report2['copied'] == 2 and not report2['errors']
+
+        assert os.path.samefile(os.path.join(snapshot1, "file1.txt"), os.path.join(snapshot2, "file1.txt"))
+        assert not os.path.samefile(os.path.join(snapshot1, "sub", "file2.txt"),
+                                    os.path.join(snapshot2, "sub", "file2.txt"))
+        with open(os.path.join(snapshot1, "sub", "file2.txt"), encoding='utf-8') as f:
+            assert f.read() == "会被修改的文件\n"
+        print("✓ 未变化的文件已硬链接，变化的文件已复制")
+
+
+def test_directory_copy():
+    """测试小文件并行复制、大文件分块复制和错误报告"""
+    print("=== 进程内复制测试 ===\n")
+
+    # 降低阈值，让测试文件走大文件分块路径
+    old_threshold, old_chunk = copier.LARGE_FILE_THRESHOLD, copier.COPY_CHUNK_SIZE
+    copier.LARGE_FILE_THRESHOLD = 1024 * 1024
+    copier.COPY_CHUNK_SIZE = 256 * 1024
+
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_dir = os.path.join(temp_dir, "source")
+            for i in range(50):
+                write_file(os.path.join(source_dir, f"dir{i % 5}", f"file{i}.txt"), f"文件 {i}\n" * i)
+            large_data = os.urandom(3 * 1024 * 1024 + 123)
+            with open(os.path.join(source_dir, "large.bin"), 'wb') as f:
+                f.write(large_data)
+            manifest = scan_directory(source_dir)
+
+            # 扫描后删除一个文件，模拟复制过程中消失的文件
+            os.remove(os.path.join(source_dir, "dir0", "file0.txt"))
+
+            snapshot = os.path.join(temp_dir, "hourly", "2025-01-15_1000")
+            report = create_directory_snapshot(source_dir, snapshot, manifest, workers=4)
+
+            assert report['copied'] == len(manifest) - 1
+            assert len(report['errors']) == 1
+            error = report['errors'][0]
+            assert error['path'] == os.path.join("dir0", "file0.txt") and error['errno'] is not None
+
+            with open(os.path.join(snapshot, "large.bin"), 'rb') as f:
+                assert f.read() == large_data
+            for entry in manifest:
+                if entry.path == error['path']:
+                    continue
+                st = os.stat(os.path.join(snapshot, entry.path))
+                assert st.st_size == entry.size and st.st_mtime_ns == entry.mtime_ns
+            print(f"✓ 复制 {report['copied']} 个文件（克隆 {report['cloned']} 个），错误: {report['errors']}")
+    finally:
+        copier.LARGE_FILE_THRESHOLD, copier.COPY_CHUNK_SIZE = old_threshold, old_chunk
+
+
+
+def test_large_file_shrinks_during_copy():
+    """测试大文件在扫描之后变小时，快照中的文件截断到实际复制的长度，没有全零的尾部"""
+    data = os.urandom(700 * 1024)
+    with tempfile.TemporaryDirectory() as temp_dir, ThreadPoolExecutor(max_workers=4) as pool:
+        source_dir = os.path.join(temp_dir, "source")
+        write_file(os.path.join(source_dir, "placeholder"), "")
+        with open(os.path.join(source_dir, "large.bin"), 'wb') as f:
+            f.write(data)
+        # 清单中记录的是变小之前的大小
+        entry = FileEntry("large.bin", 2 * 1024 * 1024, 1700000000 * 10 ** 9, 0o100644, 1)
+
+        for method in ('copy_file_range', 'pread'):
+            methods = dict(copier.detect_copy_methods(), reflink=False)
+            if method == 'pread':
+                methods['copy_file_range'] = False
+            elif not methods['copy_file_range']:
+                continue
+            dest_dir = os.path.join(temp_dir, method)
+            os.makedirs(dest_dir)
+            old_chunk = copier.COPY_CHUNK_SIZE
+            copier.COPY_CHUNK_SIZE = 256 * 1024
+            try:
+                copier.copy_large_entry(pool, source_dir, dest_dir, entry, methods)
+            finally:
+                copier.COPY_CHUNK_SIZE = old_chunk
+            with open(os.path.join(dest_dir, "large.bin"), 'rb') as f:
+                assert f.read() == data
+
+
+if __name__ == "__main__":
+    test_hardlink_snapshot()
+    test_directory_copy()
+    test_large_file_shrinks_during_copy()
+
+    print("=== 测试完成 ===")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试守护进程模式
+用于验证各层级的计划时间、错过备份后的补做判断，以及守护进程的运行和退出
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.catalog import list_snapshots
+from core.daemon import get_last_scheduled, get_due_tiers, seconds_until_next, run_daemon
+
+
+def test_schedule():
+    """测试计划时间和补做判断"""
+    print("=== 计划时间测试 ===\n")
+
+    # 2025-01-15 是周三
+    now = datetime(2025, 1, 15, 10, 30)
+    assert get_last_scheduled('hourly', now) == datetime(2025, 1, 15, 10, 0)
+    assert get_last_scheduled('daily', now) == datetime(2025, 1, 14, 23, 59)
+    assert get_last_scheduled('weekly', now) == datetime(2025, 1, 12, 23, 55)
+    assert get_last_scheduled('weekly', datetime(2025, 1, 19, 23, 56)) == datetime(2025, 1, 19, 23, 55)
+    assert seconds_until_next(now) == 30 * 60
+
+    # 本小时已备份，每日备份在前一天 23:59 之前：停机错过了每日备份，需要补做
+    last_created = {
+        'hourly': datetime(2025, 1, 15, 10, 5),
+        'daily': datetime(2025, 1, 13, 23, 59),
+        'weekly': datetime(2025, 1, 12, 23, 55)
+    }
+    assert get_due_tiers(last_created, now) == {'hourly': False, 'daily': True, 'weekly': False}
+    assert get_due_tiers({}, now) == {'hourly': True, 'daily': True, 'weekly': True}
+    print("✓ 计划时间和补做判断正确")
+
+
+def test_run_daemon():
+    """测试守护进程补做缺失的层级后按停止信号退出"""
+    print("=== 守护进程运行测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        os.makedirs(source_dir)
+        with open(os.path.join(source_dir, "file.txt"), 'w', encoding='utf-8') as f:
+            f.write("测试内容\n")
+
+        config_file = os.path.join(temp_dir, "config.json")
+        with open(config_file, 'w', encoding='utf-8') as f:
+            json.dump({'source_directory': source_dir, 'target_directory': target_dir,
+                       'compress_backup': True, 'tier_promotion': 'hardlink',
+                       'log_file': os.path.join(temp_dir, "backup.log")}, f)
+
+        stop_event = threading.Event()
+        result = {}
+        thread = threading.Thread(target=lambda: result.setdefault('code', run_daemon(config_file, stop_event)))
+        thread.start()
+
+        # 等待首轮补做完成：三个层级都没有备份
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if os.path.isdir(target_dir) and len(list_snapshots(target_dir)) == 3:
+                break
+            time.sleep(0.1)
+
+        stop_event.set()
+        thread.join(timeout=30)
+        assert not thread.is_alive() and result['code'] == 0
+        assert sorted(b['type'] for b in list_snapshots(target_dir)) == ['daily', 'hourly', 'weekly']
+        print("✓ 守护进程补做了全部层级并正常退出")
+
+        with open(os.path.join(target_dir, ".tier_backup", "run_history.json"), encoding='utf-8') as f:
+            history = json.load(f)
+        assert len(history) == 1 and history[0]['status'] == 'success'
+        assert [b['result'] for b in history[0]['backups']] == ['created', 'promoted', 'promoted']
+        print("✓ 守护进程记录了运行历史")
+
+
+if __name__ == "__main__":
+    test_schedule()
+    test_run_daemon()
+
+    print("=== 测试完成 ===")
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试差异存储
+用于验证大文件只保存变化的块、未变化时链接差异链、链长度上限、删除旧快照后仍能恢复，
+以及恢复、完整性校验和历史索引对差异存储文件的处理
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.scanner import scan_directory
+from core.copier import create_directory_snapshot
+from core.delta import load_delta_config, list_delta_files, get_chain_dir
+from core.restore import restore_directory
+from core.scrub import verify_directory
+from core.throttle import RateLimiter
+from core.history import read_snapshot_files
+from core.tier_backup import get_run_settings
+
+BLOCK_SIZE = 4096
+BIG_FILE = os.path.join("data", "disk.img")
+
+
+def write_big_file(source_dir, content, mtime):
+    """写入大文件并设置修改时间（秒）"""
+    path = os.path.join(source_dir, BIG_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    os.utime(path, (mtime, mtime))
+
+
+def snapshot(source_dir, backup_path, config, base=None, hardlink=False):
+    """创建一个目录快照并写入 backup_info.json（供校验使用）"""
+    manifest = scan_directory(source_dir)
+    report = create_directory_snapshot(source_dir, backup_path, manifest, link_dest=base if hardlink else None,
+                                       delta=config, delta_base=base)
+    assert not report['errors']
+    with open(os.path.join(backup_path, 'backup_info.json'), 'w', encoding='utf-8') as f:
+        json.dump({'file_count': len(manifest), 'total_size': sum(entry.size for entry in manifest)}, f)
+    return report
+
+
+def read_restored(dest_dir):
+    with open(os.path.join(dest_dir, BIG_FILE), 'rb') as f:
+        return f.read()
+
+
+def test_load_delta_config():
+    """测试 delta_storage 配置的默认值和校验"""
+    assert load_delta_config(None) is None
+    assert load_delta_config({'enabled': False}) is None
+    config = load_delta_config({'min_size': 1024})
+    assert config['min_size'] == 1024 and config['block_size'] == 256 * 1024 and config['max_chain_length'] == 8
+    for bad in ({'block_size': 0}, {'max_chain_length': 'many'}, {'max_delta_ratio': 1.5}, {'min_size': True},
+                {'chain': 3}):
+        try:
+            load_delta_config(bad)
+            assert False, f"无效配置应抛出异常: {bad}"
+        except ValueError:
+            pass
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config = {'source_directory': temp_dir, 'target_directory': temp_dir}
+        assert get_run_settings(dict(config, delta_storage={'block_size': -1})) is None
+        assert get_run_settings(dict(config, delta_storage={'min_size': 1024}))['delta']['min_size'] == 1024
+
+
+def test_delta_chain():
+    """测试大文件按块保存差异、未变化时链接差异链，以及链长度上限"""
+    print("=== 差异存储测试 ===\n")
+
+    rng = random.Random(25)
+    config = load_delta_config({'min_size': 32 * 1024, 'block_size': BLOCK_SIZE, 'max_chain_length': 2})
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        snapshots = [os.path.join(temp_dir, "backup", f"s{index}") for index in range(6)]
+        versions = [bytearray(rng.getrandbits(8) for _ in range(16 * BLOCK_SIZE + 100))]
+        write_big_file(source_dir, versions[0], 1700000000)
+        with open(os.path.join(source_dir, "notes.txt"), 'w', encoding='utf-8') as f:
+            f.write("说明\n")
+
+        # 第一个快照没有上一个版本：完整保存，并记录块摘要
+        report = snapshot(source_dir, snapshots[0], config)
+        assert report['deltas'] == 0
+        assert os.path.isfile(os.path.join(snapshots[0], BIG_FILE))
+        assert sorted(os.listdir(get_chain_dir(snapshots[0], BIG_FILE))) == ['0.json', '0.sig']
+        assert list_delta_files(snapshots[0]) == {}
+
+        # 修改一个块：只保存该块
+        version = bytearray(versions[-1])
+        version[5 * BLOCK_SIZE + 10] ^= 0xFF
+        versions.append(version)
+        write_big_file(source_dir, version, 1700000100)
+        report = snapshot(source_dir, snapshots[1], config, snapshots[0])
+        assert report['deltas'] == 1
+        assert report['copied_bytes'] == BLOCK_SIZE + len("说明\n".encode('utf-8'))
+        assert not os.path.exists(os.path.join(snapshots[1], BIG_FILE))
+        assert list_delta_files(snapshots[1])['data/disk.img']['size'] == len(version)
+        print("✓ 只保存变化的块")
+
+        # 未变化：链接上一个快照的差异链，不写入数据
+        report = snapshot(source_dir, snapshots[2], config, snapshots[1], hardlink=True)
+        assert report['linked'] == 2 and report['copied'] == 0
+        assert list_delta_files(snapshots[2])['data/disk.img']['index'] == 1
+
+        # 在开头插入一个块：其余块按摘要匹配，只保存插入的块
+        version = bytearray(rng.getrandbits(8) for _ in range(BLOCK_SIZE)) + versions[-1]
+        versions.append(version)
+        write_big_file(source_dir, version, 1700000200)
+        report = snapshot(source_dir, snapshots[3], config, snapshots[2], hardlink=True)
+        assert report['deltas'] == 1 and report['copied_bytes'] == BLOCK_SIZE
+        assert list_delta_files(snapshots[3])['data/disk.img']['index'] == 2
+        print("✓ 按摘要匹配移动的块")
+
+        # 差异链达到上限：重新保存完整副本
+        version = bytearray(versions[-1])
+        version[0] ^= 0xFF
+        versions.append(version)
+        write_big_file(source_dir, version, 1700000300)
+        report = snapshot(source_dir, snapshots[4], config, snapshots[3], hardlink=True)
+        assert report['deltas'] == 0 and report['copied_bytes'] == len(version)
+        assert os.path.isfile(os.path.join(snapshots[4], BIG_FILE))
+        print("✓ 差异链达到上限时保存完整副本")
+
+        # 变化过多：保存完整副本
+        version = bytearray(rng.getrandbits(8) for _ in range(len(versions[-1])))
+        write_big_file(source_dir, version, 1700000400)
+        report = snapshot(source_dir, snapshots[5], config, snapshots[4], hardlink=True)
+        assert report['deltas'] == 0 and os.path.isfile(os.path.join(snapshots[5], BIG_FILE))
+
+        # 删除较早的快照后，较新的快照仍然可以恢复（差异链的文件都硬链接在快照中）
+        for path in snapshots[:2]:
+            shutil.rmtree(path)
+        for index, expected, mtime in ((2, versions[1], 1700000100), (3, versions[2], 1700000200)):
+            dest_dir = os.path.join(temp_dir, f"restore{index}")
+            stats = restore_directory(snapshots[index], dest_dir)
+            assert stats['files'] == 2 and stats['rebuilt'] == 1
+            assert read_restored(dest_dir) == expected
+            assert os.stat(os.path.join(dest_dir, BIG_FILE)).st_mtime_ns == mtime * 10 ** 9
+            assert not os.path.exists(os.path.join(dest_dir, ".tier_delta"))
+        print("✓ 删除旧快照后仍可恢复")
+
+        # 历史索引按最新版本记录以差异存储的文件
+        files = read_snapshot_files(snapshots[3])
+        assert files['data/disk.img'][:2] == (len(versions[2]), 1700000200 * 10 ** 9)
+        assert set(files) == {'data/disk.img', 'notes.txt'}
+
+
+def test_verify_delta_file():
+    """测试完整性校验按差异链重建文件并检测损坏的块"""
+    rng = random.Random(7)
+    config = load_delta_config({'min_size': 32 * 1024, 'block_size': BLOCK_SIZE})
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        first, second = os.path.join(temp_dir, "s0"), os.path.join(temp_dir, "s1")
+        content = bytearray(rng.getrandbits(8) for _ in range(10 * BLOCK_SIZE))
+        write_big_file(source_dir, content, 1700000000)
+        snapshot(source_dir, first, config)
+        content[-1] ^= 0xFF
+        write_big_file(source_dir, content, 1700000100)
+        snapshot(source_dir, second, config, first)
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            files, size, errors = verify_directory(second, pool, RateLimiter())
+            assert (files, size, errors) == (1, len(content), [])
+
+            # 损坏基础版本中的一个块
+            chain_dir = list_delta_files(second)['data/disk.img']['chain_dir']
+            with open(os.path.join(chain_dir, '0.data'), 'r+b') as f:
+                f.seek(3 * BLOCK_SIZE)
+                f.write(b'\0' * 16)
+            files, size, errors = verify_directory(second, pool, RateLimiter())
+            assert len(errors) == 1 and 'data/disk.img' in errors[0] and '第 3 块' in errors[0]
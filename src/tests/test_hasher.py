@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试按内容检测变化
+用于验证 BLAKE2b 摘要、按 (inode, 大小, 修改时间) 缓存摘要、保留修改时间的文件替换能被发现、
+按内容摘要硬链接移动过的文件，以及摘要写入快照元数据后被完整性校验使用
+"""
+
+import os
+import sys
+import json
+import hashlib
+import zipfile
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.scanner import scan_directory
+from core.hasher import hash_file, hash_manifest, content_root_hash, plan_content_links
+from core.copier import create_directory_snapshot
+from core.tier_backup import create_backup, calculate_directory_hash
+from core.archiver import read_manifest_member
+from core.scrub import scrub_target
+
+MTIME_NS = 1700000000000000000
+
+
+def write(path, content):
+    """写入文件并设置固定的修改时间"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.utime(path, ns=(MTIME_NS, MTIME_NS))
+
+
+def replace_preserving_mtime(path, content):
+    """像保留修改时间的同步工具一样替换文件：写入临时文件后重命名，大小和修改时间不变"""
+    tmp_path = path + '.tmp'
+    write(tmp_path, content)
+    os.replace(tmp_path, path)
+
+
+def test_hash_file():
+    """测试文件摘要与 hashlib 的结果一致，空文件也能计算"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "data.bin")
+        data = os.urandom(300000)
+        with open(path, 'wb') as f:
+            f.write(data)
+        assert hash_file(path) == 'blake2b:' + hashlib.blake2b(data, digest_size=32).hexdigest()
+
+        empty = os.path.join(temp_dir, "empty")
+        open(empty, 'wb').close()
+        assert hash_file(empty) == 'blake2b:' + hashlib.blake2b(b'', digest_size=32).hexdigest()
+
+
+def test_hash_cache_and_preserved_mtime():
+    """测试摘要缓存只重新读取元数据变化的文件，保留修改时间的替换也会被发现"""
+    print("=== 内容摘要缓存测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        for index in range(5):
+            write(os.path.join(source_dir, "docs", f"file{index}.txt"), f"内容 {index}\n" * 100)
+
+        manifest = scan_directory(source_dir)
+        digests, stats = hash_manifest(source_dir, manifest, target_dir, workers=4)
+        assert stats['hashed'] == 5 and stats['cached'] == 0
+        assert set(digests) == {f"docs/file{index}.txt" for index in range(5)}
+
+        digests2, stats = hash_manifest(source_dir, scan_directory(source_dir), target_dir)
+        assert stats['hashed'] == 0 and stats['cached'] == 5
+        assert digests2 == digests
+        print("✓ 未变化的文件使用缓存的摘要")
+
+        old_metadata_hash = calculate_directory_hash(source_dir)[0]
+        replace_preserving_mtime(os.path.join(source_dir, "docs", "file2.txt"), "内容 X\n" * 100)
+        manifest = scan_directory(source_dir)
+        assert calculate_directory_hash(source_dir, manifest=manifest)[0] == old_metadata_hash
+
+        digests3, stats = hash_manifest(source_dir, manifest, target_dir)
+        assert stats['hashed'] == 1 and stats['cached'] == 4
+        assert digests3["docs/file2.txt"] != digests["docs/file2.txt"]
+        assert content_root_hash(digests3) != content_root_hash(digests)
+        print("✓ 保留修改时间的替换被发现，只重新读取了一个文件")
+
+
+def test_content_links_follow_moved_files():
+    """测试按内容摘要把移动过的文件硬链接到上一个快照，内容变化的文件重新复制"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        write(os.path.join(source_dir, "a.txt"), "甲\n" * 100)
+        write(os.path.join(source_dir, "old", "b.txt"), "乙\n" * 100)
+        write(os.path.join(source_dir, "c.txt"), "丙\n" * 100)
+
+        manifest = scan_directory(source_dir)
+        digests, _ = hash_manifest(source_dir, manifest, target_dir)
+        snapshot1 = os.path.join(temp_dir, "snapshot1")
+        create_directory_snapshot(source_dir, snapshot1, manifest)
+        previous = {
+            entry.path.replace(os.sep, '/'): (entry.size, entry.mtime_ns, digests[entry.path.replace(os.sep, '/')])
+            for entry in manifest
+        }
+
+        os.makedirs(os.path.join(source_dir, "new"))
+        os.rename(os.path.join(source_dir, "old", "b.txt"), os.path.join(source_dir, "new", "b.txt"))
+        replace_preserving_mtime(os.path.join(source_dir, "c.txt"), "丁\n" * 100)
+
+        manifest = scan_directory(source_dir)
+        digests, _ = hash_manifest(source_dir, manifest, target_dir)
+        link_map = plan_content_links(manifest, digests, previous)
+        assert link_map == {"a.txt": "a.txt", os.path.join("new", "b.txt"): os.path.join("old", "b.txt")}
+
+        snapshot2 = os.path.join(temp_dir, "snapshot2")
+        report = create_directory_snapshot(source_dir, snapshot2, manifest, snapshot1, link_map=link_map)
+        assert report['linked'] == 2 and report['copied'] == 1
+        assert os.path.samefile(os.path.join(snapshot2, "new", "b.txt"), os.path.join(snapshot1, "old", "b.txt"))
+        with open(os.path.join(snapshot2, "c.txt"), encoding='utf-8') as f:
+            assert f.read() == "丁\n" * 100
+
+
+def test_content_mode_backup_metadata():
+    """测试按内容检测变化的备份把摘要写入快照元数据，完整性校验据此发现内容被篡改的文件"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        write(os.path.join(source_dir, "a.txt"), "甲\n" * 100)
+        write(os.path.join(source_dir, "sub", "b.txt"), "乙\n" * 100)
+
+        archive = create_backup(source_dir, target_dir, 'hourly', compress=True, change_detection='content')
+        with zipfile.ZipFile(archive) as zipf:
+            entry = read_manifest_member(zipf)["sub/b.txt"]
+        assert entry[3] == hash_file(os.path.join(source_dir, "sub", "b.txt"))
+
+        directory = create_backup(source_dir, target_dir, 'daily', change_detection='content')
+        with open(os.path.join(directory, "backup_info.json"), encoding='utf-8') as f:
+            info = json.load(f)
+        assert info['change_detection'] == 'content'
+        assert info['file_digests']["a.txt"] == hash_file(os.path.join(source_dir, "a.txt"))
+        assert scrub_target(target_dir)['summary']['ok'] == 2
+
+        # 大小和修改时间不变，只改动内容
+        path = os.path.join(directory, "a.txt")
+        with open(path, 'r+b') as f:
+            f.write(b'X')
+        os.utime(path, ns=(MTIME_NS, MTIME_NS))
+        report = scrub_target(target_dir, restart=True)
+        assert report['summary']['corrupt'] == 1
+        errors = [e for r in report['snapshots'] for e in r['errors']]
+        assert any(e.startswith("a.txt") and '摘要' in e for e in errors)
+
+
+if __name__ == "__main__":
+    test_hash_file()
+    test_hash_cache_and_preserved_mtime()
+    test_content_links_follow_moved_files()
+    test_content_mode_backup_metadata()
+
+    print("=== 测试完成 ===")
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试文件历史索引功能
+用于验证按层级记录变化、查询文件的各个版本、删除快照时的记录移交，以及 history 和 restore --version 命令
+"""
+
+import os
+import sys
+import json
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.catalog import record_snapshot
+from core.history import record_snapshot_files, remove_snapshot_files, get_file_history, rebuild_history
+from core.tier_backup import create_backup
+from core.cli import main as cli_main
+
+
+def add_snapshot(target_dir, backup_type, timestamp, files):
+    """创建空的快照目录，登记到快照目录和历史索引中"""
+    path = os.path.join(target_dir, backup_type, timestamp)
+    os.makedirs(path)
+    record_snapshot(target_dir, {'path': path, 'timestamp': timestamp, 'created_at': timestamp})
+    record_snapshot_files(target_dir, path, timestamp, files)
+    return path
+
+
+def test_file_history():
+    """测试查询文件的各个版本，以及删除快照后历史仍然正确"""
+    print("=== 文件历史索引测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        v1 = (100, 1000, 'crc32:00000001')
+        v2 = (120, 2000, 'crc32:00000002')
+        other = (5, 1000, None)
+        first = add_snapshot(temp_dir, 'hourly', '2025-01-01_0100', {'reports/q3.xlsx': v1, 'a.txt': other})
+        second = add_snapshot(temp_dir, 'hourly', '2025-01-01_0200', {'reports/q3.xlsx': v1, 'a.txt': other})
+        third = add_snapshot(temp_dir, 'hourly', '2025-01-01_0300', {'reports/q3.xlsx': v2})
+        daily = add_snapshot(temp_dir, 'daily', '2025-01-01', {'reports/q3.xlsx': v1})
+
+        versions = get_file_history(temp_dir, 'reports/q3.xlsx')
+        assert [(v['size'], v['mtime_ns']) for v in versions] == [v2[:2], v1[:2]]
+        assert versions[0]['snapshots'] == [third]
+        assert set(versions[1]['snapshots']) == {first, second, daily}
+        # a.txt 在第三个快照中被删除
+        assert set(get_file_history(temp_dir, 'a.txt')[0]['snapshots']) == {first, second}
+        print("✓ 各版本及其所在快照正确")
+
+        # 删除第一个快照：其记录移交给第二个快照
+        os.rmdir(first)
+        remove_snapshot_files(temp_dir, [first])
+        versions = get_file_history(temp_dir, 'reports/q3.xlsx')
+        assert set(versions[1]['snapshots']) == {second, daily}
+
+        # 删除最新的快照：层级状态回退，下一个快照按第二个快照计算变化
+        os.rmdir(third)
+        remove_snapshot_files(temp_dir, [third])
+        fourth = add_snapshot(temp_dir, 'hourly', '2025-01-01_0400', {'reports/q3.xlsx': v1, 'a.txt': other})
+        versions = get_file_history(temp_dir, 'reports/q3.xlsx')
+        assert len(versions) == 1 and set(versions[0]['snapshots']) == {second, fourth, daily}
+        print("✓ 删除快照后历史仍然正确")
+
+
+def test_history_commands():
+    """测试备份时自动登记历史，以及 history 和 restore --version 命令"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        os.makedirs(os.path.join(source_dir, "reports"))
+        with open(os.path.join(source_dir, "reports", "q3.xlsx"), 'w', encoding='utf-8') as f:
+            f.write("第三季度\n")
+        backup_path = create_backup(source_dir, target_dir, 'hourly', compress=True)
+
+        versions = get_file_history(target_dir, os.path.join('reports', 'q3.xlsx'))
+        assert len(versions) == 1 and versions[0]['snapshots'] == [backup_path]
+        assert versions[0]['hash'].startswith('crc32:')
+
+        # 重建索引得到相同的结果
+        assert rebuild_history(target_dir) == 1
+        assert get_file_history(target_dir, 'reports/q3.xlsx') == versions
+
+        config_file = os.path.join(temp_dir, "config.json")
+        with open(config_file, 'w', encoding='utf-8') as f:
+            json.dump({'source_directory': source_dir, 'target_directory': target_dir}, f)
+        assert cli_main(['history', 'reports/q3.xlsx', config_file]) == 0
+        assert cli_main(['history', 'missing.txt', config_file]) == 1
+
+        dest_dir = os.path.join(temp_dir, "restore")
+        assert cli_main(['restore', config_file, '--dest', dest_dir, '--path', 'reports/q3.xlsx',
+                         '--version', '1']) == 0
+        assert os.path.isfile(os.path.join(dest_dir, "reports", "q3.xlsx"))
+        assert cli_main(['restore', config_file, '--dest', dest_dir, '--path', 'reports/q3.xlsx',
+                         '--version', '2']) == 1
+
+
+if __name__ == "__main__":
+    test_file_history()
+    test_history_commands()
+
+    print("=== 测试完成 ===")
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试多任务备份功能
+用于验证 jobs 列表的配置继承、目标目录冲突检查、按设备限制并发，以及多个任务的完整运行
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.catalog import list_snapshots
+from core.jobs import Job, load_jobs, get_path_device, run_jobs
+from core.tier_backup import main
+from core.cli import main as cli_main
+
+
+def test_load_jobs():
+    """测试任务配置继承顶层配置，以及重复目标目录的检查"""
+    print("=== 任务配置测试 ===\n")
+
+    config = {
+        'compress_backup': True,
+        'compression_level': 6,
+        'jobs': [
+            {'name': 'docs', 'source_directory': '/data/docs', 'target_directory': '/backup/docs'},
+            {'source_directory': '/data/db', 'target_directory': '/backup/db', 'compress_backup': False}
+        ]
+    }
+    jobs = dict(load_jobs(config))
+    assert set(jobs) == {'docs', 'job2'}
+    assert jobs['docs']['compress_backup'] is True and jobs['docs']['compression_level'] == 6
+    assert jobs['job2']['compress_backup'] is False
+    assert 'jobs' not in jobs['docs']
+
+    # 没有 jobs 列表时整个配置就是一个任务
+    assert load_jobs({'source_directory': '/a', 'target_directory': '/b'})[0][0] == 'default'
+
+    try:
+        load_jobs({'jobs': [{'target_directory': '/backup'}, {'target_directory': '/backup/'}]})
+        assert False, "同一个目标目录应被拒绝"
+    except ValueError:
+        pass
+    print("✓ 任务配置合并正确")
+
+
+def test_run_jobs_per_device():
+    """测试同一设备上的任务依次执行，不同设备上的任务并行"""
+    print("=== 按设备调度测试 ===\n")
+
+    lock = threading.Lock()
+    active = {}
+    peak = {}
+
+    def run_job(job):
+        with lock:
+            for dev in job.devices:
+                active[dev] = active.get(dev, 0) + 1
+                peak[dev] = max(peak.get(dev, 0), active[dev])
+        time.sleep(0.05)
+        with lock:
+            for dev in job.devices:
+                active[dev] -= 1
+        return job.name
+
+    jobs = [Job('a', {}, {}, frozenset({1})), Job('b', {}, {}, frozenset({1, 2})),
+            Job('c', {}, {}, frozenset({3})), Job('d', {}, {}, frozenset({2}))]
+    start = time.monotonic()
+    results = run_jobs(jobs, run_job)
+    elapsed = time.monotonic() - start
+    assert results == {'a': 'a', 'b': 'b', 'c': 'c', 'd': 'd'}
+    assert peak == {1: 1, 2: 1, 3: 1}
+    # a、c、d 可以同时运行，b 在 a 和 d 之后
+    assert elapsed < 0.2
+
+    peak.clear()
+    run_jobs(jobs, run_job, max_per_device=2)
+    assert peak[1] == 2
+
+    def failing(job):
+        raise RuntimeError("任务失败")
+    assert run_jobs(jobs[:1], failing) == {'a': None}
+    print("✓ 同一设备上的任务没有并发")
+
+
+def test_main_with_jobs():
+    """测试一个配置文件中的多个任务都完成备份"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        jobs = []
+        for name in ('docs', 'photos'):
+            source_dir = os.path.join(temp_dir, "source", name)
+            os.makedirs(source_dir)
+            with open(os.path.join(source_dir, f"{name}.txt"), 'w', encoding='utf-8') as f:
+                f.write(f"{name} 内容\n")
+            jobs.append({'name': name, 'source_directory': source_dir,
+                         'target_directory': os.path.join(temp_dir, "backup", name)})
+        jobs[1]['compress_backup'] = True
+        assert get_path_device(os.path.join(temp_dir, "backup", "docs")) == os.stat(temp_dir).st_dev
+
+        config_file = os.path.join(temp_dir, "config.json")
+        with open(config_file, 'w', encoding='utf-8') as f:
+            json.dump({'max_disk_usage_percent': 99, 'jobs': jobs}, f)
+
+        assert main(config_file) == 0
+        for job in jobs:
+            snapshots = list_snapshots(job['target_directory'], 'hourly')
+            assert len(snapshots) == 1
+            assert snapshots[0]['compressed'] == job.get('compress_backup', False)
+        print("✓ 两个任务都已完成备份")
+
+        # 有任务的备份失败时 run 命令返回非零退出码
+        jobs.append({'name': 'missing', 'source_directory': os.path.join(temp_dir, "source", "missing"),
+                     'target_directory': os.path.join(temp_dir, "backup", "missing")})
+        with open(config_file, 'w', encoding='utf-8') as f:
+            json.dump({'max_disk_usage_percent': 99, 'jobs': jobs}, f)
+        assert cli_main(['run', config_file]) == 1
+        print("✓ 备份失败时返回非零退出码")
+
+
+if __name__ == "__main__":
+    test_load_jobs()
+    test_run_jobs_per_device()
+    test_main_with_jobs()
+
+    print("=== 测试完成 ===")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试变化日志功能
+用于验证 inotify 记录的变化应用到基准清单后与完整扫描结果一致、溢出时回退到完整扫描，
+以及完整扫描期间的变化不会丢失
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.journal import ChangeJournal
+from core.scanner import scan_directory
+
+
+def write_file(path, content):
+    """写入测试文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def wait_for_changes(journal, expected_files):
+    """等待后台线程记录到足够的变化"""
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        with journal._lock:
+            if len(journal._files) + len(journal._dirs) >= expected_files or journal._overflowed:
+                return
+        time.sleep(0.05)
+
+
+def test_change_journal():
+    """测试变化日志的增量清单"""
+    print("=== 变化日志测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        write_file(os.path.join(source_dir, "keep.txt"), "不变\n")
+        write_file(os.path.join(source_dir, "sub", "edit.txt"), "修改前\n")
+        write_file(os.path.join(source_dir, "sub", "remove.txt"), "将被删除\n")
+
+        journal = ChangeJournal(source_dir)
+        if not journal.start():
+            pytest.skip("当前平台不支持 inotify")
+
+        try:
+            assert journal.take_changes() is None
+            journal.set_base(scan_directory(source_dir), 'hash0')
+            assert journal.take_changes() == (set(), set())
+
+            write_file(os.path.join(source_dir, "sub", "edit.txt"), "修改后的内容\n")
+            os.remove(os.path.join(source_dir, "sub", "remove.txt"))
+            write_file(os.path.join(source_dir, "new", "deep", "added.txt"), "新目录中的文件\n")
+            write_file(os.path.join(source_dir, ".hidden"), "隐藏文件\n")
+            wait_for_changes(journal, 3)
+
+            changes = journal.take_changes()
+            assert changes is not None
+            assert os.path.join("sub", "edit.txt") in changes[0]
+            assert ".hidden" not in changes[0]
+            assert journal.apply_changes(changes) == scan_directory(source_dir)
+            print(f"✓ 变化日志: {changes}")
+
+            # 日志过大时回退到完整扫描
+            journal.max_entries = 2
+            for i in range(5):
+                write_file(os.path.join(source_dir, f"many{i}.txt"), "批量文件\n")
+            wait_for_changes(journal, 3)
+            journal.max_entries = 100
+            assert journal.take_changes() is None
+            journal.set_base(scan_directory(source_dir), 'hash1')
+            # 溢出之后才读到的事件在完整扫描开始后照常记录，应用后与完整扫描一致
+            changes = journal.take_changes()
+            assert changes is not None
+            assert journal.apply_changes(changes) == scan_directory(source_dir)
+            print("✓ 日志溢出后回退到完整扫描")
+        finally:
+            journal.stop()
+
+
+def test_change_during_rescan():
+    """测试完整扫描之后、登记基准清单之前修改的文件在下次备份时被发现"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        write_file(os.path.join(source_dir, "sub", "edit.txt"), "修改前\n")
+
+        journal = ChangeJournal(source_dir)
+        if not journal.start():
+            pytest.skip("当前平台不支持 inotify")
+
+        try:
+            assert journal.take_changes() is None
+            manifest = scan_directory(source_dir)
+            write_file(os.path.join(source_dir, "sub", "edit.txt"), "扫描之后修改的内容\n")
+            wait_for_changes(journal, 1)
+            journal.set_base(manifest, 'hash0')
+
+            changes = journal.take_changes()
+            assert changes is not None
+            assert os.path.join("sub", "edit.txt") in changes[0]
+            assert journal.apply_changes(changes) == scan_directory(source_dir)
+            print("✓ 完整扫描期间的变化没有丢失")
+        finally:
+            journal.stop()
+
+
+if __name__ == "__main__":
+    test_change_journal()
+    test_change_during_rescan()
+
+    print("=== 测试完成 ===")
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试 Merkle 树变化检测
+用于验证根哈希覆盖全部文件、只报告变化的文件，并且只重新计算变化的子树
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.scanner import scan_directory
+from core import merkle
+from core.merkle import update_merkle_tree
+
+
+def write_file(path, content):
+    """写入测试文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def test_merkle_change_detection():
+    """测试超过 1000 个文件时的变化检测"""
+    print("=== Merkle 树变化检测测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "target")
+
+        for i in range(1200):
+            write_file(os.path.join(source_dir, f"dir{i % 10}", f"file{i:04d}.txt"), f"内容 {i}\n")
+
+        hash1, changed1 = update_merkle_tree(target_dir, scan_directory(source_dir))
+        assert len(changed1) == 1200
+
+        # 未变化时根哈希相同，且没有变化的文件
+        hash2, changed2 = update_merkle_tree(target_dir, scan_directory(source_dir))
+        assert hash2 == hash1 and changed2 == []
+
+        # 修改排在第 1000 个之后的文件
+        late_file = os.path.join(source_dir, "dir9", "file1199.txt")
+        write_file(late_file, "修改后的内容，长度不同\n")
+        hash3, changed3 = update_merkle_tree(target_dir, scan_directory(source_dir))
+        assert hash3 != hash1
+        assert changed3 == [os.path.join("dir9", "file1199.txt")]
+
+        # 删除整个目录
+        for name in os.listdir(os.path.join(source_dir, "dir0")):
+            os.remove(os.path.join(source_dir, "dir0", name))
+        os.rmdir(os.path.join(source_dir, "dir0"))
+        hash4, changed4 = update_merkle_tree(target_dir, scan_directory(source_dir))
+        assert hash4 != hash3 and len(changed4) == 120
+        print("✓ Merkle 树变化检测正确")
+
+
+def test_only_dirty_subtrees_recomputed(monkeypatch):
+    """测试只重新计算变化的目录及其上级目录，未变化的子树沿用保存的哈希"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "target")
+        for i in range(60):
+            write_file(os.path.join(source_dir, f"dir{i % 3}", f"sub{i % 2}", f"file{i:02d}.txt"), f"内容 {i}\n")
+        update_merkle_tree(target_dir, scan_directory(source_dir))
+
+        digested = []
+        entries_digest = merkle._entries_digest
+
+        def counting_digest(files):
+            digested.append(sorted(files))
+            return entries_digest(files)
+
+        monkeypatch.setattr(merkle, '_entries_digest', counting_digest)
+        write_file(os.path.join(source_dir, "dir1", "sub0", "file01.txt"), "修改后的内容，长度不同\n")
+        hash1, changed = update_merkle_tree(target_dir, scan_directory(source_dir))
+        assert changed == [os.path.join("dir1", "sub0", "file01.txt")]
+        # 缓存中有上次的条目：只有条目变化的目录计算条目摘要
+        assert len(digested) == 1
+
+        # 进程内缓存失效（如新进程）时按数据库中的摘要比较，结果相同
+        merkle._tree_cache.clear()
+        hash2, changed = update_merkle_tree(target_dir, scan_directory(source_dir))
+        assert hash2 == hash1 and changed == []
+
+        # 删除子目录时父目录的哈希随之变化
+        for name in os.listdir(os.path.join(source_dir, "dir2", "sub1")):
+            os.remove(os.path.join(source_dir, "dir2", "sub1", name))
+        os.rmdir(os.path.join(source_dir, "dir2", "sub1"))
+        hash3, changed = update_merkle_tree(target_dir, scan_directory(source_dir))
+        assert hash3 != hash2 and len(changed) == 10
+        merkle._tree_cache.clear()
+        assert update_merkle_tree(target_dir, scan_directory(source_dir)) == (hash3, [])
+
+
+if __name__ == "__main__":
+    test_merkle_change_detection()
+
+    print("=== 测试完成 ===")
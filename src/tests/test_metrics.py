@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试运行指标
+用于验证各阶段计时、运行报告和 Prometheus textfile 的内容、多任务时的输出路径、
+守护进程的滚动运行历史，以及按配置设置日志
+"""
+
+import os
+import sys
+import json
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.metrics import (RunMetrics, RunHistory, load_metrics_config, get_job_path, format_prometheus,
+                          PHASES)
+from core.tier_backup import get_run_settings, run_backups, configure_logging
+
+
+def make_source(source_dir):
+    """创建测试用的源目录"""
+    os.makedirs(os.path.join(source_dir, "sub"))
+    for index in range(5):
+        with open(os.path.join(source_dir, "sub", f"file{index}.txt"), 'w', encoding='utf-8') as f:
+            f.write(f"测试内容 {index}\n" * 2000)
+
+
+def test_phase_timing_and_report():
+    """测试同一阶段的耗时累加，报告汇总各备份的统计"""
+    metrics = RunMetrics('docs', '/backup')
+    with metrics.phase('scan'):
+        pass
+    with metrics.phase('scan'):
+        pass
+    assert set(PHASES) <= set(metrics.phases)
+
+    metrics.record_backup('hourly', 'created', '/backup/hourly/x.zip', files=10, size=1000, written_bytes=250,
+                          seconds=2.0, transfer_seconds=0.5, compressed=True)
+    metrics.record_backup('daily', 'failed')
+    report = metrics.report(throttled_seconds=1.25)
+    assert report['status'] == 'failed' and report['job'] == 'docs'
+    assert report['totals'] == {'backups': 2, 'failed': 1, 'files': 10, 'bytes': 1000, 'written_bytes': 250}
+    hourly = report['backups'][0]
+    assert hourly['compression_ratio'] == 0.25 and hourly['throughput_bytes_per_second'] == 2000
+    assert report['backups'][1]['throughput_bytes_per_second'] is None
+    assert RunMetrics().report()['status'] == 'idle'
+
+    text = format_prometheus(report)
+    assert '# TYPE tier_backup_phase_duration_seconds gauge' in text
+    assert 'tier_backup_phase_duration_seconds{job="docs",phase="scan"}' in text
+    assert 'tier_backup_backup_compression_ratio{job="docs",type="hourly",result="created"} 0.25' in text
+    assert 'tier_backup_last_run_success{job="docs"} 0' in text
+    assert 'tier_backup_throttled_seconds{job="docs"} 1.25' in text
+    # 失败的备份没有压缩率，不输出该样本
+    assert 'type="daily",result="failed"} None' not in text
+
+
+def test_load_metrics_config():
+    """测试 metrics 配置的默认值、校验和多任务时的输出路径"""
+    assert load_metrics_config(None) == {'enabled': True, 'report_path': None, 'prometheus_textfile': None,
+                                         'history_size': 100}
+    for bad in ({'history_size': -1}, {'history_size': 'all'}, {'prometheus_textfile': 1}, {'path': 'x'}):
+        try:
+            load_metrics_config(bad)
+            assert False, f"无效配置应抛出异常: {bad}"
+        except ValueError:
+            pass
+
+    assert get_job_path('/var/lib/node_exporter/backup.prom', 'default', 'default') == \
+        '/var/lib/node_exporter/backup.prom'
+    assert get_job_path('/var/lib/node_exporter/backup.prom', 'docs', 'default') == \
+        '/var/lib/node_exporter/backup-docs.prom'
+    assert get_job_path(None, 'docs', 'default') is None
+
+
+def test_run_report_and_textfile():
+    """测试一次运行写出运行报告和 Prometheus textfile，记录各阶段耗时"""
+    print("=== 运行报告测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        textfile = os.path.join(temp_dir, "textfile", "tier_backup.prom")
+        make_source(source_dir)
+
+        config = {'source_directory': source_dir, 'target_directory': target_dir, 'compress_backup': True,
+                  'change_detection': 'content', 'metrics': {'prometheus_textfile': textfile}}
+        settings = get_run_settings(config)
+        created = run_backups(config, settings, {'hourly': True, 'daily': False, 'weekly': False})
+        settings['reaper'].wait()
+        assert created == ['hourly']
+
+        with open(os.path.join(target_dir, ".tier_backup", "run_report.json"), encoding='utf-8') as f:
+            report = json.load(f)
+        assert report['status'] == 'success' and report['job'] == 'default'
+        assert set(report['phases']) == set(PHASES)
+        assert report['phases']['archive'] > 0 and report['phases']['copy'] == 0
+        backup = report['backups'][0]
+        assert backup['result'] == 'created' and backup['files'] == 5
+        assert backup['bytes'] == sum(os.path.getsize(os.path.join(source_dir, "sub", name))
+                                      for name in os.listdir(os.path.join(source_dir, "sub")))
+        assert backup['written_bytes'] == os.path.getsize(backup['path'])
+        assert 0 < backup['compression_ratio'] < 1 and backup['throughput_bytes_per_second'] > 0
+        print("✓ 运行报告包含各阶段耗时和压缩率")
+
+        with open(textfile, encoding='utf-8') as f:
+            text = f.read()
+        assert 'tier_backup_backup_files{job="default",type="hourly",result="created"} 5' in text
+        assert 'tier_backup_last_run_success{job="default"} 1' in text
+        assert not [name for name in os.listdir(os.path.dirname(textfile)) if name.endswith('.tmp')]
+        print("✓ 写出 Prometheus textfile")
+
+        # 源目录未变化：第二次运行创建软链接备份，报告覆盖上一次
+        config['metrics']['enabled'] = False
+        settings = get_run_settings(config)
+        run_backups(config, settings, {'hourly': False, 'daily': True, 'weekly': False})
+        settings['reaper'].wait()
+        with open(os.path.join(target_dir, ".tier_backup", "run_report.json"), encoding='utf-8') as f:
+            assert json.load(f)['started_at'] == report['started_at']
+
+
+def test_run_history_is_bounded():
+    """测试运行历史只保留最近 N 次，重新打开时读回"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        history = RunHistory(temp_dir, size=3)
+        for index in range(5):
+            history.append({'run': index})
+        assert [run['run'] for run in RunHistory(temp_dir, size=3).runs] == [2, 3, 4]
+
+
+def test_configure_logging():
+    """测试按配置设置日志级别和日志文件，再次配置时替换之前的处理器"""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_file = os.path.join(temp_dir, "backup.log")
+        try:
+            configure_logging({'log_level': 'warning', 'log_file': log_file})
+            logging.info("不应写入")
+            logging.warning("应写入")
+            configure_logging({'log_level': 'DEBUG', 'log_file': os.path.join(temp_dir, "other.log")})
+            logging.debug("写入新的日志文件")
+            assert len([handler for handler in root.handlers if handler not in handlers]) == 1
+
+            with open(log_file, encoding='utf-8') as f:
+                content = f.read()
+            assert "应写入" in content and "不应写入" not in content and "新的日志文件" not in content
+
+            try:
+                configure_logging({'log_level': 'VERBOSE'})
+                assert False, "未知的日志级别应抛出异常"
+            except ValueError:
+                pass
+        finally:
+            configure_logging({'log_file': ''})
+            for handler in root.handlers[:]:
+                if handler not in handlers:
+                    root.removeHandler(handler)
+                    handler.close()
+            root.setLevel(level)
+
+
+if __name__ == "__main__":
+    test_phase_timing_and_report()
+    test_load_metrics_config()
+    test_run_report_and_textfile()
+    test_run_history_is_bounded()
+    test_configure_logging()
+
+    print("=== 测试完成 ===")
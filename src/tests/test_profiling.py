@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试性能剖析
+用于验证 profiling 配置的校验、--profile 开关、慢文件追踪、cProfile 和采样剖析器写出的结果，
+以及剖析结果的保留数量
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.profiling import (SlowFileTracer, SamplingProfiler, Profiler, load_profiling_config, enable_profiling,
+                            create_profiler)
+from core.tier_backup import get_run_settings, run_backups
+
+
+def make_source(source_dir):
+    """创建测试用的源目录"""
+    os.makedirs(os.path.join(source_dir, "sub"))
+    for index in range(5):
+        with open(os.path.join(source_dir, "sub", f"file{index}.txt"), 'w', encoding='utf-8') as f:
+            f.write(f"测试内容 {index}\n" * 2000)
+
+
+def test_load_profiling_config():
+    """测试 profiling 配置的默认值、校验和 --profile 开关"""
+    config = load_profiling_config(None)
+    assert config['enabled'] is False and config['profiler'] == 'cprofile' and config['phases'] == ['run']
+    assert create_profiler(config, '/tmp', 'default') is None
+    assert create_profiler(None, '/tmp', 'default') is None
+
+    for bad in ({'profiler': 'perf'}, {'phases': 'run'}, {'phases': ['compile']}, {'sample_interval': 0},
+                {'slow_file_seconds': True}, {'keep_runs': 0}, {'output': 'x'}):
+        try:
+            load_profiling_config(bad)
+            assert False, f"无效配置应抛出异常: {bad}"
+        except ValueError:
+            pass
+
+    config = {'profiling': {'phases': ['hash']},
+              'jobs': [{'name': 'docs', 'profiling': {'profiler': 'sampling'}}, {'name': 'photos'}]}
+    enable_profiling(config)
+    assert config['profiling'] == {'phases': ['hash'], 'enabled': True}
+    assert config['jobs'][0]['profiling'] == {'profiler': 'sampling', 'enabled': True}
+    # 没有单独设置 profiling 的任务沿用全局设置
+    assert 'profiling' not in config['jobs'][1]
+
+
+def test_slow_file_tracer():
+    """测试慢文件追踪器只记录超过阈值的调用，且不改变返回值和异常"""
+    tracer = SlowFileTracer(0.02, limit=1)
+
+    def work(path, seconds):
+        time.sleep(seconds)
+        if seconds < 0:
+            raise OSError(path)
+        return path.upper()
+
+    traced = tracer.wrap('hash', work)
+    assert traced('fast.txt', 0) == 'FAST.TXT'
+    assert tracer.count == 0
+    assert traced('slow.txt', 0.05) == 'SLOW.TXT'
+    traced('slower.txt', 0.05)
+    assert tracer.count == 2
+    assert len(tracer.slow_files) == 1
+    assert tracer.slow_files[0]['stage'] == 'hash' and tracer.slow_files[0]['path'] == 'slow.txt'
+    assert tracer.slow_files[0]['seconds'] >= 0.02
+
+
+def test_sampling_profiler():
+    """测试采样剖析器记录其他线程的调用栈并写出折叠栈文件"""
+    def busy_loop(stop):
+        while not stop.is_set():
+            sum(range(1000))
+
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name='busy')
+    profiler = SamplingProfiler(0.001)
+    worker.start()
+    profiler.start()
+    time.sleep(0.1)
+    profiler.stop()
+    stop.set()
+    worker.join()
+    assert profiler.samples > 0
+    assert any(stack.startswith('busy;') and 'busy_loop' in stack for stack in profiler.stacks)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        folded = os.path.join(temp_dir, 'run.folded')
+        text = os.path.join(temp_dir, 'run.txt')
+        profiler.write(folded, text)
+        with open(folded, encoding='utf-8') as f:
+            line = f.readline().rstrip('\n')
+        assert int(line.rsplit(' ', 1)[1]) > 0
+        with open(text, encoding='utf-8') as f:
+            assert f.readline().startswith(f"采样 {profiler.samples} 次")
+
+
+def test_run_profile_outputs():
+    """测试启用剖析的运行写出各阶段的 pstats、内存统计和慢文件，并记录到运行报告"""
+    print("=== 性能剖析测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        make_source(source_dir)
+
+        config = {'source_directory': source_dir, 'target_directory': target_dir, 'compress_backup': True,
+                  'change_detection': 'content',
+                  'profiling': {'enabled': True, 'phases': ['run', 'hash'], 'tracemalloc': True,
+                                'slow_file_seconds': 0.000001}}
+        settings = get_run_settings(config)
+        created = run_backups(config, settings, {'hourly': True, 'daily': False, 'weekly': False})
+        settings['reaper'].wait()
+        assert created == ['hourly']
+
+        with open(os.path.join(target_dir, ".tier_backup", "run_report.json"), encoding='utf-8') as f:
+            report = json.load(f)
+        profile = report['profile']
+        assert profile['profiler'] == 'cprofile'
+        assert os.path.dirname(profile['directory']) == os.path.join(target_dir, ".tier_backup", "profiles")
+        names = sorted(os.path.basename(path) for path in profile['files'])
+        # hash 阶段在 run 阶段之内，同一线程中不重复剖析
+        assert names == ['memory.txt', 'run.pstats', 'run.txt', 'slow_files.json']
+        with open(os.path.join(profile['directory'], 'run.txt'), encoding='utf-8') as f:
+            assert 'create_backup' in f.read()
+        assert profile['memory_peak_bytes'] > 0 and 'run' in profile['phase_memory_peak_bytes']
+        print("✓ 写出 pstats 和内存统计")
+
+        # 阈值极小，每个文件的哈希和压缩都被记录
+        stages = {item['stage'] for item in profile['slow_files']}
+        assert {'hash', 'compress'} <= stages
+        assert profile['slow_file_count'] >= 10
+        print("✓ 记录慢文件")
+
+        # 只追踪慢文件时不写剖析结果
+        config['profiling'] = {'slow_file_seconds': 60}
+        settings = get_run_settings(config)
+        run_backups(config, settings, {'hourly': False, 'daily': True, 'weekly': False})
+        settings['reaper'].wait()
+        with open(os.path.join(target_dir, ".tier_backup", "run_report.json"), encoding='utf-8') as f:
+            report = json.load(f)
+        assert report['profile'] == {'slow_file_seconds': 60, 'slow_file_count': 0, 'slow_files': []}
+
+        config['profiling'] = {'keep_runs': 1}
+        assert get_run_settings(config)['profiling']['enabled'] is False
+
+
+def test_profile_pruning():
+    """测试每个任务只保留最近 keep_runs 次的剖析结果"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        profiles_dir = os.path.join(temp_dir, 'profiles')
+        for name in ('20240101-000000-docs', '20240102-000000-docs', '20240101-000000-photos'):
+            os.makedirs(os.path.join(profiles_dir, name))
+
+        config = load_profiling_config({'enabled': True, 'keep_runs': 2})
+        profiler = Profiler(config, profiles_dir, 'docs')
+        with profiler.phase('run'):
+            sum(range(1000))
+        summary = profiler.finish()
+        remaining = sorted(os.listdir(profiles_dir))
+        assert os.path.basename(summary['directory']) in remaining
+        assert '20240101-000000-docs' not in remaining
+        assert '20240102-000000-docs' in remaining and '20240101-000000-photos' in remaining
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试层级提升功能
+用于验证同一次运行中只备份一次源目录，其余层级由该快照提升，各层级可以独立删除，
+重建快照目录后提升和移交的快照仍在各自的层级中，
+以及批量删除时快照只列出一次
+"""
+
+import os
+import sys
+import json
+import logging
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.catalog import list_snapshots, rebuild_catalog, STATE_DIR_NAME, CATALOG_FILE_NAME
+from core import tier_backup
+from core.tier_backup import create_backup, promote_backup, delete_backup, delete_backups
+
+
+def create_source(source_dir):
+    """创建测试源目录"""
+    os.makedirs(os.path.join(source_dir, "sub"), exist_ok=True)
+    with open(os.path.join(source_dir, "file1.txt"), 'w', encoding='utf-8') as f:
+        f.write("测试内容\n")
+    with open(os.path.join(source_dir, "sub", "file2.txt"), 'w', encoding='utf-8') as f:
+        f.write("子目录内容\n")
+
+
+def test_hardlink_promotion():
+    """测试硬链接提升：删除每小时快照不影响每日快照"""
+    print("=== 硬链接层级提升测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        create_source(source_dir)
+
+        hourly = create_backup(source_dir, target_dir, 'hourly', enable_symlink=False)
+        daily = promote_backup(hourly, target_dir, 'daily')
+        assert daily and os.path.isdir(daily) and not os.path.islink(daily)
+        assert os.path.samefile(os.path.join(hourly, "sub", "file2.txt"), os.path.join(daily, "sub", "file2.txt"))
+        assert not os.path.samefile(os.path.join(hourly, "backup_info.json"), os.path.join(daily, "backup_info.json"))
+
+        delete_backup(hourly)
+        assert not os.path.exists(hourly)
+        with open(os.path.join(daily, "file1.txt"), encoding='utf-8') as f:
+            assert f.read() == "测试内容\n"
+        assert [b['type'] for b in list_snapshots(target_dir)] == ['daily']
+        print(f"✓ 每日快照由硬链接提升，删除每小时快照后仍完整: {daily}")
+
+
+def test_reference_promotion():
+    """测试引用提升：删除被引用的实际快照时数据移交给引用者"""
+    print("=== 引用层级提升测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        create_source(source_dir)
+
+        hourly = create_backup(source_dir, target_dir, 'hourly', compress=True, enable_symlink=False)
+        daily = promote_backup(hourly, target_dir, 'daily', mode='reference')
+        weekly = promote_backup(hourly, target_dir, 'weekly', mode='reference')
+        assert os.path.islink(daily) and os.path.islink(weekly)
+
+        # 删除实际快照：数据移交给保留时间最长的每周快照，每日快照改为指向它
+        delete_backup(hourly)
+        assert not os.path.lexists(hourly)
+        assert os.path.isfile(weekly) and not os.path.islink(weekly)
+        assert os.path.islink(daily) and os.path.samefile(daily, weekly)
+
+        snapshots = {b['type']: b for b in list_snapshots(target_dir)}
+        assert set(snapshots) == {'daily', 'weekly'}
+        assert not snapshots['weekly']['is_symlink']
+        assert snapshots['daily']['symlink_target'] == weekly
+        print(f"✓ 实际快照已移交: {weekly}")
+
+
+def test_rebuild_after_promotion():
+    """测试提升和数据移交后的快照在重建快照目录后仍登记在各自的层级中"""
+    for compress in (True, False):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_dir = os.path.join(temp_dir, "source")
+            target_dir = os.path.join(temp_dir, "backup")
+            catalog_file = os.path.join(target_dir, STATE_DIR_NAME, CATALOG_FILE_NAME)
+            create_source(source_dir)
+
+            hourly = create_backup(source_dir, target_dir, 'hourly', compress=compress, enable_symlink=False)
+            daily = promote_backup(hourly, target_dir, 'daily', mode='reference')
+            weekly = promote_backup(hourly, target_dir, 'weekly', mode='hardlink')
+
+            os.remove(catalog_file)
+            assert rebuild_catalog(target_dir) == 3
+            snapshots = {b['type']: b for b in list_snapshots(target_dir)}
+            assert {t: b['path'] for t, b in snapshots.items()} == {'hourly': hourly, 'daily': daily,
+                                                                  'weekly': weekly}
+            assert snapshots['daily']['is_symlink'] and snapshots['daily']['symlink_target'] == hourly
+
+            # 删除每小时快照：数据移交给引用它的每日快照
+            delete_backup(hourly)
+            assert os.path.exists(daily) and not os.path.islink(daily)
+
+            # 快照目录丢失时 list_snapshots 自动重建，移交后的快照不会被遗漏
+            os.remove(catalog_file)
+            snapshots = {b['type']: b for b in list_snapshots(target_dir)}
+            assert {t: b['path'] for t, b in snapshots.items()} == {'daily': daily, 'weekly': weekly}
+            assert not snapshots['daily']['is_symlink']
+            print(f"✓ 重建快照目录后提升的快照仍在各自的层级中（压缩: {compress}）")
+
+
+def make_snapshot(target_dir, backup_type, created, symlink_target=None):
+    """在目标目录中生成一个目录快照（symlink_target 不为空时生成指向它的软链接快照）"""
+    timestamp = created.strftime("%Y-%m-%d_%H%M" if backup_type == 'hourly' else "%Y-%m-%d")
+    snapshot = os.path.join(target_dir, backup_type, timestamp)
+    os.makedirs(os.path.dirname(snapshot), exist_ok=True)
+    if symlink_target:
+        os.symlink(symlink_target, snapshot)
+        return snapshot
+    os.makedirs(snapshot)
+    with open(os.path.join(snapshot, 'backup_info.json'), 'w', encoding='utf-8') as f:
+        json.dump({'timestamp': timestamp, 'created_at': created.isoformat(), 'type': backup_type,
+                   'directory_hash': timestamp, 'file_count': 0, 'total_size': 0, 'is_symlink': False}, f)
+    return snapshot
+
+
+def test_batch_delete_lists_once(monkeypatch, caplog):
+    """测试批量删除只列出一次快照，移交在内存中更新引用关系，不再误报快照已不存在"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        target_dir = os.path.join(temp_dir, "backup")
+        now = datetime(2025, 1, 15, 12, 0)
+        hourly = [make_snapshot(target_dir, 'hourly', now - timedelta(hours=i)) for i in range(30)]
+        # hourly[0] 被每日和每周快照引用，hourly[1] 被另一个每日快照引用
+        daily_old = make_snapshot(target_dir, 'daily', now - timedelta(days=1), hourly[0])
+        weekly = make_snapshot(target_dir, 'weekly', now, hourly[0])
+        daily = make_snapshot(target_dir, 'daily', now, hourly[1])
+        rebuild_catalog(target_dir)
+
+        calls = []
+        original = tier_backup.list_snapshots
+
+        def counting_list(*args, **kwargs):
+            calls.append(args)
+            return original(*args, **kwargs)
+
+        monkeypatch.setattr(tier_backup, 'list_snapshots', counting_list)
+        with caplog.at_level(logging.WARNING):
+            delete_backups(hourly[:-1] + [daily_old])
+        assert len(calls) == 1
+        assert "快照已不存在" not in caplog.text
+
+        # 每周快照接收 hourly[0] 的数据（同一批中删除的每日软链接不参与移交），每日快照接收 hourly[1]
+        assert os.path.isdir(weekly) and not os.path.islink(weekly)
+        assert os.path.isdir(daily) and not os.path.islink(daily)
+        assert not os.path.lexists(daily_old)
+        snapshots = {b['path']: b for b in original(target_dir)}
+        assert set(snapshots) == {hourly[-1], weekly, daily}
+        assert not snapshots[weekly]['is_symlink'] and not snapshots[daily]['is_symlink']
+
+
+if __name__ == "__main__":
+    test_hardlink_promotion()
+    test_reference_promotion()
+    test_rebuild_after_promotion()
+
+    print("=== 测试完成 ===")
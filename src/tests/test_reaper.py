@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试回收站功能
+用于验证过期快照移入回收站、并行限速删除、中断后继续回收，以及磁盘空间规划对回收站的计入
+"""
+
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.catalog import list_snapshots
+from core.reaper import Reaper, list_trash, reap_trash
+from core.space import plan_space_cleanup
+from core.tier_backup import create_backup, delete_backups
+
+
+def create_source(source_dir, count=20):
+    """创建包含多级子目录的测试源目录"""
+    for i in range(count):
+        sub_dir = os.path.join(source_dir, f"dir{i % 4}", f"sub{i % 3}")
+        os.makedirs(sub_dir, exist_ok=True)
+        with open(os.path.join(sub_dir, f"file{i}.txt"), 'w', encoding='utf-8') as f:
+            f.write(f"测试内容 {i}\n" * 100)
+
+
+def test_trash_and_reap():
+    """测试删除快照时移入回收站，再由回收线程删除"""
+    print("=== 回收站测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        create_source(source_dir)
+
+        backup_path = create_backup(source_dir, target_dir, 'hourly', enable_symlink=False)
+        delete_backups([backup_path])
+        assert not os.path.lexists(backup_path)
+        assert list_snapshots(target_dir) == []
+        assert len(list_trash(target_dir)) == 1
+        print("✓ 快照已移入回收站，快照目录中已移除")
+
+        reaper = Reaper(target_dir, workers=4, rate=1000)
+        assert reaper.start()
+        assert reaper.wait(timeout=30)
+        assert list_trash(target_dir) == []
+        assert not reaper.start()
+        print("✓ 后台回收完成")
+
+
+def test_interrupted_reap_resumes():
+    """测试回收被中断后，剩余部分在下次回收时继续"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        create_source(source_dir)
+
+        backup_path = create_backup(source_dir, target_dir, 'hourly', enable_symlink=False)
+        delete_backups([backup_path])
+
+        stop_event = threading.Event()
+        stop_event.set()
+        stats = reap_trash(target_dir, stop_event=stop_event)
+        assert stats['entries'] == 0 and stats['remaining'] == 1
+
+        stats = reap_trash(target_dir, workers=2)
+        assert stats['entries'] == 1 and stats['remaining'] == 0
+        assert stats['files'] == 21
+        assert list_trash(target_dir) == []
+        print("✓ 中断的回收在下次继续")
+
+
+def test_plan_counts_pending_trash():
+    """测试磁盘空间规划先计入回收站中等待删除的空间"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        trash_entry = os.path.join(temp_dir, ".trash", "1-hourly-2025-01-01_0100")
+        os.makedirs(trash_entry)
+        with open(os.path.join(trash_entry, "data.bin"), 'wb') as f:
+            f.write(os.urandom(64 * 1024))
+
+        older = os.path.join(temp_dir, "hourly", "2025-01-01_0200")
+        newest = os.path.join(temp_dir, "hourly", "2025-01-01_0300")
+        for path in (older, newest):
+            os.makedirs(path)
+        backups = {'hourly': [
+            {'path': older, 'type': 'hourly', 'timestamp': '2025-01-01_0200', 'is_symlink': False},
+            {'path': newest, 'type': 'hourly', 'timestamp': '2025-01-01_0300', 'is_symlink': False}
+        ]}
+
+        # 回收站中的空间已足够，不需要再删除快照
+        to_delete, freed = plan_space_cleanup(backups, 1, pending=list_trash(temp_dir))
+        assert to_delete == [] and freed >= 64 * 1024
+
+        to_delete, _ = plan_space_cleanup(backups, 10 ** 12, pending=list_trash(temp_dir))
+        assert [b['path'] for b in to_delete] == [older]
+
+
+if __name__ == "__main__":
+    test_trash_and_reap()
+    test_interrupted_reap_resumes()
+    test_plan_counts_pending_trash()
+
+    print("=== 测试完成 ===")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试恢复功能
+用于验证从压缩快照中按路径恢复单个文件、恢复整个目录快照、软链接快照的解析以及修改时间的恢复
+"""
+
+import os
+import sys
+import json
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.tier_backup import create_backup, promote_backup
+from core.restore import restore_snapshot, resolve_snapshot, matches_patterns
+from core.cli import main as cli_main
+
+# 固定的修改时间（纳秒），用于验证恢复后的 mtime
+MTIME_NS = 1700000000123456789
+
+
+def create_source(source_dir):
+    """创建测试源目录，文件使用固定的修改时间"""
+    files = {
+        "readme.txt": "说明\n",
+        os.path.join("reports", "q3.xlsx"): "第三季度\n" * 100,
+        os.path.join("reports", "2024", "q4.csv"): "a,b,c\n" * 100,
+        os.path.join("logs", "app.log"): "日志\n" * 1000
+    }
+    for rel_path, content in files.items():
+        path = os.path.join(source_dir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.utime(path, ns=(MTIME_NS, MTIME_NS))
+    return files
+
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def test_restore_from_archive():
+    """测试从压缩快照中只恢复匹配的文件，并恢复纳秒精度的修改时间"""
+    print("=== 压缩快照恢复测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        files = create_source(source_dir)
+        create_backup(source_dir, target_dir, 'hourly', compress=True, enable_symlink=False)
+
+        dest_dir = os.path.join(temp_dir, "restore")
+        stats = restore_snapshot(target_dir, dest_dir, patterns=['reports/*.xlsx'])
+        assert stats['files'] == 1
+        restored = os.path.join(dest_dir, "reports", "q3.xlsx")
+        assert read(restored) == files[os.path.join("reports", "q3.xlsx")]
+        assert os.stat(restored).st_mtime_ns == MTIME_NS
+        assert not os.path.exists(os.path.join(dest_dir, "readme.txt"))
+        print("✓ 只恢复了匹配的文件")
+
+        full_dir = os.path.join(temp_dir, "full")
+        stats = restore_snapshot(target_dir, full_dir, workers=4)
+        assert stats['files'] == len(files)
+        for rel_path, content in files.items():
+            assert read(os.path.join(full_dir, rel_path)) == content
+        assert not os.path.exists(os.path.join(full_dir, "backup_info.json"))
+        print("✓ 完整恢复压缩快照")
+
+
+def test_restore_directory_and_symlink():
+    """测试恢复目录快照，软链接快照解析为实际快照"""
+    print("=== 目录快照恢复测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        files = create_source(source_dir)
+        hourly = create_backup(source_dir, target_dir, 'hourly')
+        daily = promote_backup(hourly, target_dir, 'daily', mode='reference')
+        assert os.path.islink(daily)
+
+        backup = resolve_snapshot(target_dir, backup_type='daily')
+        assert backup['physical_path'] == hourly
+        name = os.path.basename(daily)
+        assert resolve_snapshot(target_dir, f"daily/{name}")['path'] == daily
+
+        dest_dir = os.path.join(temp_dir, "restore")
+        stats = restore_snapshot(target_dir, dest_dir, backup_type='daily', patterns=['reports'])
+        assert stats['files'] == 2 and stats['snapshot'] == hourly
+        restored = os.path.join(dest_dir, "reports", "2024", "q4.csv")
+        assert read(restored) == files[os.path.join("reports", "2024", "q4.csv")]
+        assert os.stat(restored).st_mtime_ns == MTIME_NS
+
+        linked_dir = os.path.join(temp_dir, "linked")
+        stats = restore_snapshot(target_dir, linked_dir, link=True)
+        assert stats['linked'] == len(files)
+        assert os.path.samefile(os.path.join(linked_dir, "readme.txt"), os.path.join(hourly, "readme.txt"))
+        print("✓ 软链接快照解析为实际快照并恢复")
+
+        try:
+            resolve_snapshot(target_dir, "2000-01-01")
+            assert False, "不存在的快照应抛出异常"
+        except FileNotFoundError:
+            pass
+
+
+def test_restore_command():
+    """测试 restore 子命令"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        create_source(source_dir)
+        create_backup(source_dir, target_dir, 'hourly', compress=True)
+
+        config_file = os.path.join(temp_dir, "config.json")
+        with open(config_file, 'w', encoding='utf-8') as f:
+            json.dump({'source_directory': source_dir, 'target_directory': target_dir}, f)
+
+        dest_dir = os.path.join(temp_dir, "restore")
+        assert cli_main(['restore', config_file, '--dest', dest_dir, '--path', 'logs/app.log']) == 0
+        assert os.path.isfile(os.path.join(dest_dir, "logs", "app.log"))
+        assert cli_main(['restore', config_file, '--dest', dest_dir, '--path', 'missing/*']) == 1
+
+
+def test_matches_patterns():
+    """测试路径匹配规则"""
+    assert matches_patterns('reports/q3.xlsx', None)
+    assert matches_patterns('reports/q3.xlsx', ['reports/*.xlsx'])
+    assert matches_patterns('reports/2024/q4.csv', ['reports/'])
+    assert not matches_patterns('reports2/q3.xlsx', ['reports'])
+
+
+if __name__ == "__main__":
+    test_restore_from_archive()
+    test_restore_directory_and_symlink()
+    test_restore_command()
+    test_matches_patterns()
+
+    print("=== 测试完成 ===")
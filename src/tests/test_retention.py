@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试保留策略功能
+用于验证按解析后的时间计算删除集合、GFS 和稀疏化规则，以及最新的快照总是保留
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.retention import load_retention_policy, plan_retention, parse_snapshot_time
+
+
+def make_snapshots(backup_type, times, fmt):
+    """按时间列表构造快照字典"""
+    return [
+        {'path': f"/backup/{backup_type}/{t.strftime(fmt)}", 'type': backup_type, 'timestamp': t.strftime(fmt)}
+        for t in times
+    ]
+
+
+def test_default_policy():
+    """测试默认策略与旧版本的保留数量一致"""
+    print("=== 默认保留策略测试 ===\n")
+
+    now = datetime(2025, 1, 15, 12, 0)
+    hourly = make_snapshots('hourly', [now - timedelta(hours=i) for i in range(30)], '%Y-%m-%d_%H%M')
+    daily = make_snapshots('daily', [now - timedelta(days=i) for i in range(35)], '%Y-%m-%d')
+    to_delete = plan_retention({'hourly': hourly, 'daily': daily, 'weekly': []}, load_retention_policy(), now)
+
+    deleted_hourly = [b for b in to_delete if b['type'] == 'hourly']
+    deleted_daily = [b for b in to_delete if b['type'] == 'daily']
+    assert len(deleted_hourly) == 6 and len(deleted_daily) == 5
+    # 删除的是最旧的快照，按时间从旧到新排列
+    assert deleted_hourly[0]['timestamp'] == (now - timedelta(hours=29)).strftime('%Y-%m-%d_%H%M')
+    assert parse_snapshot_time(deleted_daily[-1]['timestamp']) == datetime(2024, 12, 16)
+    print(f"✓ 删除 {len(deleted_hourly)} 个每小时备份、{len(deleted_daily)} 个每日备份")
+
+
+def test_gfs_and_thinning():
+    """测试按月、按年保留和稀疏化规则"""
+    print("=== GFS 和稀疏化规则测试 ===\n")
+
+    now = datetime(2025, 1, 15)
+    times = [now - timedelta(days=i) for i in range(0, 800)]
+    daily = make_snapshots('daily', times, '%Y-%m-%d')
+    policy = load_retention_policy({
+        'daily': {
+            'keep_last': 7,
+            'keep_monthly': 6,
+            'keep_yearly': 3,
+            'thin': [{'older_than_days': 7, 'keep_every_days': 30}]
+        }
+    })
+    deleted = {b['timestamp'] for b in plan_retention({'daily': daily}, policy, now)}
+    kept = sorted(parse_snapshot_time(b['timestamp']) for b in daily if b['timestamp'] not in deleted)
+
+    # 最近 7 天全部保留
+    assert all(now - timedelta(days=i) in kept for i in range(7))
+    # 每月最后一个快照保留 6 个月
+    assert datetime(2024, 12, 31) in kept and datetime(2024, 8, 31) in kept
+    # 每年最后一个快照
+    assert datetime(2023, 12, 31) in kept
+    # 稀疏化：更早的快照至多每 30 天一个
+    old = [t for t in kept if t < datetime(2023, 1, 1)]
+    assert old and all((b - a).days >= 30 for a, b in zip(old, old[1:]))
+    print(f"✓ {len(daily)} 个快照中保留 {len(kept)} 个")
+
+
+def test_invalid_policy():
+    """测试错误的规则名称，以及不保留任何快照的规则"""
+    with pytest.raises(ValueError):
+        load_retention_policy({'hourly': {'keep_lats': 10}})
+    with pytest.raises(ValueError):
+        load_retention_policy({'monthly': {'keep_last': 10}})
+    for rules in ({}, {'keep_last': 0, 'keep_daily': 0}, {'keep_within_days': 0, 'thin': []}):
+        with pytest.raises(ValueError):
+            load_retention_policy({'daily': rules})
+
+
+def test_newest_always_kept():
+    """测试规则没有选中最新的快照时仍保留它"""
+    now = datetime(2025, 1, 15, 12, 0)
+    weekly = make_snapshots('weekly', [now - timedelta(days=7 * i) for i in range(10)], '%Y-%m-%d')
+    policy = load_retention_policy({'weekly': {'thin': [{'older_than_days': 30, 'keep_every_days': 28}]}})
+    to_delete = plan_retention({'weekly': weekly}, policy, now)
+    assert weekly[0] not in to_delete
+    # 30 天内的其余快照不被任何规则选中
+    assert weekly[1] in to_delete and weekly[4] in to_delete
+
+
+if __name__ == "__main__":
+    test_default_policy()
+    test_gfs_and_thinning()
+    test_invalid_policy()
+    test_newest_always_kept()
+
+    print("=== 测试完成 ===")
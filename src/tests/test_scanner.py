@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试源目录扫描功能
+用于验证文件清单的内容、顺序和排除规则
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.scanner import scan_directory, summarize_manifest, iter_directory, manifest_sort_key
+
+
+def create_test_tree(source_dir):
+    """创建包含隐藏文件、系统目录和垃圾文件的测试目录"""
+    files = {
+        "b.txt": "bb",
+        "a.txt": "a",
+        "sub/c.txt": "ccc",
+        "sub/deep/d.txt": "dddd",
+        ".hidden": "x",
+        ".git/config": "x",
+        "$RECYCLE.BIN/junk": "x",
+        "sub/Thumbs.db": "x",
+        "sub/e.txt~": "x",
+    }
+    for rel_path, content in files.items():
+        full_path = os.path.join(source_dir, rel_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+
+def test_scan_directory():
+    """测试扫描结果与排除规则"""
+    print("=== 源目录扫描测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as source_dir:
+        create_test_tree(source_dir)
+        manifest = scan_directory(source_dir)
+
+        paths = [entry.path.replace(os.sep, '/') for entry in manifest]
+        assert paths == ['a.txt', 'b.txt', 'sub/c.txt', 'sub/deep/d.txt']
+
+        file_count, total_bytes = summarize_manifest(manifest)
+        assert file_count == 4 and total_bytes == 10
+
+        st = os.stat(os.path.join(source_dir, 'a.txt'))
+        entry = manifest[0]
+        assert (entry.size, entry.mtime_ns, entry.inode) == (st.st_size, st.st_mtime_ns, st.st_ino)
+        print(f"✓ 扫描到 {file_count} 个文件, 共 {total_bytes} 字节")
+
+
+def test_parallel_scan_order():
+    """测试并行扫描的顺序与单线程相同"""
+    print("=== 并行扫描顺序测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as source_dir:
+        for i in range(30):
+            dir_path = os.path.join(source_dir, f"dir{i % 7}", f"sub{i}")
+            os.makedirs(dir_path, exist_ok=True)
+            for j in range(5):
+                with open(os.path.join(dir_path, f"file{j}.txt"), 'w', encoding='utf-8') as f:
+                    f.write(f"{i}-{j}")
+
+        expected = scan_directory(source_dir, workers=1)
+        assert len(expected) == 150
+        assert scan_directory(source_dir, workers=16) == expected
+        assert list(iter_directory(source_dir, workers=4)) == expected
+        assert sorted(expected, key=lambda e: manifest_sort_key(e.path)) == expected
+        print(f"✓ 并行扫描 {len(expected)} 个文件，顺序稳定")
+
+
+if __name__ == "__main__":
+    test_scan_directory()
+    test_parallel_scan_order()
+
+    print("=== 测试完成 ===")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试完整性校验功能
+用于验证压缩快照的 CRC 校验、目录快照与备份时元数据的比对、悬空软链接快照的检测、
+分多次运行的断点续校以及 verify 子命令
+"""
+
+import os
+import sys
+import json
+import shutil
+import struct
+import zipfile
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.tier_backup import create_backup, promote_backup
+from core.scrub import scrub_target, load_scrub_state, is_report_clean
+from core.cli import main as cli_main
+
+
+def create_source(source_dir):
+    """创建测试源目录"""
+    files = {
+        "readme.txt": "说明\n",
+        os.path.join("data", "table.csv"): "a,b,c\n" * 2000,
+        os.path.join("data", "notes.txt"): "记录\n" * 500
+    }
+    for rel_path, content in files.items():
+        path = os.path.join(source_dir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+    return files
+
+
+def corrupt_member(archive_path, name):
+    """翻转压缩包中某个成员数据中间的一个字节（不改动中央目录）"""
+    with zipfile.ZipFile(archive_path) as zipf:
+        zinfo = zipf.getinfo(name)
+    with open(archive_path, 'r+b') as f:
+        f.seek(zinfo.header_offset + 26)
+        name_len, extra_len = struct.unpack('<HH', f.read(4))
+        offset = zinfo.header_offset + 30 + name_len + extra_len + zinfo.compress_size // 2
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+
+def statuses(report):
+    return {os.path.basename(os.path.dirname(r['path'])): r['status'] for r in report['snapshots']}
+
+
+def test_scrub_detects_corruption():
+    """测试校验通过的快照和损坏的压缩快照、目录快照"""
+    print("=== 快照损坏检测测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        create_source(source_dir)
+        archive = create_backup(source_dir, target_dir, 'hourly', compress=True, enable_symlink=False)
+        directory = create_backup(source_dir, target_dir, 'daily', enable_symlink=False)
+
+        report = scrub_target(target_dir, workers=4)
+        assert is_report_clean(report) and report['complete']
+        assert statuses(report) == {'hourly': 'ok', 'daily': 'ok'}
+        assert all(r['files'] == 3 for r in report['snapshots'])
+        assert report['bytes_read'] > 0
+        with open(os.path.join(target_dir, ".tier_backup", "scrub_report.json"), encoding='utf-8') as f:
+            assert json.load(f)['summary']['ok'] == 2
+        print("✓ 完好的快照校验通过")
+
+        corrupt_member(archive, "data/table.csv")
+        with open(os.path.join(directory, "data", "notes.txt"), 'r+b') as f:
+            f.truncate(10)
+        os.unlink(os.path.join(directory, "readme.txt"))
+
+        report = scrub_target(target_dir)
+        assert statuses(report) == {'hourly': 'corrupt', 'daily': 'corrupt'}
+        errors = {os.path.basename(os.path.dirname(r['path'])): r['errors'] for r in report['snapshots']}
+        assert any(e.startswith("data/table.csv") for e in errors['hourly'])
+        assert any(e.startswith("data/notes.txt") for e in errors['daily'])
+        assert any(e.startswith("readme.txt") for e in errors['daily'])
+        assert not is_report_clean(report)
+        print("✓ 检测到损坏的压缩成员、截断和缺失的文件")
+
+
+def test_scrub_dangling_symlink():
+    """测试检测目标已不存在的软链接快照"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        create_source(source_dir)
+        hourly = create_backup(source_dir, target_dir, 'hourly')
+        promote_backup(hourly, target_dir, 'daily', mode='reference')
+        shutil.rmtree(hourly)
+
+        report = scrub_target(target_dir)
+        assert statuses(report) == {'daily': 'dangling'}
+        assert report['summary']['dangling'] == 1
+
+
+def test_scrub_resumes_across_runs():
+    """测试达到读取上限后停止，下次运行从未校验的快照继续，一轮完成后重新开始"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        create_source(source_dir)
+        create_backup(source_dir, target_dir, 'hourly', compress=True, enable_symlink=False)
+        create_backup(source_dir, target_dir, 'daily', enable_symlink=False)
+        create_backup(source_dir, target_dir, 'weekly', compress=True, enable_symlink=False)
+
+        checked = []
+        for expected_remaining in (2, 1, 0):
+            report = scrub_target(target_dir, max_bytes=1, bytes_per_second=10 ** 9)
+            assert len(report['snapshots']) == 1
+            assert report['remaining'] == expected_remaining
+            checked.append(report['snapshots'][0]['path'])
+        assert len(set(checked)) == 3 and report['complete']
+        assert load_scrub_state(target_dir)['verified'] == {}
+
+        report = scrub_target(target_dir, max_bytes=1)
+        assert report['remaining'] == 2
+        assert len(load_scrub_state(target_dir)['verified']) == 1
+
+
+def test_verify_command():
+    """测试 verify 子命令的返回值和报告输出"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        create_source(source_dir)
+        archive = create_backup(source_dir, target_dir, 'hourly', compress=True)
+
+        config_file = os.path.join(temp_dir, "config.json")
+        with open(config_file, 'w', encoding='utf-8') as f:
+            json.dump({'source_directory': source_dir, 'target_directory': target_dir}, f)
+
+        report_path = os.path.join(temp_dir, "report.json")
+        assert cli_main(['verify', config_file, '--report', report_path]) == 0
+        assert os.path.isfile(report_path)
+
+        corrupt_member(archive, "data/table.csv")
+        assert cli_main(['scrub', config_file, '--report', report_path]) == 2
+        with open(report_path, encoding='utf-8') as f:
+            assert json.load(f)['summary']['corrupt'] == 1
+
+
+if __name__ == "__main__":
+    test_scrub_detects_corruption()
+    test_scrub_dangling_symlink()
+    test_scrub_resumes_across_runs()
+    test_verify_command()
+
+    print("=== 测试完成 ===")
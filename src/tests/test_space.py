@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试磁盘空间规划功能
+用于验证按快照目录中的独占大小（缺少时按 inode）计算可释放的空间、软链接引用的实际快照不被单独删除、
+删除后按实际磁盘使用重新规划，以及备份大小的预估
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.space import plan_space_cleanup, estimate_backup_size, get_changed_paths, get_compression_ratio, _inode_usage
+from core.scanner import FileEntry
+from core.catalog import record_snapshot, list_snapshots
+from core.tier_backup import free_disk_space
+
+
+def write_file(path, size):
+    """写入指定大小的测试文件"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+
+
+def make_backup(path, backup_type, timestamp, symlink_target=None, unique_size=None):
+    """构造快照字典"""
+    return {'path': path, 'type': backup_type, 'timestamp': timestamp, 'compressed': False,
+            'is_symlink': symlink_target is not None, 'symlink_target': symlink_target, 'unique_size': unique_size}
+
+
+def test_plan_space_cleanup():
+    """测试硬链接和软链接快照的删除规划"""
+    print("=== 磁盘空间规划测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        hourly_dir = os.path.join(temp_dir, "hourly")
+        daily_dir = os.path.join(temp_dir, "daily")
+
+        # 三个每小时快照：第二个与第一个共享一个硬链接文件
+        first = os.path.join(hourly_dir, "2025-01-01_0100")
+        second = os.path.join(hourly_dir, "2025-01-01_0200")
+        third = os.path.join(hourly_dir, "2025-01-01_0300")
+        write_file(os.path.join(first, "shared.bin"), 64 * 1024)
+        write_file(os.path.join(first, "own.bin"), 32 * 1024)
+        os.makedirs(second)
+        os.link(os.path.join(first, "shared.bin"), os.path.join(second, "shared.bin"))
+        write_file(os.path.join(third, "new.bin"), 16 * 1024)
+
+        # 每日快照是指向第一个每小时快照的软链接
+        os.makedirs(daily_dir)
+        daily_link = os.path.join(daily_dir, "2025-01-01")
+        os.symlink(first, daily_link)
+        daily_latest = os.path.join(daily_dir, "2025-01-02")
+        write_file(os.path.join(daily_latest, "file.bin"), 4096)
+
+        assert _inode_usage(daily_link) == {}
+        shared_size = _inode_usage(os.path.join(first, "shared.bin"))
+
+        backups = {
+            'hourly': [make_backup(first, 'hourly', '2025-01-01_0100'),
+                       make_backup(second, 'hourly', '2025-01-01_0200'),
+                       make_backup(third, 'hourly', '2025-01-01_0300')],
+            'daily': [make_backup(daily_link, 'daily', '2025-01-01', first),
+                      make_backup(daily_latest, 'daily', '2025-01-02')],
+            'weekly': []
+        }
+
+        # 最旧的软链接加入后，其指向的实际快照没有其他引用者，随之加入
+        to_delete, freed = plan_space_cleanup(backups, 1)
+        assert [b['path'] for b in to_delete] == [daily_link, first]
+        # 共享文件在第二个快照中还有链接，只计入第一个快照独有的文件
+        assert 32 * 1024 <= freed < 64 * 1024
+
+        # 需要更多空间时依次加入软链接和实际快照，共享文件的所有链接都删除后才计入
+        to_delete, freed = plan_space_cleanup(backups, 10 ** 12)
+        paths = [b['path'] for b in to_delete]
+        assert set(paths) == {first, second, daily_link}
+        assert freed >= sum(size for _, size in shared_size.values()) + 32 * 1024
+        # 每个层级最新的快照不会被删除
+        assert third not in paths and daily_latest not in paths
+        print(f"✓ 删除 {len(paths)} 个快照，预计释放 {freed} 字节")
+
+        # 参照快照受保护时，引用它的实际快照也不会被删除
+        to_delete, _ = plan_space_cleanup(backups, 10 ** 12, protected=[daily_link])
+        assert first not in [b['path'] for b in to_delete]
+        print("✓ 被保留的软链接所指向的实际快照不会被删除")
+
+
+def test_plan_from_catalog():
+    """测试按快照目录中记录的独占大小规划，不遍历快照"""
+    # 快照不在磁盘上：只有缺少 unique_size 的快照才会被遍历（遍历结果为空）
+    backups = {
+        'hourly': [make_backup('/missing/hourly/2025-01-01_0100', 'hourly', '2025-01-01_0100', unique_size=1000),
+                   make_backup('/missing/hourly/2025-01-01_0200', 'hourly', '2025-01-01_0200'),
+                   make_backup('/missing/hourly/2025-01-01_0300', 'hourly', '2025-01-01_0300', unique_size=300),
+                   make_backup('/missing/hourly/2025-01-01_0400', 'hourly', '2025-01-01_0400', unique_size=50)],
+        'daily': [make_backup('/missing/daily/2025-01-01', 'daily', '2025-01-01', '/missing/hourly/2025-01-01_0300',
+                              unique_size=0)],
+        'weekly': []
+    }
+    to_delete, freed = plan_space_cleanup(backups, 1000)
+    assert [os.path.basename(b['path']) for b in to_delete] == ['2025-01-01_0100'] and freed == 1000
+
+    # 缺少 unique_size 的快照遍历后计入（此处为 0）；被每日层级最新的软链接引用的快照不会被删除
+    to_delete, freed = plan_space_cleanup(backups, 1200)
+    assert [os.path.basename(b['path']) for b in to_delete] == ['2025-01-01_0100', '2025-01-01_0200']
+    assert freed == 1000
+    print("✓ 按快照目录中的独占大小规划")
+
+
+def test_free_disk_space_rechecks(monkeypatch):
+    """测试独占大小高估释放的空间时，删除后按实际磁盘使用重新规划"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        hourly_dir = os.path.join(temp_dir, "hourly")
+        first, second, third = (os.path.join(hourly_dir, f"2025-01-01_0{hour}00") for hour in (1, 2, 3))
+        # 第二个快照硬链接了第一个快照的全部数据：删除第一个快照实际上不释放空间
+        write_file(os.path.join(first, "big.bin"), 100 * 1024)
+        os.makedirs(second)
+        os.link(os.path.join(first, "big.bin"), os.path.join(second, "big.bin"))
+        write_file(os.path.join(second, "new.bin"), 10 * 1024)
+        write_file(os.path.join(third, "new.bin"), 10 * 1024)
+        for path, unique_size in ((first, 100 * 1024), (second, 10 * 1024), (third, 10 * 1024)):
+            record_snapshot(temp_dir, {'path': path, 'timestamp': os.path.basename(path), 'created_at': '',
+                                       'size': unique_size, 'is_symlink': False, 'unique_size': unique_size})
+
+        def disk_usage(path):
+            """按目标目录中实际的文件大小模拟 1000 KiB 的磁盘"""
+            sizes = {}
+            for root, _, files in os.walk(temp_dir):
+                for name in files:
+                    st = os.lstat(os.path.join(root, name))
+                    if name.endswith('.bin'):
+                        sizes[st.st_ino] = st.st_size
+            used = sum(sizes.values())
+            return 1000 * 1024, used, 1000 * 1024 - used
+
+        monkeypatch.setattr(shutil, 'disk_usage', disk_usage)
+        # 写入 50 KiB 后为 17%，需要降到 10% 以下：第一次规划只删除第一个快照，空间仍不足时再删除第二个
+        free_disk_space(temp_dir, 15, 50 * 1024)
+        assert not os.path.exists(first) and not os.path.exists(second) and os.path.isdir(third)
+        assert [b['path'] for b in list_snapshots(temp_dir)] == [third]
+        print("✓ 删除后按实际磁盘使用重新规划")
+
+
+def test_estimate_backup_size():
+    """测试按文件清单预估备份大小"""
+    manifest = [FileEntry('a.txt', 100, 0, 0o100644, 1), FileEntry('b.txt', 300, 0, 0o100644, 2)]
+    assert estimate_backup_size(manifest) == 400
+    assert estimate_backup_size(manifest, changed_paths=['b.txt']) == 300
+    assert estimate_backup_size(manifest, compress=True, compression_ratio=0.5) == 200
+
+    # 相对参照快照（而不是上一次扫描）比较：大小或修改时间变化、以及参照快照中没有的文件需要复制
+    manifest.append(FileEntry(os.path.join('sub', 'c.txt'), 50, 5, 0o100644, 3))
+    previous = {'a.txt': (100, 0, None), 'b.txt': (300, 1, None), 'sub/c.txt': (50, 5, None)}
+    assert get_changed_paths(manifest, previous) == ['b.txt']
+    assert get_changed_paths(manifest, {'a.txt': (100, 0, None)}) == ['b.txt', os.path.join('sub', 'c.txt')]
+    assert get_changed_paths(manifest, None) is None
+
+    zips = [{'compressed': True, 'is_symlink': False, 'size': 250, 'source_size': 1000},
+            {'compressed': True, 'is_symlink': True, 'size': 0, 'source_size': 1000}]
+    assert get_compression_ratio(zips) == 0.25
+    assert get_compression_ratio([]) is None
+
+
+if __name__ == "__main__":
+    test_plan_space_cleanup()
+    test_plan_from_catalog()
+    test_estimate_backup_size()
+
+    print("=== 测试完成 ===")
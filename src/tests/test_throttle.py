@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试 I/O 限速
+用于验证限速器的等待时间统计、resources 配置的解析、复制/哈希/压缩各阶段按带宽限速，
+限速不改变备份结果，以及 idle I/O 优先级在运行结束后恢复
+"""
+
+import os
+import sys
+import json
+import time
+import zipfile
+import threading
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from core.throttle import (RateLimiter, IOThrottle, load_resources, set_idle_io_priority, restore_io_priority,
+                           _ioprio_syscall, IOPRIO_CLASS_IDLE, IOPRIO_CLASS_SHIFT)
+from core.copier import copy_file
+from core.hasher import hash_file
+from core.tier_backup import create_backup, get_run_settings, run_backups
+
+
+def test_rate_limiter_accounts_waiting():
+    """测试按字节数限速并累计等待时间"""
+    limiter = RateLimiter(100000)
+    start = time.monotonic()
+    for _ in range(4):
+        limiter.acquire(10000)
+    assert time.monotonic() - start >= 0.25
+    assert limiter.waited >= 0.25
+
+    unlimited = RateLimiter(None)
+    unlimited.acquire(10 ** 12)
+    assert unlimited.waited == 0
+
+
+def test_load_resources():
+    """测试 resources 配置的解析和校验"""
+    throttle, idle = load_resources(None)
+    assert not throttle.limited and not idle
+
+    throttle, idle = load_resources({'read_bytes_per_second': 1048576, 'iops': 0, 'fadvise': True,
+                                     'idle_io_priority': True})
+    assert throttle.limited and idle
+    assert throttle.chunk_size(64 * 1024 * 1024) == 1024 * 1024
+    assert throttle.fadvise == hasattr(os, 'posix_fadvise')
+
+    for bad in ({'iops': -1}, {'read_bytes_per_second': 'fast'}, {'bandwidth': 100}):
+        try:
+            load_resources(bad)
+            assert False, f"无效配置应抛出异常: {bad}"
+        except ValueError:
+            pass
+
+    config = {'source_directory': '/src', 'target_directory': '/dst', 'resources': {'iops': -5}}
+    assert get_run_settings(config) is None
+
+
+def test_throttled_copy_and_hash():
+    """测试复制和哈希按带宽限速，结果与不限速时相同"""
+    print("=== I/O 限速测试 ===\n")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        src = os.path.join(temp_dir, "data.bin")
+        data = os.urandom(3 * 1024 * 1024)
+        with open(src, 'wb') as f:
+            f.write(data)
+
+        throttle = IOThrottle(read_bytes_per_second=8 * 1024 * 1024, fadvise=True)
+        dst = os.path.join(temp_dir, "copy.bin")
+        copy_file(src, dst, throttle=throttle)
+        with open(dst, 'rb') as f:
+            assert f.read() == data
+        copied_wait = throttle.throttled_seconds
+        assert copied_wait > 0
+        print(f"✓ 复制限速等待 {copied_wait:.3f} 秒")
+
+        assert hash_file(src, throttle) == hash_file(src)
+        assert throttle.throttled_seconds > copied_wait
+        print("✓ 限速的哈希结果与不限速时相同")
+
+
+def test_throttled_backup_reports_wait():
+    """测试限速的压缩备份在元数据中记录等待时间"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        target_dir = os.path.join(temp_dir, "backup")
+        os.makedirs(source_dir)
+        for index in range(4):
+            with open(os.path.join(source_dir, f"file{index}.bin"), 'wb') as f:
+                f.write(os.urandom(100 * 1024))
+
+        throttle = IOThrottle(read_bytes_per_second=2 * 1024 * 1024, write_bytes_per_second=4 * 1024 * 1024)
+        archive = create_backup(source_dir, target_dir, 'hourly', compress=True, throttle=throttle,
+                                change_detection='content')
+        assert archive
+
+        with zipfile.ZipFile(archive) as zipf:
+            info = json.loads(zipf.read('backup_info.json'))
+            assert zipf.testzip() is None
+        assert info['throttled_seconds'] > 0
+
+
+def test_idle_io_priority():
+    """测试在单独的线程中设置 idle I/O 优先级并恢复（不支持的平台返回 None，不抛出异常）"""
+    results = []
+
+    def set_and_restore():
+        previous = set_idle_io_priority()
+        results.append(previous)
+        if previous is not None:
+            results.append(_ioprio_syscall(True) >> IOPRIO_CLASS_SHIFT)
+            results.append(restore_io_priority(previous))
+
+    thread = threading.Thread(target=set_and_restore)
+    thread.start()
+    thread.join()
+    assert results
+    if results[0] is not None:
+        assert results[1:] == [IOPRIO_CLASS_IDLE, True]
+
+
+def test_run_restores_io_priority():
+    """测试 run_backups 结束后恢复调用线程的 I/O 优先级，复用该线程的后续任务不再是 idle"""
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        os.makedirs(source_dir)
+        with open(os.path.join(source_dir, "file.txt"), 'w', encoding='utf-8') as f:
+            f.write("内容\n")
+        config = {'source_directory': source_dir, 'target_directory': os.path.join(temp_dir, "backup"),
+                  'resources': {'idle_io_priority': True}}
+        settings = get_run_settings(config)
+
+        def run():
+            before = _ioprio_syscall(True)
+            created = run_backups(config, settings, {'hourly': True, 'daily': False, 'weekly': False})
+            results.append((before, created, _ioprio_syscall(True)))
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        settings['reaper'].wait()
+
+    before, created, after = results[0]
+    assert created == ['hourly']
+    if before is not None:
+        assert after >> IOPRIO_CLASS_SHIFT != IOPRIO_CLASS_IDLE
+
+
+if __name__ == "__main__":
+    test_rate_limiter_accounts_waiting()
+    test_load_resources()
+    test_throttled_copy_and_hash()
+    test_throttled_backup_reports_wait()
+    test_idle_io_priority()
+    test_run_restores_io_priority()
+
+    print("=== 测试完成 ===")
@@ -10,14 +10,8 @@ import os
 # 添加src目录到Python路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from core.tier_backup import main
+from core.cli import main
 
 if __name__ == '__main__':
-    # 默认配置文件路径
-    config_file = os.path.join('config', 'back_config.json')
-    
-    # 如果命令行提供了配置文件路径，则使用提供的路径
-    if len(sys.argv) > 1:
-        config_file = sys.argv[1]
-    
-    main(config_file) 
\ No newline at end of file
+    # 用法: tier_backup.py [配置文件] 或 tier_backup.py <子命令> [配置文件]
+    sys.exit(main())